@@ -1,12 +1,45 @@
+import hmac
+import json
+import mimetypes
 import os
-from werkzeug.utils import secure_filename
-from flask import Flask, abort, jsonify, render_template, redirect, send_from_directory, url_for, request, flash
+import re
+import signal
+import uuid
+import click
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
+from flask import Flask, abort, get_template_attribute, jsonify, render_template, redirect, send_file, send_from_directory, stream_with_context, url_for, request, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from config import Config
 from extensions import db, login_manager, bcrypt
-from models import User, Pump, Part, DiePatternItem, OtherItem, TestingWorkflow, Role
-from utils.validators import is_valid_ddmmyyyy
-from datetime import datetime
+from models import User, Pump, Part, DiePatternItem, OtherItem, TestingWorkflow, Role, Job
+from utils.validators import is_valid_ddmmyyyy, parse_ddmmyyyy, format_ddmmyyyy
+from utils.pagination import get_page_size, keyset_page
+from utils.grid import save_grid_changes, save_grid_rows
+from utils.principal import get_principal, invalidate_principal
+from utils.metrics import init_metrics, render_metrics
+from utils.fragments import init_fragment_cache
+from utils.audit import history as change_history, init_audit
+from utils.board import board_page, board_rows
+from utils.passwords import HasherBusy, init_password_hasher, password_hasher
+from utils.throttle import init_login_throttle, login_throttle
+from utils.summary import get_dashboard_summary, rebuild_pump_summary
+from utils.export import iter_export_rows, stream_csv, stream_xlsx, xlsx_available
+from utils.storage import etag_for, is_content_addressed, rebuild_file_refs, store_upload
+from utils.api import ApiError, fetch_children, fetch_pumps, make_etag, parse_fields, parse_include, pump_version
+from utils.thumbnails import VARIANTS as THUMBNAIL_VARIANTS, schedule_thumbnails, thumbnail_path
+from utils.events import EventBroker, publish
+from utils.search import rebuild_search_index, search_pumps
+from utils.progress import rebuild_pump_progress
+from utils.stages import STAGES, plant_stage_report, pump_stage_report, rebuild_die_stages, stalled_pumps
+from utils.jobs import Worker, enqueue, job_status
+from utils.snapshots import discard_snapshot, load_page, load_snapshot, render_content, store_snapshot
+from utils.workflow import FORM_ACTIONS, WorkflowError, append_actions, rebuild_workflow_stages
+import utils.tasks  # noqa: F401  registers the job handlers
+from sqlalchemy import case, func, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import contains_eager, load_only
+from datetime import date
 from decimal import Decimal, InvalidOperation
 
 
@@ -18,6 +51,23 @@ app.config.from_object(Config)
 db.init_app(app)
 login_manager.init_app(app)
 bcrypt.init_app(app)
+init_metrics(app)
+init_fragment_cache(app)
+init_audit(app)
+init_password_hasher(app)
+init_login_throttle(app)
+
+if app.config['PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'], x_proto=app.config['PROXY_COUNT'])
+
+# Date columns are shown as DD/MM/YYYY everywhere: {{ pump.deadline_date|ddmmyyyy }}
+app.add_template_filter(format_ddmmyyyy, 'ddmmyyyy')
+
+event_broker = EventBroker(
+    poll_seconds=app.config['EVENT_POLL_SECONDS'],
+    retention_hours=app.config['EVENT_RETENTION_HOURS'],
+    logger=app.logger,
+)
 
 def to_decimal(value):
     if value in (None, "", " ","None","null"):
@@ -64,66 +114,100 @@ def can_view_form(form_name):
     return False
 
 
-def parse_deadline_date(date_str):
-    """Parse DD/MM/YYYY date string to datetime object"""
-    if not date_str:
-        return None
-    try:
-        return datetime.strptime(date_str, '%d/%m/%Y')
-    except:
-        return None
-
-
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return get_principal(int(user_id), app.config['PRINCIPAL_CACHE_TTL'], app.config['PRINCIPAL_CHECK_SECONDS'])
+
+
+def deadline_sort_key():
+    """Deadline for ordering; pumps without one sort after every date"""
+    return func.coalesce(Pump.deadline_date, date.max)
+
+
+def get_pump_filters():
+    """Read the pump list/dashboard filters from the query string"""
+    return {
+        'q': request.args.get('q', '').strip(),
+        'type': request.args.get('type', '').strip(),
+        'per_page': get_page_size(
+            request.args.get('per_page'),
+            app.config['PAGE_SIZES'],
+            app.config['DEFAULT_PAGE_SIZE']
+        ),
+    }
+
+
+def filter_pumps(query, filters):
+    """Apply the name search and pump type filters to a Pump query"""
+    if filters['q']:
+        query = query.filter(Pump.name.icontains(filters['q'], autoescape=True))
+    if filters['type']:
+        query = query.filter(Pump.pump_type == filters['type'])
+    return query
 
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get all pumps
-    pumps = Pump.query.all()
-    
-    # Separate by status
-    pending_pumps = []
-    completed_pumps = []
-    
-    for pump in pumps:
-        deadline_date = parse_deadline_date(pump.deadline_date)
-        pump_data = {
-            'id': pump.id,
-            'name': pump.name,
-            'pump_type': pump.pump_type,
-            'status': pump.status,
-            'deadline_date': pump.deadline_date,
-            'deadline_obj': deadline_date,
-            'has_deadline': deadline_date is not None
-        }
-        
-        if pump.status == 'PENDING':
-            pending_pumps.append(pump_data)
-        else:
-            completed_pumps.append(pump_data)
-    
-    # Sort: pumps with deadline first (by date), then pumps without deadline
-    def sort_by_deadline(pumps_list):
-        with_deadline = [p for p in pumps_list if p['has_deadline']]
-        without_deadline = [p for p in pumps_list if not p['has_deadline']]
-        
-        with_deadline.sort(key=lambda x: x['deadline_obj'])
-        
-        return with_deadline + without_deadline
-    
-    pending_pumps = sort_by_deadline(pending_pumps)
-    completed_pumps = sort_by_deadline(completed_pumps)
-    
-    return render_template('dashboard/index.html', 
+    filters = get_pump_filters()
+    base_query = filter_pumps(Pump.query, filters).outerjoin(Pump.progress).options(
+        load_only(Pump.id, Pump.name, Pump.pump_type, Pump.status, Pump.deadline_date,
+                  Pump.version, Pump.created_at),
+        contains_eager(Pump.progress),
+    )
+    sort_keys = [deadline_sort_key(), Pump.id]
+
+    pending_after = request.args.get('pending_after')
+    completed_after = request.args.get('completed_after')
+
+    # Pumps with deadline first (by date), then pumps without deadline
+    pending_pumps, pending_next = keyset_page(
+        base_query.filter(Pump.status == 'PENDING'),
+        sort_keys, pending_after, filters['per_page']
+    )
+    completed_pumps, completed_next = keyset_page(
+        base_query.filter(Pump.status != 'PENDING'),
+        sort_keys, completed_after, filters['per_page']
+    )
+
+    summary = get_dashboard_summary(pump_type=filters['type'])
+
+    if filters['q']:
+        # Name searches can't use the summary table; count them directly
+        counts = dict(
+            filter_pumps(db.session.query(Pump.status, func.count(Pump.id)), filters)
+            .group_by(Pump.status)
+            .all()
+        )
+    else:
+        counts = dict(summary['by_status'])
+    pending_count = counts.pop('PENDING', 0)
+    completed_count = sum(counts.values())
+
+    return render_template('dashboard/index.html',
                           pending_pumps=pending_pumps,
-                          completed_pumps=completed_pumps)
+                          completed_pumps=completed_pumps,
+                          pending_count=pending_count,
+                          completed_count=completed_count,
+                          pending_after=pending_after,
+                          completed_after=completed_after,
+                          pending_next=pending_next,
+                          completed_next=completed_next,
+                          summary=summary,
+                          filters=filters,
+                          page_sizes=app.config['PAGE_SIZES'])
 
 
 
+@app.route('/api/dashboard/summary')
+@login_required
+def dashboard_summary():
+    """Pump counts by status and type, overdue and due-soon pending pumps"""
+    summary = get_dashboard_summary(pump_type=request.args.get('type', '').strip())
+    summary['as_of'] = format_ddmmyyyy(summary['as_of'])
+    return jsonify(summary)
+
+
 @app.route('/')
 def index():
     """Root route - redirect to login if not authenticated, otherwise dashboard"""
@@ -138,9 +222,33 @@ def login():
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
-        user = User.query.filter_by(username=request.form['username']).first()
-        if user and bcrypt.check_password_hash(user.password_hash, request.form['password']):
-            login_user(user)
+        username, password = request.form['username'], request.form['password']
+
+        # Floods are turned away before the user is loaded or anything is hashed
+        retry_after = login_throttle.check(username, request.remote_addr)
+        if retry_after:
+            flash(f"Too many login attempts. Try again in {retry_after} seconds", "danger")
+            return render_template('auth/login.html'), 429, {'Retry-After': str(retry_after)}
+
+        user = User.query.filter_by(username=username).first()
+        try:
+            valid = user is not None and password_hasher.check(user.password_hash, password)
+        except HasherBusy:
+            flash("The server is busy. Please try again in a moment", "danger")
+            return render_template('auth/login.html'), 503, {'Retry-After': '5'}
+
+        if valid:
+            login_throttle.succeeded(username)
+            if password_hasher.needs_rehash(user.password_hash):
+                # Work factor changed: store a new hash while the password is at hand
+                try:
+                    user.password_hash = password_hasher.hash(password)
+                    db.session.commit()
+                except HasherBusy:
+                    pass  # next login tries again
+            # Fresh login always rebuilds the cached roles
+            invalidate_principal(user.id)
+            login_user(get_principal(user.id, app.config['PRINCIPAL_CACHE_TTL'], app.config['PRINCIPAL_CHECK_SECONDS']))
             return redirect(url_for('dashboard'))
         flash("Invalid username or password", "danger")
 
@@ -150,38 +258,125 @@ def login():
 @app.route('/pumps')
 @login_required
 def pump_list():
-    # Filter pumps based on user role
-    if current_user.has_any_role('BOSS', 'ADMIN'):
-        all_pumps = Pump.query.all()
-    elif current_user.has_role('DIE_INCHARGE'):
-        all_pumps = Pump.query.all()
-    elif current_user.has_role('OTHER_INCHARGE'):
-        all_pumps = Pump.query.all()
+    filters = get_pump_filters()
+    filters['status'] = request.args.get('status', '').strip()
+    after = request.args.get('after')
+
+    # Only known roles can see the pump list
+    if not current_user.has_any_role('BOSS', 'ADMIN', 'DIE_INCHARGE', 'OTHER_INCHARGE'):
+        return render_template('pumps/list.html', pumps=[], next_cursor=None,
+                               after=None, filters=filters,
+                               page_sizes=app.config['PAGE_SIZES'])
+
+    # Progress comes from the pump_progress summary row in the same query
+    query = filter_pumps(Pump.query, filters).outerjoin(Pump.progress).options(contains_eager(Pump.progress))
+    if filters['status'] in ('PENDING', 'COMPLETED'):
+        query = query.filter(Pump.status == filters['status'])
     else:
-        all_pumps = []
-    
-    # Separate by status
-    pending_pumps = [p for p in all_pumps if p.status == 'PENDING']
-    completed_pumps = [p for p in all_pumps if p.status == 'COMPLETED']
-    
-    # Sort function: pumps with deadline first (by date), then without deadline
-    def sort_by_deadline(pump_list):
-        with_deadline = [p for p in pump_list if p.deadline_date]
-        without_deadline = [p for p in pump_list if not p.deadline_date]
-        
-        # Sort by deadline date (parse DD/MM/YYYY)
-        with_deadline.sort(key=lambda p: parse_deadline_date(p.deadline_date))
-        
-        return with_deadline + without_deadline
-    
-    # Sort both groups
-    pending_pumps = sort_by_deadline(pending_pumps)
-    completed_pumps = sort_by_deadline(completed_pumps)
-    
-    # Combine: pending first, then completed
-    pumps = pending_pumps + completed_pumps
-    
-    return render_template('pumps/list.html', pumps=pumps)
+        query = query.filter(Pump.status.in_(['PENDING', 'COMPLETED']))
+
+    # Pending first, then completed; within each, deadline first (by date),
+    # then pumps without deadline
+    status_rank = case((Pump.status == 'PENDING', 0), else_=1)
+    pumps, next_cursor = keyset_page(
+        query,
+        [status_rank, deadline_sort_key(), Pump.id],
+        after,
+        filters['per_page']
+    )
+
+    return render_template('pumps/list.html',
+                           pumps=pumps,
+                           next_cursor=next_cursor,
+                           after=after,
+                           filters=filters,
+                           page_sizes=app.config['PAGE_SIZES'])
+
+def read_export_request():
+    """
+    Format and filters of an export request; dates stay DD/MM/YYYY strings.
+    Raises ValueError with a message for the client.
+    """
+    export_format = request.values.get('format', 'csv').lower()
+    if export_format not in ('csv', 'xlsx'):
+        raise ValueError('format must be csv or xlsx')
+    if export_format == 'xlsx' and not xlsx_available():
+        raise ValueError('XLSX export needs openpyxl installed')
+
+    filters = {
+        'q': request.values.get('q', '').strip(),
+        'type': request.values.get('type', '').strip(),
+        'status': request.values.get('status', '').strip(),
+        'date_field': request.values.get('date_field', 'created').strip(),
+    }
+    for key in ('from', 'to'):
+        value = request.values.get(key, '').strip()
+        if not is_valid_ddmmyyyy(value):
+            raise ValueError(f'Invalid {key} date. Use DD/MM/YYYY')
+        filters[key] = value
+    return export_format, filters
+
+
+def export_filename(export_format):
+    return f'pumps_{date.today():%Y%m%d}.{export_format}'
+
+
+@app.route('/pumps/export')
+@login_required
+def export_pumps():
+    """
+    Stream every pump with its parts, die items, other items and latest
+    workflow action as CSV (default) or XLSX (?format=xlsx).
+    Filters: status, type, q, and from/to (DD/MM/YYYY) on date_field
+    ('created' or 'deadline').
+    """
+    if not current_user.has_any_role('BOSS', 'ADMIN'):
+        abort(403)
+
+    try:
+        export_format, filters = read_export_request()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    for key in ('from', 'to'):
+        filters[key] = parse_ddmmyyyy(filters[key])
+
+    rows = iter_export_rows(filters)
+    filename = export_filename(export_format)
+    if export_format == 'xlsx':
+        body = stream_xlsx(rows)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        body = stream_csv(rows)
+        mimetype = 'text/csv'
+
+    # stream_with_context keeps the DB session open while the body is sent
+    return app.response_class(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@app.route('/api/exports', methods=['POST'])
+@login_required
+def queue_export():
+    """Build the same export as /pumps/export in the job worker"""
+    if not current_user.has_any_role('BOSS', 'ADMIN'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+
+    try:
+        export_format, filters = read_export_request()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    job_id = enqueue(db.session, 'export_pumps', {
+        'format': export_format,
+        'filters': filters,
+        'filename': export_filename(export_format),
+    }, created_by=current_user.id)
+    db.session.commit()
+    return job_accepted(job_id)
+
 
 @app.route('/pumps/add', methods=['GET','POST'])
 @login_required
@@ -208,13 +403,11 @@ def add_pump():
             flash('Invalid deadline date format. Use DD/MM/YYYY', 'danger')
             return redirect(url_for('add_pump'))
         
-        # Handle file upload
+        # Handle file upload (stored by content hash, see utils/storage.py)
         file = request.files.get('drawing')
-        filename = None
+        drawing_path = drawing_name = None
         if file and file.filename:
-            filename = secure_filename(file.filename)
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(save_path)
+            drawing_path, drawing_name = store_upload(file, app.config['UPLOAD_FOLDER'], db.session)
 
         pump = Pump(
             name=name,
@@ -225,8 +418,9 @@ def add_pump():
             stamping=stamping,
             stamping_grade=stamping_grade,
             capacitor=capacitor,  # NEW FIELD
-            deadline_date=deadline_date if deadline_date else None,
-            drawing_path=filename,
+            deadline_date=parse_ddmmyyyy(deadline_date),
+            drawing_path=drawing_path,
+            drawing_name=drawing_name,
             status='PENDING',
             created_by=current_user.id
         )
@@ -244,6 +438,7 @@ def add_pump():
 
         db.session.add(pump)
         db.session.commit()
+        queue_thumbnails(pump.drawing_path)
 
         flash('Pump created successfully', 'success')
         return redirect(url_for('pump_list'))
@@ -261,6 +456,11 @@ def pump_info(pump_id):
         flash('Access denied', 'danger')
         return redirect(url_for('pump_list'))
     
+    if request.method == 'GET':
+        frozen = load_page(db.session, pump_id, 'info')
+        if frozen is not None:
+            return render_template('snapshots/page.html', body=frozen, show_flashes=True)
+
     pump = Pump.query.get_or_404(pump_id)
     
     if request.method == 'POST':
@@ -283,7 +483,7 @@ def pump_info(pump_id):
             flash('Invalid deadline date format. Use DD/MM/YYYY', 'danger')
             return redirect(url_for('pump_info', pump_id=pump_id))
         
-        pump.deadline_date = deadline_date if deadline_date else None
+        pump.deadline_date = parse_ddmmyyyy(deadline_date)
         
         # === GAUGE FIELDS: Update only relevant ones ===
         if phase in ['1', '2']:
@@ -307,19 +507,14 @@ def pump_info(pump_id):
             pump.s_gauge_weight = None
 
         # === FILE UPLOAD ===
+        # The old drawing is deleted after commit once no pump references it
         file = request.files.get('drawing')
         if file and file.filename:
-            if pump.drawing_path:
-                old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], pump.drawing_path)
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
-            
-            filename = secure_filename(file.filename)
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(save_path)
-            pump.drawing_path = filename
+            pump.drawing_path, pump.drawing_name = store_upload(file, app.config['UPLOAD_FOLDER'], db.session)
         
         db.session.commit()
+        if file and file.filename:
+            queue_thumbnails(pump.drawing_path)
         flash('Pump info updated successfully', 'success')
         return redirect(url_for('pump_info', pump_id=pump_id))
 
@@ -339,15 +534,17 @@ def add_parts(pump_id):
         flash('Access denied', 'danger')
         return redirect(url_for('pump_list'))
     
+    frozen = load_page(db.session, pump_id, 'parts')
+    if frozen is not None:
+        return render_template('snapshots/page.html', body=frozen)
+
     pump = Pump.query.get_or_404(pump_id)
     read_only = pump.status != 'PENDING'
     
     return render_template('pumps/add_parts.html', pump=pump, read_only=read_only)
 
 
-@app.route('/api/pumps/<int:pump_id>/parts', methods=['GET'])
-@login_required
-def get_parts(pump_id):
+def parts_payload(pump_id):
     parts = Part.query.filter_by(pump_id=pump_id).all()
     parts_data = []
     for part in parts:
@@ -360,7 +557,30 @@ def get_parts(pump_id):
             'brand': part.brand,
             'material': part.material
         })
-    return jsonify({'parts': parts_data})
+    return {'parts': parts_data}
+
+
+@app.route('/api/pumps/<int:pump_id>/parts', methods=['GET'])
+@login_required
+def get_parts(pump_id):
+    # An approved pump's parts come from its snapshot, version included
+    frozen = load_snapshot(db.session, pump_id, 'parts.json')
+    version = frozen[1] if frozen else pump_version(pump_id)
+    etag = make_etag('get_parts', pump_id, version)
+    if version is not None and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    if frozen:
+        response = app.response_class(frozen[0], mimetype='application/json')
+    else:
+        response = jsonify(parts_payload(pump_id))
+    if version is not None:
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/api/pumps/<int:pump_id>/parts/save', methods=['POST'])
@@ -438,8 +658,245 @@ def delete_part(pump_id, part_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+IMPORT_EXTENSIONS = ('.csv', '.xlsx')
+
+
+@app.route('/api/parts/import', methods=['POST'])
+@login_required
+def import_parts_file():
+    """
+    Bulk-add parts from an uploaded CSV/XLSX file in the job worker. With a
+    pump_id form field every row goes to that pump; otherwise rows name
+    their pump in a pump_id or pump_name column.
+    """
+    if not current_user.has_any_role('BOSS', 'ADMIN'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+
+    pump_id = request.form.get('pump_id', type=int)
+    if pump_id is not None:
+        pump = Pump.query.get_or_404(pump_id)
+        if pump.status != 'PENDING':
+            return jsonify({'success': False, 'error': 'Cannot edit parts in current pump status'}), 403
+
+    extension = os.path.splitext(file.filename)[1].lower()
+    if extension not in IMPORT_EXTENSIONS:
+        return jsonify({'success': False, 'error': 'Upload a .csv or .xlsx file'}), 400
+
+    # The worker reads the file from disk and removes it when done
+    folder = app.config['IMPORT_UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'{uuid.uuid4().hex}{extension}')
+    file.save(path)
+
+    # Retrying is safe: a failed import commits none of its rows
+    job_id = enqueue(db.session, 'import_parts', {
+        'path': path,
+        'filename': file.filename,
+        'pump_id': pump_id,
+    }, created_by=current_user.id)
+    db.session.commit()
+    return job_accepted(job_id)
+
+
+@app.route('/api/parts/import/<token>/report')
+@login_required
+def import_parts_report(token):
+    """Download the rejected rows of an earlier import as CSV"""
+    if not current_user.has_any_role('BOSS', 'ADMIN'):
+        abort(403)
+    if not re.fullmatch(r'[0-9a-f]{32}', token):
+        abort(404)
+    return send_from_directory(app.config['IMPORT_REPORT_FOLDER'], f'{token}.csv',
+                               mimetype='text/csv', as_attachment=True,
+                               download_name=f'parts_import_rejected_{token[:8]}.csv')
+
+
+# ==================== SEARCH ====================
+
+def searchable_fields():
+    """Index fields the current user may search, matching what their pages show"""
+    if current_user.has_any_role('BOSS', 'ADMIN'):
+        return {'name', 'part', 'brand', 'material', 'supplier', 'spec',
+                'die_remark', 'other_remark', 'workflow_remark'}
+    fields = set()
+    if can_view_form('die'):
+        fields |= {'name', 'part', 'die_remark'}
+    if can_view_form('other'):
+        fields |= {'name', 'part', 'supplier', 'spec', 'other_remark'}
+    return fields
+
+
+def run_search():
+    q = request.args.get('q', '').strip()
+    per_page = get_page_size(request.args.get('per_page'), app.config['PAGE_SIZES'],
+                             app.config['PAGE_SIZES'][0])
+    after = request.args.get('after')
+    results, next_cursor = search_pumps(db.session, q, searchable_fields(), after=after, limit=per_page)
+    return q, per_page, after, results, next_cursor
+
+
+@app.route('/search')
+@login_required
+def search():
+    """Pumps whose name, parts, suppliers or remarks match ?q=, best first"""
+    q, per_page, after, results, next_cursor = run_search()
+    return render_template('search/results.html', q=q, per_page=per_page, after=after,
+                           results=results, next_cursor=next_cursor)
+
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    """JSON version of /search; page on with ?after=<next_cursor>"""
+    q, per_page, after, results, next_cursor = run_search()
+    for result in results:
+        result['deadline_date'] = format_ddmmyyyy(result['deadline_date'])
+        result['url'] = url_for('pump_management', pump_id=result['id'])
+    return jsonify({'q': q, 'results': results, 'next_cursor': next_cursor})
+
+
+# ==================== READ API (v1) ====================
+
+API_RESOURCE_URLS = {
+    'parts': 'parts',
+    'die-items': 'die_items',
+    'other-items': 'other_items',
+    'workflow': 'workflow',
+}
+
+
+def can_read_resource(resource):
+    """Same visibility as the HTML forms for each kind of row"""
+    if resource == 'die_items':
+        return can_view_form('die')
+    if resource == 'other_items':
+        return can_view_form('other')
+    if resource == 'workflow':
+        return current_user.has_any_role('BOSS', 'ADMIN')
+    return current_user.has_any_role('BOSS', 'ADMIN', 'DIE_INCHARGE', 'OTHER_INCHARGE')
+
+
+def conditional_json(etag, build_payload):
+    """304 when the client already has etag, otherwise the JSON payload"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/api/v1/pumps')
+@login_required
+def api_pumps():
+    """Pumps ordered by id; ?after=<last id>&per_page=&status=&type=&fields="""
+    if not can_read_resource('pump'):
+        abort(403)
+    try:
+        fields = parse_fields('pump', request.args.get('fields'))
+    except ApiError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    per_page = get_page_size(request.args.get('per_page'), app.config['PAGE_SIZES'],
+                             app.config['DEFAULT_PAGE_SIZE'])
+    where = []
+    after = request.args.get('after', type=int)
+    if after:
+        where.append(Pump.id > after)
+    if request.args.get('status'):
+        where.append(Pump.status == request.args['status'])
+    if request.args.get('type'):
+        where.append(Pump.pump_type == request.args['type'])
+
+    pumps = fetch_pumps(where, fields, per_page + 1)
+    next_after = pumps[per_page - 1]['id'] if len(pumps) > per_page else None
+    payload = {'pumps': pumps[:per_page], 'next_after': next_after}
+    return conditional_json(make_etag(json.dumps(payload, sort_keys=True)), lambda: payload)
+
+
+@app.route('/api/v1/pumps/<int:pump_id>')
+@login_required
+def api_pump(pump_id):
+    """
+    One pump; ?include=parts,die_items,other_items,workflow embeds its rows.
+    ?fields= selects pump fields, ?fields[parts]= etc. the embedded ones.
+    """
+    try:
+        fields = parse_fields('pump', request.args.get('fields'))
+        include = parse_include(request.args.get('include'))
+        child_fields = {name: parse_fields(name, request.args.get(f'fields[{name}]'))
+                        for name in include}
+    except ApiError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    for resource in ['pump'] + include:
+        if not can_read_resource(resource):
+            abort(403)
+
+    version = pump_version(pump_id)
+    if version is None:
+        abort(404)
+
+    def build_payload():
+        pump = fetch_pumps([Pump.id == pump_id], fields, 1)[0]
+        for name in include:
+            pump[name] = fetch_children(name, pump_id, child_fields[name])
+        return {'pump': pump}
+
+    etag = make_etag('pump', pump_id, version, fields, sorted(child_fields.items()))
+    return conditional_json(etag, build_payload)
+
+
+@app.route('/api/v1/pumps/<int:pump_id>/<resource_url>')
+@login_required
+def api_pump_rows(pump_id, resource_url):
+    """Parts, die-items, other-items or workflow rows of one pump; ?fields="""
+    resource = API_RESOURCE_URLS.get(resource_url)
+    if resource is None:
+        abort(404)
+    if not can_read_resource(resource):
+        abort(403)
+    try:
+        fields = parse_fields(resource, request.args.get('fields'))
+    except ApiError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    version = pump_version(pump_id)
+    if version is None:
+        abort(404)
+
+    etag = make_etag(resource, pump_id, version, fields)
+    return conditional_json(etag, lambda: {resource: fetch_children(resource, pump_id, fields)})
+
+
 # ==================== DIE & PATTERN ROUTES ====================
 
+def die_item_values(row):
+    """Column values for one submitted die & pattern grid row"""
+    return {
+        'pattern_cavity': row.get('pattern_cavity') or None,
+        'item_weight': to_decimal(row.get('item_weight')),
+        'making_pattern_date': parse_ddmmyyyy(row.get('making_pattern_date')),
+        'complete_pattern_date': parse_ddmmyyyy(row.get('complete_pattern_date')),
+        'send_foundry_pattern_date': parse_ddmmyyyy(row.get('send_foundry_pattern_date')),
+        'casting_date': parse_ddmmyyyy(row.get('casting_date')),
+        'drawing_date': parse_ddmmyyyy(row.get('drawing_date')),
+        'casting_mc_date': parse_ddmmyyyy(row.get('casting_mc_date')),
+        'mc_received_date': parse_ddmmyyyy(row.get('mc_received_date')),
+        'mc_sample_rate': to_decimal(row.get('mc_sample_rate')),
+        'mc_qty_rate': to_decimal(row.get('mc_qty_rate')),
+        'remark': row.get('remark') or None,
+        'status': row.get('status') or 'PENDING',
+    }
+
+
 @app.route('/pumps/<int:pump_id>/die-pattern', methods=['GET'])
 @login_required
 def die_pattern_form(pump_id):
@@ -447,6 +904,10 @@ def die_pattern_form(pump_id):
         flash('Access denied', 'danger')
         return redirect(url_for('pump_list'))
     
+    frozen = load_page(db.session, pump_id, 'die')
+    if frozen is not None:
+        return render_template('snapshots/page.html', body=frozen)
+
     pump = Pump.query.get_or_404(pump_id)
 
     versil_parts = Part.query.filter_by(
@@ -483,7 +944,13 @@ def save_die_pattern(pump_id):
     if pump.status != 'PENDING':
         return jsonify({'success': False, 'message': 'Cannot edit pump in current status'}), 403
 
-    rows = request.json.get('rows', [])
+    payload = request.json or {}
+    # Delta saves send {'changes': {added, changed, removed}}; full saves send {'rows': [...]}
+    changes = payload.get('changes')
+    if changes is None:
+        rows = payload.get('rows', [])
+    else:
+        rows = (changes.get('added') or []) + (changes.get('changed') or [])
 
     # Validate dates FIRST
     DATE_FIELDS = [
@@ -505,57 +972,126 @@ def save_die_pattern(pump_id):
                     'message': f'Invalid date format for {field}. Use DD/MM/YYYY'
                 }), 400
 
-    # Get existing items for this pump
-    existing_items = DiePatternItem.query.filter_by(pump_id=pump.id).all()
-    processed_ids = []
+    if changes is not None:
+        result = save_grid_changes(DiePatternItem, pump.id, changes, die_item_values)
+        if result['added'] or result['changed'] or result['removed']:
+            publish_event('grid.saved', pump_id, grid='die')
+        message = 'Die & Pattern saved successfully'
+        if result['conflicts']:
+            message = f"{len(result['conflicts'])} row(s) were not saved; reload to see the latest values"
+        return jsonify({'success': True, 'message': message, **result})
 
-    for row in rows:
-        part_id = row.get('part_id')
-        if not part_id:
-            continue
+    save_grid_rows(DiePatternItem, pump.id, rows, die_item_values)
+    publish_event('grid.saved', pump_id, grid='die')
 
-        item = DiePatternItem.query.filter_by(
-            pump_id=pump.id,
-            part_id=part_id
-        ).first()
+    return jsonify({'success': True, 'message': 'Die & Pattern saved successfully'})
 
-        if not item:
-            item = DiePatternItem(
-                pump_id=pump.id,
-                part_id=part_id
-            )
 
-        # Field mapping
-        item.pattern_cavity = row.get('pattern_cavity') or None
-        item.item_weight = to_decimal(row.get('item_weight'))
-        item.making_pattern_date = row.get('making_pattern_date') or None
-        item.complete_pattern_date = row.get('complete_pattern_date') or None
-        item.send_foundry_pattern_date = row.get('send_foundry_pattern_date') or None
-        item.casting_date = row.get('casting_date') or None
-        item.drawing_date = row.get('drawing_date') or None
-        item.casting_mc_date = row.get('casting_mc_date') or None
-        item.mc_received_date = row.get('mc_received_date') or None
-        item.mc_sample_rate = to_decimal(row.get('mc_sample_rate'))
-        item.mc_qty_rate = to_decimal(row.get('mc_qty_rate'))
-        item.remark = row.get('remark') or None
-        item.status = row.get('status') or 'PENDING'
-
-        db.session.add(item)
-        if item.id:
-            processed_ids.append(item.id)
-
-    # Delete items that were removed from the form
-    for existing_item in existing_items:
-        if existing_item.id not in processed_ids:
-            db.session.delete(existing_item)
+# ==================== DIE & PATTERN STAGE TIMES ====================
 
-    db.session.commit()
+def die_stage_report():
+    """Plant-wide stage figures plus one pump (?pump_id=) or the most stalled pumps"""
+    pump_id = request.args.get('pump_id', type=int)
+    pump_ids = [pump_id] if pump_id else stalled_pumps(db.session)
+    per_pump = pump_stage_report(db.session, pump_ids)
+    names = dict(db.session.query(Pump.id, Pump.name).filter(Pump.id.in_(pump_ids)).all()) if pump_ids else {}
+    pumps = [
+        {'id': pid, 'name': names[pid], **per_pump[pid]}
+        for pid in pump_ids if pid in names
+    ]
+    return {'plant': plant_stage_report(db.session), 'pumps': pumps, 'pump_id': pump_id}
 
-    return jsonify({'success': True, 'message': 'Die & Pattern saved successfully'})
+
+@app.route('/analytics/die-stages')
+@login_required
+def die_stages():
+    """Where die & pattern items spend their time, and where they are stuck"""
+    if not can_view_form('die'):
+        abort(403)
+    return render_template('die_pattern/stages.html', stages=STAGES, **die_stage_report())
+
+
+@app.route('/api/analytics/die-stages')
+@login_required
+def api_die_stages():
+    if not can_view_form('die'):
+        abort(403)
+    return jsonify(die_stage_report())
+
+
+# ==================== MANUFACTURING BOARD ====================
+
+def board_columns():
+    """Board columns the current user may see, as for the forms they link to"""
+    return {
+        'die': can_view_form('die'),
+        'other': can_view_form('other'),
+        'workflow': current_user.has_any_role('BOSS', 'ADMIN'),
+    }
+
+
+def render_board_rows(rows):
+    board_row = get_template_attribute('manufacturing/_row.html', 'board_row')
+    columns, today = board_columns(), date.today()
+    return ''.join(board_row(row, columns, today) for row in rows)
+
+
+@app.route('/manufacturing')
+@login_required
+def manufacturing_board():
+    """Every pending pump with its die & pattern, other items and workflow progress"""
+    if not current_user.has_any_role('BOSS', 'ADMIN', 'DIE_INCHARGE', 'OTHER_INCHARGE'):
+        abort(403)
+    per_page = get_page_size(request.args.get('per_page'), app.config['PAGE_SIZES'],
+                             app.config['DEFAULT_PAGE_SIZE'])
+    rows, next_cursor = board_page(db.session, request.args.get('after'), per_page)
+    return render_template(
+        'manufacturing/index.html', rows=rows, next_cursor=next_cursor, per_page=per_page,
+        columns=board_columns(), today=date.today(),
+    )
+
+
+@app.route('/api/manufacturing/rows')
+@login_required
+def manufacturing_rows():
+    """
+    Rendered board rows: the page after ?after=, or the pumps in ?ids=1,2,3
+    (pumps that are no longer pending are left out, so the page drops them)
+    """
+    if not current_user.has_any_role('BOSS', 'ADMIN', 'DIE_INCHARGE', 'OTHER_INCHARGE'):
+        abort(403)
+    ids = request.args.get('ids')
+    if ids is not None:
+        pump_ids = [int(pid) for pid in ids.split(',') if pid.strip().isdigit()][:200]
+        return jsonify({'html': render_board_rows(board_rows(db.session, pump_ids))})
+
+    per_page = get_page_size(request.args.get('per_page'), app.config['PAGE_SIZES'],
+                             app.config['DEFAULT_PAGE_SIZE'])
+    rows, next_cursor = board_page(db.session, request.args.get('after'), per_page)
+    return jsonify({'html': render_board_rows(rows), 'next_cursor': next_cursor})
 
 
 # ==================== OTHER ITEMS ROUTES ====================
 
+def other_item_values(row):
+    """Column values for one submitted other items grid row"""
+    return {
+        'material_specification': row.get('material_specification') or None,
+        'item_weight': to_decimal(row.get('item_weight')),
+        'drawing_date': parse_ddmmyyyy(row.get('drawing_date')),
+        'send_party_drawing_date': parse_ddmmyyyy(row.get('send_party_drawing_date')),
+        'party_name': row.get('party_name') or None,
+        'party_received_date': parse_ddmmyyyy(row.get('party_received_date')),
+        'inward_date': parse_ddmmyyyy(row.get('inward_date')),
+        'sample_price': to_decimal(row.get('sample_price')),
+        'qty_price': to_decimal(row.get('qty_price')),
+        'qc_date': parse_ddmmyyyy(row.get('qc_date')),
+        'qc_status': row.get('qc_status') or None,
+        'remark': row.get('remark') or None,
+        'status': row.get('status') or 'PENDING',
+    }
+
+
 @app.route('/pumps/<int:pump_id>/other-items', methods=['GET'])
 @login_required
 def other_items_form(pump_id):
@@ -563,6 +1099,10 @@ def other_items_form(pump_id):
         flash('Access denied', 'danger')
         return redirect(url_for('pump_list'))
     
+    frozen = load_page(db.session, pump_id, 'other')
+    if frozen is not None:
+        return render_template('snapshots/page.html', body=frozen)
+
     pump = Pump.query.get_or_404(pump_id)
 
     versil_parts = Part.query.filter_by(
@@ -599,7 +1139,13 @@ def save_other_items(pump_id):
     if not can_edit_form('other'):
         return jsonify({'success': False, 'message': 'Access denied'}), 403
 
-    rows = request.json.get('rows', [])
+    payload = request.json or {}
+    # Delta saves send {'changes': {added, changed, removed}}; full saves send {'rows': [...]}
+    changes = payload.get('changes')
+    if changes is None:
+        rows = payload.get('rows', [])
+    else:
+        rows = (changes.get('added') or []) + (changes.get('changed') or [])
 
     # Validate dates FIRST
     DATE_FIELDS = [
@@ -619,51 +1165,17 @@ def save_other_items(pump_id):
                     'message': f'Invalid date format for {field}. Use DD/MM/YYYY'
                 }), 400
 
-    # Get existing items for this pump
-    existing_items = OtherItem.query.filter_by(pump_id=pump.id).all()
-    processed_ids = []
+    if changes is not None:
+        result = save_grid_changes(OtherItem, pump.id, changes, other_item_values)
+        if result['added'] or result['changed'] or result['removed']:
+            publish_event('grid.saved', pump_id, grid='other')
+        message = 'Other items saved successfully'
+        if result['conflicts']:
+            message = f"{len(result['conflicts'])} row(s) were not saved; reload to see the latest values"
+        return jsonify({'success': True, 'message': message, **result})
 
-    for row in rows:
-        part_id = row.get('part_id')
-        if not part_id:
-            continue
-
-        item = OtherItem.query.filter_by(
-            pump_id=pump.id,
-            part_id=part_id
-        ).first()
-
-        if not item:
-            item = OtherItem(
-                pump_id=pump.id,
-                part_id=part_id
-            )
-
-        # Field mapping
-        item.material_specification = row.get('material_specification') or None
-        item.item_weight = to_decimal(row.get('item_weight'))
-        item.drawing_date = row.get('drawing_date') or None
-        item.send_party_drawing_date = row.get('send_party_drawing_date') or None
-        item.party_name = row.get('party_name') or None
-        item.party_received_date = row.get('party_received_date') or None
-        item.inward_date = row.get('inward_date') or None
-        item.sample_price = to_decimal(row.get('sample_price'))
-        item.qty_price = to_decimal(row.get('qty_price'))
-        item.qc_date = row.get('qc_date') or None
-        item.qc_status = row.get('qc_status') or None
-        item.remark = row.get('remark') or None
-        item.status = row.get('status') or 'PENDING'
-
-        db.session.add(item)
-        if item.id:
-            processed_ids.append(item.id)
-
-    # Delete items that were removed from the form
-    for existing_item in existing_items:
-        if existing_item.id not in processed_ids:
-            db.session.delete(existing_item)
-
-    db.session.commit()
+    save_grid_rows(OtherItem, pump.id, rows, other_item_values)
+    publish_event('grid.saved', pump_id, grid='other')
 
     return jsonify({'success': True, 'message': 'Other items saved successfully'})
 
@@ -679,6 +1191,10 @@ def workflow_form(pump_id):
         flash('Access denied', 'danger')
         return redirect(url_for('pump_list'))
 
+    # Only the boss gets the reject button
+    frozen = load_page(db.session, pump_id, 'workflow_boss' if current_user.has_role('BOSS') else 'workflow')
+    if frozen is not None:
+        return render_template('snapshots/page.html', body=frozen)
 
     pump = Pump.query.get_or_404(pump_id)
     
@@ -687,8 +1203,7 @@ def workflow_form(pump_id):
     ).order_by(TestingWorkflow.created_at.asc()).all()
     
     # Get today's date in DD/MM/YYYY format
-    today = datetime.now()
-    today_date = today.strftime('%d/%m/%Y')
+    today_date = format_ddmmyyyy(date.today())
 
     # Only editable when status is PENDING and user is BOSS/ADMIN
     can_edit = current_user.has_any_role('BOSS', 'ADMIN') and pump.status == 'PENDING'
@@ -711,16 +1226,13 @@ def workflow_form(pump_id):
 def save_workflow(pump_id):
     pump = Pump.query.get_or_404(pump_id)
     
-    if pump.status != 'PENDING':
-        return jsonify({'success': False, 'message': 'Invalid pump status'}), 403
-    
     if not current_user.has_any_role('BOSS', 'ADMIN'):
         return jsonify({'success': False, 'message': 'Access denied'}), 403
     
     data = request.json
     rows = data.get('rows', [])
     
-    # Validate dates
+    # Validate dates and actions
     for row in rows:
         date_str = row.get('date')
         if date_str and not is_valid_ddmmyyyy(date_str):
@@ -728,39 +1240,21 @@ def save_workflow(pump_id):
                 'success': False,
                 'message': f'Invalid date format: {date_str}. Use DD/MM/YYYY'
             }), 400
+        if row.get('action') not in FORM_ACTIONS:
+            return jsonify({'success': False, 'message': f"Invalid action: {row.get('action')}"}), 400
     
-    # Get existing activities count
-    existing_count = TestingWorkflow.query.filter_by(pump_id=pump.id).count()
-    
-    # Validate action sequence
-    for idx, row in enumerate(rows):
-        action = row.get('action')
-        position = existing_count + idx
-        
-        if position == 0 and action != 'Assembly':
-            return jsonify({
-                'success': False,
-                'message': 'First action must be Assembly'
-            }), 400
-        
-        if position == 1 and action != 'Testing':
-            return jsonify({
-                'success': False,
-                'message': 'Second action must be Testing'
-            }), 400
-    
-    # Save new activities
-    for row in rows:
-        activity = TestingWorkflow(
-            pump_id=pump.id,
-            date=row.get('date'),
-            user_id=current_user.id,
-            action=row.get('action'),
-            remark=row.get('remark')
-        )
-        db.session.add(activity)
+    # The pump's workflow stage decides which actions may follow
+    try:
+        append_actions(db.session, pump, [
+            {'action': row['action'], 'date': parse_ddmmyyyy(row.get('date')), 'remark': row.get('remark')}
+            for row in rows
+        ], current_user.id)
+    except WorkflowError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': e.message}), e.status
     
     db.session.commit()
+    publish_event('workflow.saved', pump_id, count=len(rows))
     
     return jsonify({'success': True, 'message': 'Workflow saved successfully'})
 
@@ -776,12 +1270,6 @@ def final_approve_workflow(pump_id):
 
         pump = Pump.query.get_or_404(pump_id)
 
-        if pump.status != 'PENDING':
-            return jsonify({
-                'success': False,
-                'message': 'Pump is not in pending state.'
-            }), 400
-
         data = request.get_json(silent=True) or {}
         comment = data.get('comment', '').strip()
 
@@ -791,18 +1279,17 @@ def final_approve_workflow(pump_id):
                 'message': 'Approval comment is required.'
             }), 400
 
-        pump.status = 'COMPLETED'
-
-        approval_entry = TestingWorkflow(
-            pump_id=pump.id,
-            date=datetime.now().strftime('%d/%m/%Y'),
-            user_id=current_user.id,
-            action='Final Approved',
-            remark=comment
-        )
+        try:
+            pump = append_actions(db.session, pump, [
+                {'action': 'Final Approved', 'date': date.today(), 'remark': comment}
+            ], current_user.id)
+        except WorkflowError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': e.message}), e.status
 
-        db.session.add(approval_entry)
+        freeze_pump(pump)
         db.session.commit()
+        publish_event('pump.status', pump.id, name=pump.name, pump_type=pump.pump_type, status=pump.status)
 
         return jsonify({
             'success': True,
@@ -826,28 +1313,23 @@ def reject_workflow(pump_id):
         
         pump = Pump.query.get_or_404(pump_id)
         
-        if pump.status != 'COMPLETED':
-            return jsonify({'success': False, 'message': 'Can only reject approved pumps'}), 400
-        
         data = request.get_json(silent=True) or {}
         comment = data.get('comment', '').strip()
         
         if not comment:
             return jsonify({'success': False, 'message': 'Comment is required'}), 400
         
-        pump.status = 'PENDING'
-        
-        today = datetime.now()
-        rejection_entry = TestingWorkflow(
-            pump_id=pump.id,
-            date=today.strftime('%d/%m/%Y'),
-            user_id=current_user.id,
-            action='Rejected by Boss',
-            remark=comment
-        )
-        db.session.add(rejection_entry)
+        try:
+            pump = append_actions(db.session, pump, [
+                {'action': 'Rejected by Boss', 'date': date.today(), 'remark': comment}
+            ], current_user.id)
+        except WorkflowError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': e.message}), e.status
         
+        discard_snapshot(db.session, pump.id)
         db.session.commit()
+        publish_event('pump.status', pump.id, name=pump.name, pump_type=pump.pump_type, status=pump.status)
         
         return jsonify({'success': True, 'message': 'Pump rejected and sent back for revision'})
     
@@ -858,6 +1340,214 @@ def reject_workflow(pump_id):
             'message': f'Error: {str(e)}'
         }), 500
 
+# ==================== SNAPSHOTS ====================
+
+def snapshot_pages(pump):
+    """Template and context of every read-only page of a COMPLETED pump"""
+    versil_parts = Part.query.filter_by(pump_id=pump.id, source='VERSIL').all()
+    activities = TestingWorkflow.query.filter_by(
+        pump_id=pump.id
+    ).order_by(TestingWorkflow.created_at.asc()).all()
+    workflow = {'pump': pump, 'activities': activities, 'today_date': '', 'read_only': True}
+    return {
+        'info': ('pumps/add.html', {'pump': pump, 'read_only': True}),
+        'parts': ('pumps/add_parts.html', {'pump': pump, 'read_only': True}),
+        'die': ('die_pattern/form.html', {
+            'pump': pump, 'versil_parts': versil_parts, 'read_only': True,
+            'items': DiePatternItem.query.filter_by(pump_id=pump.id).all(),
+        }),
+        'other': ('other_items/form.html', {
+            'pump': pump, 'versil_parts': versil_parts, 'read_only': True,
+            'items': OtherItem.query.filter_by(pump_id=pump.id).all(),
+        }),
+        'workflow': ('workflow/form.html', {**workflow, 'is_boss': False}),
+        'workflow_boss': ('workflow/form.html', {**workflow, 'is_boss': True}),
+    }
+
+
+def freeze_pump(pump):
+    """
+    Store the read-only pages of a just-approved pump (utils/snapshots.py).
+    A failure is logged and leaves the pump without a snapshot; its pages
+    are then rendered live as before.
+    """
+    try:
+        with db.session.begin_nested():
+            pages = {
+                name: render_content(template_name, **context)
+                for name, (template_name, context) in snapshot_pages(pump).items()
+            }
+            pages['parts.json'] = app.json.response(parts_payload(pump.id)).get_data(as_text=True)
+            store_snapshot(db.session, pump.id, pages)
+    except Exception:
+        app.logger.exception('Freezing pump %s failed', pump.id)
+
+
+# ==================== CHANGE HISTORY ====================
+
+def history_entities():
+    """Audit entities the current user may read: die/other rows follow the form rights"""
+    entities = ['pump', 'part']
+    if can_view_form('die'):
+        entities.append('die_item')
+    if can_view_form('other'):
+        entities.append('other_item')
+    return entities
+
+
+def pump_history(pump_id):
+    """One page of a pump's field changes; ?field= narrows it, ?before= pages on"""
+    per_page = get_page_size(request.args.get('per_page'), app.config['PAGE_SIZES'],
+                             app.config['DEFAULT_PAGE_SIZE'])
+    records, next_before = change_history(
+        db.session, pump_id, history_entities(),
+        field=request.args.get('field') or None,
+        before=request.args.get('before', type=int),
+        limit=per_page,
+    )
+    return records, next_before, per_page
+
+
+@app.route('/pumps/<int:pump_id>/history')
+@login_required
+def pump_history_page(pump_id):
+    pump = Pump.query.get_or_404(pump_id)
+    records, next_before, per_page = pump_history(pump_id)
+    return render_template(
+        'pumps/history.html', pump=pump, records=records, next_before=next_before,
+        field=request.args.get('field', ''), per_page=per_page,
+    )
+
+
+@app.route('/api/pumps/<int:pump_id>/history')
+@login_required
+def api_pump_history(pump_id):
+    records, next_before, _ = pump_history(pump_id)
+    for record in records:
+        record['changed_at'] = record['changed_at'].isoformat()
+    return jsonify({'changes': records, 'next_before': next_before})
+
+
+# ==================== LIVE UPDATES ====================
+
+def publish_event(kind, pump_id, **data):
+    """Tell open pages about a committed change (see utils/events.py)"""
+    publish(db.session, kind, pump_id, logger=app.logger, by=current_user.username, **data)
+
+
+@app.route('/events')
+@login_required
+def live_events():
+    """
+    Server-sent events stream of pump changes. ?pump_id= limits it to one
+    pump; grid and workflow events follow the same visibility as their forms.
+    """
+    if not app.config['EVENT_STREAMS']:
+        # Streams are served by the gevent process (gunicorn_events.conf.py)
+        abort(503)
+    pump_id = request.args.get('pump_id', type=int)
+    visible = {
+        'die': can_view_form('die'),
+        'other': can_view_form('other'),
+        'workflow': current_user.has_any_role('BOSS', 'ADMIN'),
+    }
+
+    def allowed(event):
+        if pump_id is not None and event['pump_id'] != pump_id:
+            return False
+        if event['kind'] == 'grid.saved':
+            return visible.get(event.get('grid'), False)
+        if event['kind'] == 'workflow.saved':
+            return visible['workflow']
+        return True
+
+    stream = event_broker.stream(
+        db.engine,
+        last_id=request.headers.get('Last-Event-ID', type=int),
+        allowed=allowed,
+        keepalive=app.config['EVENT_KEEPALIVE_SECONDS'],
+    )
+    response = app.response_class(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ==================== BACKGROUND JOBS ====================
+
+def job_accepted(job_id):
+    """202 response for a queued job; the page polls status_url"""
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('get_job', job_id=job_id),
+    }), 202
+
+
+def get_own_job(job_id):
+    """Jobs are visible to whoever queued them and to BOSS/ADMIN"""
+    job = db.get_or_404(Job, job_id)
+    if job.created_by != current_user.id and not current_user.has_any_role('BOSS', 'ADMIN'):
+        abort(404)
+    return job
+
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def get_job(job_id):
+    """Status of a background job: QUEUED, RUNNING, DONE or FAILED"""
+    job = get_own_job(job_id)
+    status = job_status(job)
+    result = status['result'] or {}
+    if job.status == 'DONE' and result.get('file'):
+        status['download_url'] = url_for('download_job_file', job_id=job.id)
+    if result.get('report'):
+        status['report_url'] = url_for('import_parts_report', token=result['report'])
+    response = jsonify(status)
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/api/jobs/<int:job_id>/download')
+@login_required
+def download_job_file(job_id):
+    """The file a finished export job wrote"""
+    job = get_own_job(job_id)
+    result = job_status(job)['result'] or {}
+    if job.status != 'DONE' or not result.get('file'):
+        abort(404)
+    return send_from_directory(app.config['EXPORT_FOLDER'], result['file'],
+                               as_attachment=True, download_name=result.get('filename'))
+
+
+# ==================== HEALTH CHECKS ====================
+
+@app.route('/health/live')
+def liveness():
+    """The process is up and serving requests. Doesn't touch the database,
+    so a database outage doesn't get every worker restarted."""
+    response = jsonify({'status': 'ok'})
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/health/ready')
+def readiness():
+    """Ready for traffic: a pooled database connection answers a query"""
+    try:
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+    except SQLAlchemyError:
+        app.logger.exception('Readiness check failed')
+        response = jsonify({'status': 'unavailable', 'database': 'unreachable'})
+        response.status_code = 503
+    else:
+        response = jsonify({'status': 'ok', 'database': 'ok', 'pool': db.engine.pool.status()})
+    response.cache_control.no_store = True
+    return response
+
+
 # ==================== OTHER ROUTES ====================
 
 @app.route('/pumps/<int:pump_id>/delete', methods=['POST'])
@@ -870,10 +1560,12 @@ def delete_pump(pump_id):
 
     try:
         pump = Pump.query.get_or_404(pump_id)
-        db.session.delete(pump)  # CASCADE handles children
+        # The worker deletes the pump and its rows; open pages drop it then
+        enqueue(db.session, 'delete_pump', {'pump_id': pump.id, 'by': current_user.username},
+                created_by=current_user.id)
         db.session.commit()
 
-        flash(f'Pump "{pump.name}" deleted successfully.', 'success')
+        flash(f'Pump "{pump.name}" is being deleted.', 'success')
 
     except Exception as e:
         db.session.rollback()
@@ -882,11 +1574,74 @@ def delete_pump(pump_id):
     return redirect(url_for('pump_list'))
 
 
-@app.route('/uploads/<filename>')
+@app.route('/uploads/<path:filename>')
 @login_required
 def uploaded_file(filename):
-    """Serve uploaded files"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """
+    Serve uploaded files with ETag/Last-Modified, 304s and Range requests.
+    Content-addressed files never change, so browsers may cache them for a
+    year. With DRAWING_ACCEL_PREFIX set, nginx sends the bytes instead
+    (X-Accel-Redirect); USE_X_SENDFILE does the same for Apache/lighttpd.
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    etag = etag_for(filename)
+    max_age = 365 * 24 * 3600 if etag else None
+
+    accel_prefix = app.config.get('DRAWING_ACCEL_PREFIX')
+    if accel_prefix:
+        path = safe_join(folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+        response.set_etag(etag or f'{os.path.getmtime(path):.0f}-{os.path.getsize(path)}')
+        response.last_modified = os.path.getmtime(path)
+        if max_age:
+            response.cache_control.max_age = max_age
+        response = response.make_conditional(request)
+    else:
+        response = send_from_directory(folder, filename, etag=etag or True, max_age=max_age)
+
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if etag:
+        response.cache_control.immutable = True
+    return response
+
+
+def queue_thumbnails(drawing_path):
+    """Build the drawing's thumbnail and preview in the background"""
+    schedule_thumbnails(app.config['UPLOAD_FOLDER'], drawing_path,
+                        app.config['THUMBNAIL_WORKERS'], app.logger)
+
+
+@app.route('/thumbnails/<variant>/<path:filename>')
+@login_required
+def drawing_thumbnail(variant, filename):
+    """
+    Cached thumbnail ('thumb') or low-resolution preview ('preview') of a
+    drawing. Until it has been generated a placeholder is returned, and
+    generation is queued in case the upload-time job was lost.
+    """
+    if variant not in THUMBNAIL_VARIANTS:
+        abort(404)
+    folder = app.config['UPLOAD_FOLDER']
+
+    if is_content_addressed(filename):
+        path = thumbnail_path(folder, filename, variant)
+        if os.path.exists(path):
+            response = send_file(path, mimetype='image/jpeg', etag=f'{etag_for(filename)}-{variant}',
+                                 max_age=365 * 24 * 3600)
+            response.cache_control.public = False
+            response.cache_control.private = True
+            response.cache_control.immutable = True
+            return response
+        if os.path.exists(os.path.join(folder, filename)):
+            queue_thumbnails(filename)
+
+    response = send_from_directory(app.static_folder, 'img/drawing-placeholder.svg', max_age=0)
+    response.cache_control.no_store = True
+    return response
 
 
 @app.route('/logout')
@@ -905,6 +1660,26 @@ def pump_management(pump_id):
 
 
 
+@app.route('/admin/metrics')
+def metrics():
+    """
+    Prometheus-style metrics for this worker.
+    BOSS/ADMIN can open it in the browser; a scraper sends
+    'Authorization: Bearer <METRICS_TOKEN>'.
+    """
+    token = app.config.get('METRICS_TOKEN')
+    has_token = bool(token) and hmac.compare_digest(
+        request.headers.get('Authorization', '').encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+    if not has_token:
+        if not current_user.is_authenticated:
+            return login_manager.unauthorized()
+        if not current_user.has_any_role('BOSS', 'ADMIN'):
+            abort(403)
+
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/admin/users/add', methods=['GET', 'POST'])
 @login_required
 def add_user():
@@ -922,7 +1697,11 @@ def add_user():
             flash('Username already exists', 'danger')
             return redirect(url_for('add_user'))
 
-        password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        try:
+            password_hash = password_hasher.hash(password)
+        except HasherBusy:
+            flash('The server is busy. Please try again in a moment', 'danger')
+            return redirect(url_for('add_user'))
 
         user = User(
             username=username,
@@ -988,16 +1767,67 @@ def delete_user(user_id):
 
 
 
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Create missing tables and apply pending schema migrations"""
+    import migrations
+
+    db.create_all()
+    applied = migrations.upgrade(db.engine)
+    print(f'{len(applied)} migration(s) applied' if applied else 'Database is up to date')
+
+
+@app.cli.command('run-worker')
+@click.option('--threads', type=int, default=None, help='Jobs run at the same time (JOB_WORKER_THREADS)')
+def run_worker(threads):
+    """Run queued background jobs until interrupted"""
+    worker = Worker(
+        app, db.engine,
+        threads=threads or app.config['JOB_WORKER_THREADS'],
+        poll_seconds=app.config['JOB_POLL_SECONDS'],
+        lease_seconds=app.config['JOB_LEASE_SECONDS'],
+        retention_hours=app.config['JOB_RETENTION_HOURS'],
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    print('Worker stopped')
+
+
+@app.cli.command('freeze-pumps')
+def freeze_pumps():
+    """Snapshot every COMPLETED pump that has no current snapshot"""
+    frozen = 0
+    pump_ids = db.session.scalars(
+        db.select(Pump.id).where(Pump.status == 'COMPLETED').order_by(Pump.id)
+    ).all()
+    for pump_id in pump_ids:
+        if load_snapshot(db.session, pump_id, 'info') is not None:
+            continue
+        with app.test_request_context():
+            freeze_pump(db.session.get(Pump, pump_id))
+        db.session.commit()
+        frozen += 1
+    print(f'{frozen} pumps frozen')
+
+
+@app.cli.command('rebuild-summaries')
+def rebuild_summaries():
+    """Recount the summary and progress tables, drawing references, search index, die stage times and workflow stages from scratch"""
+    with db.engine.begin() as connection:
+        rebuild_pump_summary(connection)
+        rebuild_file_refs(connection)
+        rebuild_search_index(connection)
+        rebuild_die_stages(connection)
+        rebuild_pump_progress(connection)
+        rebuild_workflow_stages(connection)
+    print('Summary tables rebuilt')
 
-# REPLACE THE LAST SECTION OF app.py (at the very bottom)
-# FROM:
-# if __name__ == '__main__':
-#     app.run(host="0.0.0.0", debug=True, port=5000)
 
-# TO:
 if __name__ == '__main__':
-    # This section is no longer needed since we're using run.py
-    # But keep it for backward compatibility
+    # Development server; production runs gunicorn (see gunicorn.conf.py)
     from config import Config
     app.run(
         host=Config.HOST,
@@ -0,0 +1,12 @@
+"""
+Data-layer benchmarks.
+
+    python -m benchmarks.run --pumps 2000 --parts 40
+    python -m benchmarks.run --save-baseline      # record the current numbers
+    python -m benchmarks.run                      # compare against them
+
+dataset.py seeds a synthetic plant-scale dataset into a local database
+(SQLite by default, or any --db URI). run.py drives the hot routes through
+the Flask test client and reports wall time and SQL statement count per
+route.
+"""
@@ -0,0 +1,130 @@
+"""Synthetic plant-scale dataset for the benchmarks"""
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from extensions import bcrypt, db
+from models import DiePatternItem, OtherItem, Part, Pump, Role, TestingWorkflow, User
+from utils.progress import rebuild_pump_progress
+from utils.search import rebuild_search_index
+from utils.stages import rebuild_die_stages
+from utils.summary import rebuild_pump_summary
+from utils.workflow import rebuild_workflow_stages
+
+ROLES = ['BOSS', 'ADMIN', 'DIE_INCHARGE', 'OTHER_INCHARGE']
+PASSWORD = 'bench'
+BATCH_SIZE = 5000
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def _maybe_date(rng, start, chance=0.7):
+    if rng.random() > chance:
+        return None
+    return start + timedelta(days=rng.randint(0, 365))
+
+
+def seed(pumps=500, parts_per_pump=30, workflow_per_pump=4, seed_value=42):
+    """
+    Recreate every table and fill it with pumps, parts, die/other items and
+    workflow history. Returns {role: username}.
+    """
+    rng = random.Random(seed_value)
+    start = date(2024, 1, 1)
+
+    db.drop_all()
+    db.create_all()
+
+    users = {}
+    password_hash = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    for name in ROLES:
+        role = Role(name=name)
+        user = User(username=f'bench_{name.lower()}', password_hash=password_hash)
+        user.roles.append(role)
+        db.session.add(user)
+        users[name] = user
+    db.session.flush()
+    boss_id = users['BOSS'].id
+
+    _insert(Pump, [{
+        'id': pump_id,
+        'name': f'Bench Pump {pump_id:05d}',
+        'pump_type': rng.choice(['VERSIL', 'OTHER']),
+        'phase': rng.choice(['1', '2', '3']),
+        'hp': rng.choice([1, 1.5, 2, 3, 5]),
+        'deadline_date': _maybe_date(rng, start),
+        'status': 'COMPLETED' if rng.random() < 0.3 else 'PENDING',
+        'created_by': boss_id,
+    } for pump_id in range(1, pumps + 1)])
+
+    part_rows = []
+    die_rows = []
+    other_rows = []
+    part_id = 0
+    for pump_id in range(1, pumps + 1):
+        for n in range(parts_per_pump):
+            part_id += 1
+            source = 'VERSIL' if n % 2 == 0 else 'OTHER'
+            part_rows.append({
+                'id': part_id,
+                'pump_id': pump_id,
+                'source': source,
+                'part_name': f'Part {n:03d}',
+                'weight': round(rng.uniform(0.1, 25), 3),
+                'quantity': rng.randint(1, 12),
+                'brand': rng.choice(['Kirloskar', 'Crompton', 'Havells', None]),
+                'material': rng.choice(['CI', 'SS304', 'Brass', 'Aluminium']),
+            })
+            if source != 'VERSIL':
+                continue
+            die_rows.append({
+                'pump_id': pump_id,
+                'part_id': part_id,
+                'pattern_cavity': str(rng.randint(1, 4)),
+                'making_pattern_date': _maybe_date(rng, start),
+                'complete_pattern_date': _maybe_date(rng, start),
+                'send_foundry_pattern_date': _maybe_date(rng, start),
+                'casting_date': _maybe_date(rng, start),
+                'casting_mc_date': _maybe_date(rng, start, 0.4),
+                'mc_received_date': _maybe_date(rng, start, 0.3),
+                'status': rng.choice(['PENDING', 'COMPLETED']),
+                'remark': rng.choice([None, 'Check core', 'Rework pattern']),
+            })
+            other_rows.append({
+                'pump_id': pump_id,
+                'part_id': part_id,
+                'material_specification': rng.choice(['IS 210', 'EN8', None]),
+                'party_name': rng.choice(['Shree Castings', 'Om Engg', 'Patel Works']),
+                'drawing_date': _maybe_date(rng, start),
+                'inward_date': _maybe_date(rng, start, 0.5),
+                'qc_date': _maybe_date(rng, start, 0.4),
+                'qc_status': rng.choice([None, 'OK', 'REJECTED']),
+                'sample_price': round(rng.uniform(50, 5000), 2),
+                'status': rng.choice(['PENDING', 'COMPLETED']),
+            })
+    _insert(Part, part_rows)
+    _insert(DiePatternItem, die_rows)
+    _insert(OtherItem, other_rows)
+
+    actions = ['Assembly', 'Testing'] + ['Testing Report Date'] * max(workflow_per_pump - 2, 0)
+    _insert(TestingWorkflow, [{
+        'pump_id': pump_id,
+        'date': start + timedelta(days=i * 7),
+        'user_id': boss_id,
+        'action': action,
+        'remark': f'Step {i + 1}',
+    } for pump_id in range(1, pumps + 1) for i, action in enumerate(actions[:workflow_per_pump])])
+
+    # Bulk inserts bypass the ORM hooks that maintain the summary tables
+    # and the derived tables
+    rebuild_pump_summary(db.session.connection())
+    rebuild_search_index(db.session.connection())
+    rebuild_die_stages(db.session.connection())
+    rebuild_pump_progress(db.session.connection())
+    rebuild_workflow_stages(db.session.connection())
+    db.session.commit()
+    return {name: user.username for name, user in users.items()}
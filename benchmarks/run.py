@@ -0,0 +1,277 @@
+"""
+Time the hot routes against a seeded database and compare with a baseline.
+
+    python -m benchmarks.run [--db URI] [--pumps N] [--parts M] [--repeat R]
+                             [--save-baseline] [--tolerance 0.25]
+
+Exits with status 1 when a route is slower than the baseline by more than
+--tolerance, or issues more SQL statements than it did in the baseline.
+It also posts stale row versions to both grids and exits with status 1
+unless every one comes back as a conflict without writing anything.
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', help='SQLAlchemy URI (default: a temporary SQLite file)')
+    parser.add_argument('--pumps', type=int, default=500)
+    parser.add_argument('--parts', type=int, default=30, help='parts per pump')
+    parser.add_argument('--workflow', type=int, default=4, help='workflow rows per pump')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown before a route counts as a regression')
+    return parser.parse_args(argv)
+
+
+def load_app(db_uri):
+    # Config is read when app.py is imported, so point it at the bench DB first
+    import config
+    config.Config.SQLALCHEMY_DATABASE_URI = db_uri
+    config.Config.BCRYPT_LOG_ROUNDS = 4
+    from app import app
+    app.config['TESTING'] = True
+    return app
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def build_routes(app, pump_id):
+    """(name, method, url, payload factory) for each hot route"""
+    from extensions import db
+    from models import DiePatternItem, OtherItem
+    from utils.validators import format_ddmmyyyy
+
+    def grid_rows(model, fields):
+        with app.app_context():
+            items = model.query.filter_by(pump_id=pump_id).all()
+            rows = []
+            for item in items:
+                row = {'part_id': item.part_id, 'status': item.status}
+                for field in fields:
+                    value = getattr(item, field)
+                    row[field] = format_ddmmyyyy(value) if field.endswith('_date') else value
+                rows.append(row)
+            db.session.remove()
+        return rows
+
+    def delta_change(model):
+        # One edited row per save; each save bumps its version by one
+        with app.app_context():
+            item = model.query.filter_by(pump_id=pump_id).order_by(model.id).first()
+            item_id, part_id, version = (item.id, item.part_id, item.version) if item else (0, 0, 1)
+            db.session.remove()
+        versions = itertools.count(version)
+        return lambda: {'changes': {'changed': [
+            {'id': item_id, 'part_id': part_id, 'version': next(versions), 'remark': 'bench'}
+        ]}}
+
+    die_rows = grid_rows(DiePatternItem, ['making_pattern_date', 'casting_date', 'remark'])
+    other_rows = grid_rows(OtherItem, ['party_name', 'qc_date', 'remark'])
+    # Built before the full saves below run, which also bump row versions
+    die_delta = delta_change(DiePatternItem)
+    other_delta = delta_change(OtherItem)
+
+    return [
+        ('dashboard', 'GET', '/dashboard', None),
+        ('pump_list', 'GET', '/pumps', None),
+        ('export_csv', 'GET', '/pumps/export', None),
+        ('search', 'GET', '/api/search?q=kirloskar+part', None),
+        ('manufacturing', 'GET', '/manufacturing?per_page=100', None),
+        ('get_parts', 'GET', f'/api/pumps/{pump_id}/parts', None),
+        ('die_pattern_form', 'GET', f'/pumps/{pump_id}/die-pattern', None),
+        ('die_pattern_delta', 'POST', f'/pumps/{pump_id}/die-pattern', die_delta),
+        ('save_die_pattern', 'POST', f'/pumps/{pump_id}/die-pattern', lambda: {'rows': die_rows}),
+        ('other_items_form', 'GET', f'/pumps/{pump_id}/other-items', None),
+        ('other_items_delta', 'POST', f'/pumps/{pump_id}/other-items', other_delta),
+        ('save_other_items', 'POST', f'/pumps/{pump_id}/other-items', lambda: {'rows': other_rows}),
+        ('save_workflow', 'POST', f'/pumps/{pump_id}/workflow', lambda: {'rows': [
+            {'date': '01/01/2025', 'action': 'Testing Report Date', 'remark': 'bench'}
+        ]}),
+    ]
+
+
+def check_conflicts(app, client, pump_id):
+    """
+    Save a grid row, then post a change and a removal that still carry the
+    version read before that save. Returns a message for every stale row
+    that was not reported as a conflict or that changed the stored row or
+    the pump's version.
+    """
+    from extensions import db
+    from models import DiePatternItem, OtherItem, Pump
+
+    def snapshot(model, item_id):
+        with app.app_context():
+            item = db.session.get(model, item_id)
+            row = item and {column.name: getattr(item, column.name) for column in model.__table__.columns}
+            state = (row, db.session.get(Pump, pump_id).version)
+            db.session.remove()
+        return state
+
+    failures = []
+    for name, model, url in (
+        ('die_pattern', DiePatternItem, f'/pumps/{pump_id}/die-pattern'),
+        ('other_items', OtherItem, f'/pumps/{pump_id}/other-items'),
+    ):
+        with app.app_context():
+            item = model.query.filter_by(pump_id=pump_id).order_by(model.id).first()
+            read = item and {'id': item.id, 'part_id': item.part_id, 'version': item.version}
+            db.session.remove()
+        if read is None:
+            failures.append(f'{name}: pump {pump_id} has no rows to check')
+            continue
+
+        # Someone else saves the row after it was read...
+        saved = client.post(url, json={'changes': {'changed': [{**read, 'remark': 'saved first'}]}}).get_json()
+        if not saved or saved.get('changed') != 1:
+            failures.append(f'{name}: the first save did not apply: {saved}')
+            continue
+        before = snapshot(model, read['id'])
+
+        # ...so both of these must come back as conflicts and write nothing
+        for kind, row in (('changed', {**read, 'remark': 'stale'}), ('removed', read)):
+            body = client.post(url, json={'changes': {kind: [row]}}).get_json() or {}
+            conflicts = body.get('conflicts') or []
+            current = conflicts[0].get('current') or {} if conflicts else {}
+            if (
+                len(conflicts) != 1
+                or conflicts[0].get('id') != read['id']
+                or conflicts[0].get('reason') != 'changed by someone else'
+                or current.get('version') != read['version'] + 1
+            ):
+                failures.append(f'{name}: stale {kind} row not reported as a conflict: {conflicts}')
+            if body.get(kind):
+                failures.append(f'{name}: stale {kind} row counted as {kind}: {body.get(kind)}')
+            if snapshot(model, read['id']) != before:
+                failures.append(f'{name}: stale {kind} row was written')
+    return failures
+
+
+def run(args):
+    db_uri = args.db
+    tmpdir = None
+    if not db_uri:
+        tmpdir = tempfile.mkdtemp(prefix='versil-bench-')
+        db_uri = f'sqlite:///{os.path.join(tmpdir, "bench.db")}'
+
+    app = load_app(db_uri)
+    from extensions import db
+    from models import Pump
+    from benchmarks.dataset import PASSWORD, seed
+
+    with app.app_context():
+        started = time.perf_counter()
+        users = seed(args.pumps, args.parts, args.workflow)
+        print(f'Seeded {args.pumps} pumps x {args.parts} parts in {time.perf_counter() - started:.1f}s')
+        pump_id = (
+            Pump.query.filter_by(status='PENDING')
+            .order_by(Pump.id)
+            .offset(args.pumps // 4)
+            .first()
+            or Pump.query.filter_by(status='PENDING').first()
+        ).id
+        counter = StatementCounter(db.engine)
+
+    client = app.test_client()
+    client.post('/login', data={'username': users['BOSS'], 'password': PASSWORD})
+
+    results = {}
+    for name, method, url, payload in build_routes(app, pump_id):
+        timings = []
+        statements = []
+        for _ in range(args.repeat):
+            counter.count = 0
+            started = time.perf_counter()
+            if method == 'GET':
+                response = client.get(url)
+            else:
+                response = client.post(url, json=payload())
+            # Streamed bodies (e.g. the export) are only produced when read
+            response.get_data()
+            timings.append((time.perf_counter() - started) * 1000)
+            statements.append(counter.count)
+            if response.status_code >= 400:
+                print(f'{name}: HTTP {response.status_code}', file=sys.stderr)
+                break
+        timings.sort()
+        results[name] = {
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'statements': int(statistics.median(statements)),
+        }
+    return results, check_conflicts(app, client, pump_id)
+
+
+def compare(results, baseline, tolerance):
+    """Print the report; return the names of routes that regressed"""
+    regressions = []
+    print(f'\n{"route":<20}{"median ms":>11}{"p95 ms":>10}{"stmts":>7}   vs baseline')
+    for name, current in results.items():
+        note = ''
+        before = baseline.get(name)
+        if before:
+            ratio = current['median_ms'] / before['median_ms'] if before['median_ms'] else 1.0
+            note = f'{ratio:5.2f}x time, {current["statements"] - before["statements"]:+d} stmts'
+            if ratio > 1 + tolerance or current['statements'] > before['statements']:
+                regressions.append(name)
+                note += '  REGRESSION'
+        print(f'{name:<20}{current["median_ms"]:>11.2f}{current["p95_ms"]:>10.2f}'
+              f'{current["statements"]:>7}   {note}')
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results, conflict_failures = run(args)
+
+    meta = {'pumps': args.pumps, 'parts': args.parts, 'workflow': args.workflow}
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            stored = json.load(fh)
+        if stored.get('dataset') == meta:
+            baseline = stored.get('routes', {})
+        else:
+            print(f'Baseline was recorded for {stored.get("dataset")}; not comparing')
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fh:
+            json.dump({'dataset': meta, 'routes': results}, fh, indent=2)
+        print(f'\nBaseline saved to {args.baseline}')
+        return 0
+
+    if conflict_failures:
+        print('\nConflict check failed:\n  ' + '\n  '.join(conflict_failures))
+    else:
+        print('\nConflict check passed: stale grid rows were reported and not written')
+
+    if regressions:
+        print(f'\nRegressions: {", ".join(regressions)}')
+        return 1
+    return 1 if conflict_failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,7 +19,77 @@ class Config:
     
     SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool per worker process. Connections are recycled before
+    # MySQL's wait_timeout closes them and checked with a ping on checkout,
+    # so an idle worker doesn't hit "MySQL server has gone away".
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '5')),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true',
+    }
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static/uploads')
+    # Let the front web server send drawings: nginx internal location prefix
+    # for X-Accel-Redirect, or X-Sendfile for Apache/lighttpd
+    DRAWING_ACCEL_PREFIX = os.getenv('DRAWING_ACCEL_PREFIX', '')
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
+    # Background threads per worker process that render drawing thumbnails
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+    IMPORT_REPORT_FOLDER = os.path.join(BASE_DIR, 'instance/import_reports')
+    # Uploaded import files waiting for the worker, and finished exports
+    IMPORT_UPLOAD_FOLDER = os.path.join(BASE_DIR, 'instance/import_uploads')
+    EXPORT_FOLDER = os.path.join(BASE_DIR, 'instance/exports')
+    EXPORT_RETENTION_HOURS = int(os.getenv('EXPORT_RETENTION_HOURS', '24'))
+
+    # Background jobs (flask run-worker, see utils/jobs.py)
+    JOB_WORKER_THREADS = int(os.getenv('JOB_WORKER_THREADS', '4'))
+    JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '1'))
+    # A RUNNING job whose worker stopped is requeued after this long
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+    # DONE jobs are deleted this long after they finished
+    JOB_RETENTION_HOURS = int(os.getenv('JOB_RETENTION_HOURS', '168'))
+
+    # Pump list / dashboard pagination
+    PAGE_SIZES = (25, 50, 100, 200)
+    DEFAULT_PAGE_SIZE = 50
+
+    # Rendered pump rows/cards kept per worker (see utils/fragments.py)
+    FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', '5000'))
+
+    # Field change history (see utils/audit.py): rows per INSERT and max seconds they wait
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '200'))
+    AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '2'))
+
+    # Password hashing pool and login throttling (see utils/passwords.py, utils/throttle.py).
+    # Raising BCRYPT_LOG_ROUNDS upgrades each user's hash at their next login.
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '4'))
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '64'))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+    LOGIN_USER_BURST = int(os.getenv('LOGIN_USER_BURST', '5'))
+    LOGIN_USER_PER_MINUTE = int(os.getenv('LOGIN_USER_PER_MINUTE', '5'))
+    LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', '60'))
+    LOGIN_IP_PER_MINUTE = int(os.getenv('LOGIN_IP_PER_MINUTE', '120'))
+    # Reverse proxies in front that set X-Forwarded-For (0 = none)
+    PROXY_COUNT = int(os.getenv('PROXY_COUNT', '0'))
+
+    # Seconds a worker keeps a logged-in user's roles cached (see utils/principal.py)
+    PRINCIPAL_CACHE_TTL = int(os.getenv('PRINCIPAL_CACHE_TTL', '300'))
+    # How often a worker looks for role changes made by other workers
+    PRINCIPAL_CHECK_SECONDS = float(os.getenv('PRINCIPAL_CHECK_SECONDS', '2'))
+
+    # Request/SQL instrumentation served at /admin/metrics
+    SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '200'))
+    N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '10'))
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # bearer token for scrapers
+
+    # Live updates over server-sent events (/events, see utils/events.py)
+    EVENT_POLL_SECONDS = float(os.getenv('EVENT_POLL_SECONDS', '1'))
+    EVENT_KEEPALIVE_SECONDS = int(os.getenv('EVENT_KEEPALIVE_SECONDS', '15'))
+    EVENT_RETENTION_HOURS = int(os.getenv('EVENT_RETENTION_HOURS', '24'))
+    # Off in the gthread workers (gunicorn.conf.py); gunicorn_events.conf.py serves /events
+    EVENT_STREAMS = True
     
     # Server configuration
     HOST = os.getenv('HOST', '0.0.0.0')  # Allow network access
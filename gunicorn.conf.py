@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for serving the app in production:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is loaded once in the master and forked into WEB_WORKERS processes,
+each running WEB_THREADS threads. These workers answer /events with 503:
+an event stream would hold a thread for as long as its page is open, so
+the reverse proxy sends /events to the gevent process configured in
+gunicorn_events.conf.py instead. Each process has its own database pool
+(DB_POOL_SIZE + DB_MAX_OVERFLOW connections); keep WEB_WORKERS * that,
+plus the events process's pool, below MySQL's max_connections.
+
+Workers are replaced gracefully after about MAX_REQUESTS requests, and on
+'kill -HUP <master pid>'. Because the app is preloaded, deploying new code
+needs a full restart (or USR2 to start a new master, then QUIT the old one).
+"""
+import multiprocessing
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count() + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+preload_app = True
+
+# Requests that take longer than this get their worker restarted
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+# Time a stopping worker gets to finish its requests
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.getenv('MAX_REQUESTS', '2000'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+# Trust X-Forwarded-* from the reverse proxy in front
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+def post_fork(server, worker):
+    # Connections opened in the master while loading the app must not be
+    # shared with the children; each worker starts with an empty pool
+    from app import app
+    from extensions import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+    app.config['EVENT_STREAMS'] = False
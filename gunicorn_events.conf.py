@@ -0,0 +1,29 @@
+"""
+Gunicorn settings for the process that serves the /events streams:
+
+    gunicorn -c gunicorn_events.conf.py wsgi:app
+
+Every open page keeps one server-sent events connection for as long as it
+is open. gevent workers hold each one in a greenlet rather than a thread,
+so a few hundred idle streams cost next to nothing and never take threads
+from the gthread workers in gunicorn.conf.py. Only /events should be
+routed here; see the README for the nginx location.
+"""
+import os
+
+bind = f"{os.getenv('HOST', '127.0.0.1')}:{os.getenv('EVENTS_PORT', '5001')}"
+workers = int(os.getenv('EVENTS_WORKERS', '1'))
+worker_class = 'gevent'
+# Open streams per worker
+worker_connections = int(os.getenv('EVENTS_CONNECTIONS', '1000'))
+# Load the app in each worker, after gevent has patched it, not in the master
+preload_app = False
+
+# Async workers report in between requests, so open streams don't time out
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+# Streams never finish on their own; browsers reconnect after a restart
+graceful_timeout = 5
+
+accesslog = '-'
+errorlog = '-'
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1')
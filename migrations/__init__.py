@@ -0,0 +1,83 @@
+"""
+Schema migrations for databases created before a model change.
+
+db.create_all() only creates missing tables, it never alters existing ones.
+Each module listed in MIGRATIONS has an upgrade(connection) function that
+brings an existing database in line with models.py. Applied migrations are
+recorded in the schema_migrations table so `flask upgrade-db` is safe to
+run on every deploy.
+"""
+import importlib
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+MIGRATIONS = [
+    'm0001_pump_listing_indexes',
+    'm0002_native_dates',
+    'm0003_grid_unique_parts',
+    'm0004_pump_summary',
+    'm0005_content_addressed_drawings',
+    'm0006_pump_version',
+    'm0007_grid_row_versions',
+    'm0008_search_index',
+    'm0009_die_stage_times',
+    'm0010_pump_progress',
+    'm0011_workflow_stage',
+    'm0012_search_term_collation',
+]
+
+
+def index_exists(connection, table, name):
+    return any(ix['name'] == name for ix in inspect(connection).get_indexes(table))
+
+
+def unique_exists(connection, table, name):
+    inspector = inspect(connection)
+    return (
+        any(uc['name'] == name for uc in inspector.get_unique_constraints(table))
+        or index_exists(connection, table, name)
+    )
+
+
+def column_exists(connection, table, name):
+    return any(col['name'] == name for col in inspect(connection).get_columns(table))
+
+
+def table_exists(connection, table):
+    return inspect(connection).has_table(table)
+
+
+def _applied(connection):
+    if not table_exists(connection, 'schema_migrations'):
+        connection.execute(text(
+            'CREATE TABLE schema_migrations ('
+            'name VARCHAR(100) PRIMARY KEY, applied_at DATETIME NOT NULL)'
+        ))
+        return set()
+    rows = connection.execute(text('SELECT name FROM schema_migrations'))
+    return {row[0] for row in rows}
+
+
+def upgrade(engine, log=print):
+    """Apply every pending migration in order. Returns the names applied."""
+    with engine.begin() as connection:
+        applied = _applied(connection)
+
+    done = []
+    for name in MIGRATIONS:
+        if name in applied:
+            continue
+        module = importlib.import_module(f'migrations.{name}')
+        log(f'Applying {name}...')
+        # Each migration manages its own transactions so long backfills
+        # can commit in batches instead of holding one big lock
+        with engine.connect() as connection:
+            module.upgrade(connection)
+        with engine.begin() as connection:
+            connection.execute(
+                text('INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :at)'),
+                {'name': name, 'at': datetime.utcnow()}
+            )
+        done.append(name)
+    return done
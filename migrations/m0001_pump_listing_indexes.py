@@ -0,0 +1,16 @@
+"""Indexes used by the paginated pump list and dashboard filters"""
+from sqlalchemy import text
+
+from migrations import index_exists
+
+INDEXES = [
+    ('ix_pumps_status_deadline', 'pumps', 'status, deadline_date'),
+    ('ix_pumps_pump_type', 'pumps', 'pump_type'),
+]
+
+
+def upgrade(connection):
+    for name, table, columns in INDEXES:
+        if not index_exists(connection, table, name):
+            connection.execute(text(f'CREATE INDEX {name} ON {table} ({columns})'))
+    connection.commit()
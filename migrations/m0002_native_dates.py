@@ -0,0 +1,265 @@
+"""
+Convert the DD/MM/YYYY String(10) date columns to native DATE columns
+while the app keeps running.
+
+Each table goes through four steps:
+
+1. A nullable shadow DATE column is added next to each string column, and
+   insert and update triggers fill it from the string, so every write the
+   running app makes from then on keeps it in step.
+2. Existing rows are backfilled in id ranges of BATCH_SIZE rows, one small
+   transaction each. A batch is a single UPDATE that parses the strings in
+   SQL, exactly as the triggers do, so it can never put back a value older
+   than one a concurrent edit wrote.
+3. The swap: with the table write-locked, a catch-up pass converts the rows
+   added since the backfill began, the triggers are dropped and the columns
+   are renamed (string to <column>_old, shadow to <column>). Renames only
+   change metadata, so the lock is held for moments.
+4. The <column>_old columns are dropped and testing_workflow.date is made
+   NOT NULL. Each ALTER asks MySQL for ALGORITHM=INSTANT and, where the
+   server can't do that, for an online rebuild (ALGORITHM=INPLACE,
+   LOCK=NONE) that lets writes carry on; it fails rather than lock the
+   table. The date indexes are then built online.
+
+The SQL parser accepts what utils.validators.is_valid_ddmmyyyy() accepts,
+DD/MM/YYYY of a date that exists; anything else is left NULL and reported.
+Creating the triggers needs the TRIGGER privilege. On SQLite, which allows
+one writer at a time, the swap is one transaction that drops the string
+column directly.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.types import Date
+
+from migrations import column_exists, index_exists
+from utils.validators import DATE_REGEX
+
+BATCH_SIZE = 1000
+
+DATE_COLUMNS = {
+    'pumps': ['deadline_date'],
+    'die_pattern_items': [
+        'making_pattern_date',
+        'complete_pattern_date',
+        'send_foundry_pattern_date',
+        'casting_date',
+        'drawing_date',
+        'casting_mc_date',
+        'mc_received_date',
+    ],
+    'other_items': [
+        'drawing_date',
+        'send_party_drawing_date',
+        'party_received_date',
+        'inward_date',
+        'qc_date',
+    ],
+    'testing_workflow': ['date'],
+}
+
+NOT_NULL = {('testing_workflow', 'date')}
+
+# Indexes that cover a converted column and must be dropped before the swap
+DEPENDENT_INDEXES = {
+    ('pumps', 'deadline_date'): [('ix_pumps_status_deadline', 'status, deadline_date')],
+}
+
+# MySQL errors for an ALGORITHM the server can't use for an ALTER
+_ALGORITHM_UNSUPPORTED = {1800, 1845, 1846}
+
+
+def _is_date(connection, table, column):
+    for col in inspect(connection).get_columns(table):
+        if col['name'] == column:
+            return isinstance(col['type'], Date)
+    return False
+
+
+def _parse_sql(connection, value):
+    """SQL expression for the DATE in the DD/MM/YYYY string value, NULL if it isn't one"""
+    value = f'TRIM({value})'
+    if connection.dialect.name == 'mysql':
+        # The validators' pattern, so the casts below only ever see digits
+        # in range; a warning from them would fail the app's write in strict mode
+        pattern = DATE_REGEX.pattern.replace('\\d', '[0-9]')
+        day, month, year = (f'CAST(SUBSTRING({value}, {start}, {length}) AS SIGNED)'
+                            for start, length in ((1, 2), (4, 2), (7, 4)))
+        # Built from its parts and compared back, so 31/02 is NULL rather
+        # than 2 March
+        parsed = f'(MAKEDATE({year}, 1) + INTERVAL ({month} - 1) MONTH + INTERVAL ({day} - 1) DAY)'
+        return (f"CASE WHEN {value} REGEXP '{pattern}' THEN "
+                f'CASE WHEN DAY({parsed}) = {day} AND MONTH({parsed}) = {month} AND YEAR({parsed}) = {year} '
+                f'THEN {parsed} END END')
+    iso = f"substr({value}, 7, 4) || '-' || substr({value}, 4, 2) || '-' || substr({value}, 1, 2)"
+    # date() alone keeps 2024-02-31; a modifier makes it roll over to March
+    return (f"CASE WHEN {value} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]' "
+            f"AND date({iso}, '+0 days') = {iso} THEN {iso} END")
+
+
+def _shadow(column):
+    return f'{column}_new'
+
+
+def _copy(connection, columns, source=''):
+    """SET list converting each column into its shadow; source is e.g. 'NEW.'"""
+    return ', '.join(
+        f'{_shadow(column)} = {_parse_sql(connection, source + column)}' for column in columns
+    )
+
+
+def _alter_online(connection, table, clauses):
+    """Run ALTER TABLE without blocking writes: INSTANT if possible, else an online rebuild"""
+    if connection.dialect.name != 'mysql':
+        for clause in clauses:
+            connection.execute(text(f'ALTER TABLE {table} {clause}'))
+        connection.commit()
+        return
+    statement = f'ALTER TABLE {table} {", ".join(clauses)}'
+    try:
+        connection.execute(text(f'{statement}, ALGORITHM=INSTANT'))
+    except DBAPIError as e:
+        if not e.orig.args or e.orig.args[0] not in _ALGORITHM_UNSUPPORTED:
+            raise
+        connection.rollback()
+        connection.execute(text(f'{statement}, ALGORITHM=INPLACE, LOCK=NONE'))
+    connection.commit()
+
+
+def _trigger_names(table):
+    return f'{table}_dates_ins', f'{table}_dates_upd'
+
+
+def _create_triggers(connection, table, columns):
+    insert_trigger, update_trigger = _trigger_names(table)
+    for name in (insert_trigger, update_trigger):
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+    if connection.dialect.name == 'mysql':
+        for name, when in ((insert_trigger, 'INSERT'), (update_trigger, 'UPDATE')):
+            connection.execute(text(
+                f'CREATE TRIGGER {name} BEFORE {when} ON {table} FOR EACH ROW '
+                f'SET {_copy(connection, columns, "NEW.")}'
+            ))
+    else:
+        copy = f'UPDATE {table} SET {_copy(connection, columns, "NEW.")} WHERE id = NEW.id;'
+        connection.execute(text(
+            f'CREATE TRIGGER {insert_trigger} AFTER INSERT ON {table} BEGIN {copy} END'
+        ))
+        connection.execute(text(
+            f'CREATE TRIGGER {update_trigger} AFTER UPDATE OF {", ".join(columns)} ON {table} '
+            f'BEGIN {copy} END'
+        ))
+    connection.commit()
+
+
+def _backfill(connection, table, columns):
+    """Fill the shadow columns of every row up to now; returns the last id covered"""
+    last_id = connection.execute(text(f'SELECT MAX(id) FROM {table}')).scalar() or 0
+    update = text(f'UPDATE {table} SET {_copy(connection, columns)} WHERE id > :low AND id <= :high')
+    for low in range(0, last_id, BATCH_SIZE):
+        connection.execute(update, {'low': low, 'high': low + BATCH_SIZE})
+        connection.commit()
+    return last_id
+
+
+def _report_skipped(connection, table, columns):
+    for column in columns:
+        skipped = connection.execute(text(
+            f"SELECT COUNT(*) FROM {table} WHERE TRIM({column}) <> '' AND {_shadow(column)} IS NULL"
+        )).scalar()
+        if skipped:
+            print(f'  {table}.{column}: {skipped} value(s) were not DD/MM/YYYY and were left empty')
+    connection.commit()
+
+
+def _swap(connection, table, columns, last_id):
+    """Catch up, drop the triggers and put the DATE columns in place, all under a short write lock"""
+    catch_up = text(f'UPDATE {table} SET {_copy(connection, columns)} WHERE id > :last_id')
+    drops = [text(f'DROP TRIGGER IF EXISTS {name}') for name in _trigger_names(table)]
+
+    if connection.dialect.name != 'mysql':
+        # The UPDATE takes SQLite's write lock until the commit
+        connection.execute(catch_up, {'last_id': last_id})
+        for drop in drops:
+            connection.execute(drop)
+        for column in columns:
+            connection.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+            connection.execute(text(f'ALTER TABLE {table} RENAME COLUMN {_shadow(column)} TO {column}'))
+        connection.commit()
+        return
+
+    renames = []
+    for column in columns:
+        renames += [
+            f'RENAME COLUMN {column} TO {column}_old',
+            # testing_workflow.date has no default; new rows don't set it
+            f"ALTER COLUMN {column}_old SET DEFAULT ''",
+            f'RENAME COLUMN {_shadow(column)} TO {column}',
+        ]
+    connection.execute(text(f'LOCK TABLES {table} WRITE'))
+    try:
+        connection.execute(catch_up, {'last_id': last_id})
+        for drop in drops:
+            connection.execute(drop)
+        connection.execute(text(f'ALTER TABLE {table} {", ".join(renames)}'))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection.execute(text('UNLOCK TABLES'))
+        connection.commit()
+
+
+def _convert(connection, table, columns):
+    missing = [column for column in columns if not column_exists(connection, table, _shadow(column))]
+    if missing:
+        _alter_online(connection, table, [f'ADD COLUMN {_shadow(column)} DATE NULL' for column in missing])
+    _create_triggers(connection, table, columns)
+    last_id = _backfill(connection, table, columns)
+    _report_skipped(connection, table, columns)
+
+    mysql = connection.dialect.name == 'mysql'
+    for column in columns:
+        for name, _ in DEPENDENT_INDEXES.get((table, column), []):
+            if index_exists(connection, table, name):
+                connection.execute(text(f'DROP INDEX {name} ON {table}' if mysql else f'DROP INDEX {name}'))
+    connection.commit()
+
+    _swap(connection, table, columns, last_id)
+
+
+def _finish(connection, table, columns):
+    """Drop the string columns left by the swap and tighten NOT NULL columns"""
+    clauses = [f'DROP COLUMN {column}_old' for column in columns
+               if column_exists(connection, table, f'{column}_old')]
+    if connection.dialect.name == 'mysql':
+        nullable = {col['name']: col['nullable'] for col in inspect(connection).get_columns(table)}
+        for column in columns:
+            if (table, column) not in NOT_NULL or not nullable.get(column):
+                continue
+            if connection.execute(text(f'SELECT 1 FROM {table} WHERE {column} IS NULL LIMIT 1')).first():
+                print(f'  {table}.{column}: left nullable, some rows have no valid date')
+            else:
+                clauses.append(f'MODIFY {column} DATE NOT NULL')
+        connection.commit()
+    if clauses:
+        _alter_online(connection, table, clauses)
+
+
+def upgrade(connection):
+    for table, columns in DATE_COLUMNS.items():
+        pending = [column for column in columns if not _is_date(connection, table, column)]
+        if pending:
+            print(f'  converting {table}: {", ".join(pending)}')
+            _convert(connection, table, pending)
+        _finish(connection, table, columns)
+
+        for column in columns:
+            for name, indexed in DEPENDENT_INDEXES.get((table, column), []):
+                if not index_exists(connection, table, name):
+                    connection.execute(text(f'CREATE INDEX {name} ON {table} ({indexed})'))
+            # pumps.deadline_date is covered by ix_pumps_status_deadline
+            index = f'ix_{table}_{column}'
+            if table != 'pumps' and not index_exists(connection, table, index):
+                connection.execute(text(f'CREATE INDEX {index} ON {table} ({column})'))
+            connection.commit()
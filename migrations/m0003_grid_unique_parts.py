@@ -0,0 +1,35 @@
+"""
+One grid row per (pump_id, part_id) on die_pattern_items and other_items.
+
+Older saves could leave duplicate rows for the same part; the newest row
+(highest id) is kept before the unique index is created.
+"""
+from sqlalchemy import text
+
+from migrations import unique_exists
+
+CONSTRAINTS = [
+    ('uq_die_pattern_items_pump_part', 'die_pattern_items'),
+    ('uq_other_items_pump_part', 'other_items'),
+]
+
+
+def upgrade(connection):
+    for name, table in CONSTRAINTS:
+        if unique_exists(connection, table, name):
+            continue
+
+        duplicates = connection.execute(text(
+            f'SELECT id FROM {table} t WHERE EXISTS ('
+            f'SELECT 1 FROM {table} newer WHERE newer.pump_id = t.pump_id '
+            f'AND newer.part_id = t.part_id AND newer.id > t.id)'
+        )).scalars().all()
+        if duplicates:
+            print(f'  removing {len(duplicates)} duplicate row(s) from {table}')
+            connection.execute(
+                text(f'DELETE FROM {table} WHERE id = :id'),
+                [{'id': item_id} for item_id in duplicates]
+            )
+
+        connection.execute(text(f'CREATE UNIQUE INDEX {name} ON {table} (pump_id, part_id)'))
+        connection.commit()
@@ -0,0 +1,7 @@
+"""Fill the dashboard summary tables (created by db.create_all) from pumps"""
+from utils.summary import rebuild_pump_summary
+
+
+def upgrade(connection):
+    rebuild_pump_summary(connection)
+    connection.commit()
@@ -0,0 +1,58 @@
+"""
+Move uploaded drawings into content-addressed storage (utils/storage.py).
+
+Adds pumps.drawing_name, hashes every legacy file named by
+pumps.drawing_path, moves it to its storage key and records the old name
+for display. Then the stored_files reference counts are rebuilt. Drawings
+whose file is missing are left as they are and reported.
+"""
+import os
+
+from sqlalchemy import text
+
+from config import Config
+from migrations import column_exists
+from utils.storage import is_content_addressed, rebuild_file_refs, store_stream
+
+
+def _move(folder, name):
+    """Store one legacy file by content hash; returns its key"""
+    with open(os.path.join(folder, name), 'rb') as fh:
+        return store_stream(fh, name, folder)
+
+
+def upgrade(connection):
+    if not column_exists(connection, 'pumps', 'drawing_name'):
+        connection.execute(text('ALTER TABLE pumps ADD COLUMN drawing_name VARCHAR(255) NULL'))
+        connection.commit()
+
+    folder = Config.UPLOAD_FOLDER
+    rows = connection.execute(text(
+        'SELECT id, drawing_path FROM pumps WHERE drawing_path IS NOT NULL'
+    )).all()
+
+    keys = {}
+    missing = 0
+    for pump_id, name in rows:
+        if is_content_addressed(name):
+            continue
+        if name not in keys:
+            keys[name] = _move(folder, name) if os.path.isfile(os.path.join(folder, name)) else None
+        if keys[name] is None:
+            missing += 1
+            continue
+        connection.execute(
+            text('UPDATE pumps SET drawing_path = :key, drawing_name = :name WHERE id = :id'),
+            {'key': keys[name], 'name': name, 'id': pump_id}
+        )
+    connection.commit()
+
+    # Legacy copies are only removed once every pump points at the new key
+    for name, key in keys.items():
+        if key is not None:
+            os.remove(os.path.join(folder, name))
+    if missing:
+        print(f'  {missing} pump drawing(s) were not found in {folder} and were left as they are')
+
+    rebuild_file_refs(connection)
+    connection.commit()
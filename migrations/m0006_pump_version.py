@@ -0,0 +1,10 @@
+"""pumps.version, the per-pump data version behind the read API's ETags"""
+from sqlalchemy import text
+
+from migrations import column_exists
+
+
+def upgrade(connection):
+    if not column_exists(connection, 'pumps', 'version'):
+        connection.execute(text('ALTER TABLE pumps ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+        connection.commit()
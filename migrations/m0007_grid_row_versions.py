@@ -0,0 +1,11 @@
+"""Row versions on the die & pattern and other items grids (delta saves)"""
+from sqlalchemy import text
+
+from migrations import column_exists
+
+
+def upgrade(connection):
+    for table in ('die_pattern_items', 'other_items'):
+        if not column_exists(connection, table, 'version'):
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+    connection.commit()
@@ -0,0 +1,7 @@
+"""Fill the pump search index (search_terms, created by db.create_all)"""
+from utils.search import rebuild_search_index
+
+
+def upgrade(connection):
+    rebuild_search_index(connection)
+    connection.commit()
@@ -0,0 +1,7 @@
+"""Fill the die & pattern stage tables (created by db.create_all)"""
+from utils.stages import rebuild_die_stages
+
+
+def upgrade(connection):
+    rebuild_die_stages(connection)
+    connection.commit()
@@ -0,0 +1,7 @@
+"""Fill the per-pump progress summary (pump_progress, created by db.create_all)"""
+from utils.progress import rebuild_pump_progress
+
+
+def upgrade(connection):
+    rebuild_pump_progress(connection)
+    connection.commit()
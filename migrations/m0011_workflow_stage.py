@@ -0,0 +1,13 @@
+"""pumps.workflow_stage, the testing workflow's current stage (see utils/workflow.py)"""
+from sqlalchemy import text
+
+from migrations import column_exists
+from utils.workflow import rebuild_workflow_stages
+
+
+def upgrade(connection):
+    if not column_exists(connection, 'pumps', 'workflow_stage'):
+        connection.execute(text("ALTER TABLE pumps ADD COLUMN workflow_stage VARCHAR(20) NOT NULL DEFAULT 'NEW'"))
+        connection.commit()
+    rebuild_workflow_stages(connection)
+    connection.commit()
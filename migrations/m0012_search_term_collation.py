@@ -0,0 +1,17 @@
+"""Binary search_terms.term on MySQL and accent-folded terms (see utils/search.py)"""
+from sqlalchemy import text
+
+from utils.search import rebuild_search_index
+
+
+def upgrade(connection):
+    if connection.dialect.name == 'mysql':
+        # Emptied first: the rebuild below rewrites every row anyway
+        connection.execute(text('DELETE FROM search_terms'))
+        connection.execute(text(
+            'ALTER TABLE search_terms MODIFY term VARCHAR(64) '
+            'CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL'
+        ))
+        connection.commit()
+    rebuild_search_index(connection)
+    connection.commit()
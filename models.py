@@ -1,6 +1,7 @@
 from extensions import db
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy.dialects import mysql
 
 user_roles = db.Table(
     'user_roles',
@@ -32,12 +33,27 @@ class Role(db.Model):
     name = db.Column(db.String(50), unique=True)
 
 
+class PrincipalInvalidation(db.Model):
+    """User whose cached principal every process must drop; see utils/principal.py"""
+    __tablename__ = 'principal_invalidations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)  # no FK: deleted users are listed too
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+
 class Pump(db.Model):
     __tablename__ = 'pumps'
+    __table_args__ = (
+        db.Index('ix_pumps_status_deadline', 'status', 'deadline_date'),
+        db.Index('ix_pumps_pump_type', 'pump_type'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200))
     pump_type = db.Column(db.String(20))  # VERSIL or OTHER
-    drawing_path = db.Column(db.String(255))
+    drawing_path = db.Column(db.String(255))  # storage key, see utils/storage.py
+    drawing_name = db.Column(db.String(255))  # original file name
     
     # New fields
     hp = db.Column(db.Numeric(10, 2))  # Horse Power (1.0, 2.0, etc.)
@@ -57,9 +73,13 @@ class Pump(db.Model):
     gauge = db.Column(db.String(100))
     weight = db.Column(db.Numeric(10, 4))
     
-    deadline_date = db.Column(db.String(10))  # DD/MM/YYYY format
+    deadline_date = db.Column(db.Date)  # shown as DD/MM/YYYY
     
     status = db.Column(db.String(50), default='PENDING')
+    # NEW/ASSEMBLED/IN_TESTING/APPROVED; moved only by utils/workflow.py
+    workflow_stage = db.Column(db.String(20), nullable=False, default='NEW', server_default='NEW')
+    # Bumped on any change to the pump or its rows; see utils/versioning.py
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -70,6 +90,9 @@ class Pump(db.Model):
         passive_deletes=True
     )
 
+    # Written by utils/progress.py with Core statements, never through the ORM
+    progress = db.relationship('PumpProgress', uselist=False, viewonly=True)
+
 class Part(db.Model):
     __tablename__ = 'parts'
     id = db.Column(db.Integer, primary_key=True)
@@ -98,6 +121,9 @@ class Part(db.Model):
 
 class DiePatternItem(db.Model):
     __tablename__ = 'die_pattern_items'
+    __table_args__ = (
+        db.UniqueConstraint('pump_id', 'part_id', name='uq_die_pattern_items_pump_part'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -107,13 +133,13 @@ class DiePatternItem(db.Model):
     pattern_cavity = db.Column(db.String(100))
     item_weight = db.Column(db.Numeric(10, 4))
 
-    making_pattern_date = db.Column(db.String(10))
-    complete_pattern_date = db.Column(db.String(10))
-    send_foundry_pattern_date = db.Column(db.String(10))
-    casting_date = db.Column(db.String(10))
-    drawing_date = db.Column(db.String(10))
-    casting_mc_date = db.Column(db.String(10))
-    mc_received_date = db.Column(db.String(10))
+    making_pattern_date = db.Column(db.Date, index=True)
+    complete_pattern_date = db.Column(db.Date, index=True)
+    send_foundry_pattern_date = db.Column(db.Date, index=True)
+    casting_date = db.Column(db.Date, index=True)
+    drawing_date = db.Column(db.Date, index=True)
+    casting_mc_date = db.Column(db.Date, index=True)
+    mc_received_date = db.Column(db.Date, index=True)
 
     mc_sample_rate = db.Column(db.Numeric(10, 4))
     mc_qty_rate = db.Column(db.Numeric(10, 4))
@@ -125,10 +151,15 @@ class DiePatternItem(db.Model):
 
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    # Row version for optimistic concurrency on grid saves; see utils/grid.py
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
 
 class OtherItem(db.Model):
     __tablename__ = 'other_items'
+    __table_args__ = (
+        db.UniqueConstraint('pump_id', 'part_id', name='uq_other_items_pump_part'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -138,16 +169,16 @@ class OtherItem(db.Model):
     material_specification = db.Column(db.String(255))
     item_weight = db.Column(db.Numeric(10, 4))
 
-    drawing_date = db.Column(db.String(10))
-    send_party_drawing_date = db.Column(db.String(10))
+    drawing_date = db.Column(db.Date, index=True)
+    send_party_drawing_date = db.Column(db.Date, index=True)
     party_name = db.Column(db.String(255))
-    party_received_date = db.Column(db.String(10))
-    inward_date = db.Column(db.String(10))
+    party_received_date = db.Column(db.Date, index=True)
+    inward_date = db.Column(db.Date, index=True)
 
     sample_price = db.Column(db.Numeric(10, 4))
     qty_price = db.Column(db.Numeric(10, 4))
 
-    qc_date = db.Column(db.String(10))
+    qc_date = db.Column(db.Date, index=True)
     qc_status = db.Column(db.Enum('OK', 'REJECTED'))
 
     status = db.Column(db.Enum('PENDING', 'COMPLETED'), default='PENDING')
@@ -157,6 +188,8 @@ class OtherItem(db.Model):
 
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    # Row version for optimistic concurrency on grid saves; see utils/grid.py
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
 
 class TestingWorkflow(db.Model):
@@ -164,11 +197,164 @@ class TestingWorkflow(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     pump_id = db.Column(db.Integer, db.ForeignKey('pumps.id', ondelete='CASCADE'), nullable=False)
-    date = db.Column(db.String(10), nullable=False)  # DD/MM/YYYY
+    date = db.Column(db.Date, nullable=False, index=True)  # shown as DD/MM/YYYY
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     action = db.Column(db.Enum('Assembly', 'Testing', 'Testing Report Date', 'Final Approved', 'Rejected by Boss'), nullable=False)
     remark = db.Column(db.Text)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
 
     user = db.relationship('User')
-    pump = db.relationship('Pump')
\ No newline at end of file
+    pump = db.relationship('Pump')
+
+class PumpStatusCount(db.Model):
+    """Pumps per (status, pump_type); kept current by utils/summary.py"""
+    __tablename__ = 'pump_status_counts'
+
+    status = db.Column(db.String(50), primary_key=True)
+    pump_type = db.Column(db.String(20), primary_key=True)  # '' when not set
+    pump_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PumpDeadlineCount(db.Model):
+    """PENDING pumps per deadline date; kept current by utils/summary.py"""
+    __tablename__ = 'pump_deadline_counts'
+
+    deadline_date = db.Column(db.Date, primary_key=True)
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class StoredFile(db.Model):
+    """Content-addressed upload and its reference count; see utils/storage.py"""
+    __tablename__ = 'stored_files'
+
+    path = db.Column(db.String(100), primary_key=True)  # 'ab/<sha256>.pdf'
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+
+class PumpEvent(db.Model):
+    """Change notification streamed to open pages from /events; see utils/events.py"""
+    __tablename__ = 'pump_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    pump_id = db.Column(db.Integer, index=True)  # no FK: outlives deleted pumps
+    kind = db.Column(db.String(30), nullable=False)
+    data = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+
+
+class Job(db.Model):
+    """Background job run by `flask run-worker`; see utils/jobs.py"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), nullable=False, default='QUEUED')  # QUEUED, RUNNING, DONE, FAILED
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer)  # user id; no FK so jobs outlive users
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    finished_at = db.Column(db.DateTime)
+
+
+class SearchTerm(db.Model):
+    """Inverted index posting for pump search; kept current by utils/search.py"""
+    __tablename__ = 'search_terms'
+
+    # Binary on MySQL: its default collation would treat distinct tokens
+    # (utils.search.tokenize) as the same key
+    term = db.Column(db.String(64).with_variant(mysql.VARCHAR(64, charset='utf8mb4', collation='utf8mb4_bin'), 'mysql'),
+                     primary_key=True)
+    pump_id = db.Column(db.Integer, db.ForeignKey('pumps.id', ondelete='CASCADE'),
+                        primary_key=True, index=True)
+    field = db.Column(db.String(20), primary_key=True)  # see utils.search.FIELD_WEIGHTS
+    weight = db.Column(db.Integer, nullable=False)
+
+
+class PendingRefresh(db.Model):
+    """Pump waiting for a refresh_derived job; see utils/versioning.py"""
+    __tablename__ = 'pending_refreshes'
+
+    # No foreign key: a deleted pump still has index rows to clear
+    pump_id = db.Column(db.Integer, primary_key=True)
+    requested_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class DieStageDuration(db.Model):
+    """Die & pattern items per (pump, stage, days taken); see utils/stages.py"""
+    __tablename__ = 'die_stage_durations'
+
+    pump_id = db.Column(db.Integer, db.ForeignKey('pumps.id', ondelete='CASCADE'), primary_key=True)
+    stage = db.Column(db.String(20), primary_key=True)
+    days = db.Column(db.Integer, primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False)
+
+
+class DieStageOpen(db.Model):
+    """Die & pattern items currently in a stage, per pump; see utils/stages.py"""
+    __tablename__ = 'die_stage_open'
+
+    pump_id = db.Column(db.Integer, db.ForeignKey('pumps.id', ondelete='CASCADE'), primary_key=True)
+    stage = db.Column(db.String(20), primary_key=True)
+    open_count = db.Column(db.Integer, nullable=False)
+    oldest_since = db.Column(db.Date, nullable=False)
+
+
+class PumpProgress(db.Model):
+    """Per-pump progress counts for list pages; kept current by utils/progress.py"""
+    __tablename__ = 'pump_progress'
+
+    pump_id = db.Column(db.Integer, db.ForeignKey('pumps.id', ondelete='CASCADE'), primary_key=True)
+    parts_count = db.Column(db.Integer, nullable=False, default=0)
+    die_total = db.Column(db.Integer, nullable=False, default=0)
+    die_completed = db.Column(db.Integer, nullable=False, default=0)
+    other_total = db.Column(db.Integer, nullable=False, default=0)
+    other_completed = db.Column(db.Integer, nullable=False, default=0)
+    other_qc_ok = db.Column(db.Integer, nullable=False, default=0)
+    other_qc_rejected = db.Column(db.Integer, nullable=False, default=0)
+    last_action = db.Column(db.String(50))
+    last_action_date = db.Column(db.Date)
+    percent_done = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def die_pending(self):
+        return self.die_total - self.die_completed
+
+
+class FieldChange(db.Model):
+    """One inserted, deleted or changed-field record; append-only, see utils/audit.py"""
+    __tablename__ = 'field_changes'
+    __table_args__ = (
+        db.Index('ix_field_changes_pump_field', 'pump_id', 'field'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    pump_id = db.Column(db.Integer, index=True)  # no FK: history outlives deleted pumps
+    entity = db.Column(db.String(20), nullable=False)  # pump, part, die_item, other_item
+    row_id = db.Column(db.Integer)
+    action = db.Column(db.String(10), nullable=False)  # INSERT, UPDATE, DELETE
+    field = db.Column(db.String(50))  # UPDATE only
+    old_value = db.Column(db.Text)
+    new_value = db.Column(db.Text)
+    changed_by = db.Column(db.Integer)  # user id; no FK so history outlives users
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+
+class PumpSnapshot(db.Model):
+    """One frozen read-only page of a COMPLETED pump, zlib-compressed; see utils/snapshots.py"""
+    __tablename__ = 'pump_snapshots'
+
+    pump_id = db.Column(db.Integer, db.ForeignKey('pumps.id', ondelete='CASCADE'), primary_key=True)
+    page = db.Column(db.String(20), primary_key=True)  # info, parts, die, other, workflow, ...
+    version = db.Column(db.Integer, nullable=False)  # pumps.version it was frozen at
+    body = db.Column(db.LargeBinary(length=2 ** 24), nullable=False)  # MEDIUMBLOB on MySQL
+    created_at = db.Column(db.DateTime, nullable=False)
@@ -34,6 +34,7 @@ function addRow() {
   `;
   
   tbody.appendChild(newRow);
+  return newRow;
 }
 
 function removeRow(button) {
@@ -42,14 +43,33 @@ function removeRow(button) {
   
   // Don't remove if it's the last row
   if (tbody.querySelectorAll('tr').length > 1) {
+    GridDelta.remove(row);
     row.remove();
   } else {
     showAlert('Cannot remove the last row. Add a new row first.', 'warning');
   }
 }
 
+function collectRow(row) {
+  return {
+    part_id: parseInt(row.querySelector('.part-select').value) || null,
+    pattern_cavity: row.querySelector('.pattern_cavity').value || null,
+    item_weight: row.querySelector('.item_weight').value || null,
+    making_pattern_date: row.querySelector('.making_pattern_date').value || null,
+    complete_pattern_date: row.querySelector('.complete_pattern_date').value || null,
+    send_foundry_pattern_date: row.querySelector('.send_foundry_pattern_date').value || null,
+    casting_date: row.querySelector('.casting_date').value || null,
+    drawing_date: row.querySelector('.drawing_date').value || null,
+    casting_mc_date: row.querySelector('.casting_mc_date').value || null,
+    mc_received_date: row.querySelector('.mc_received_date').value || null,
+    mc_sample_rate: row.querySelector('.mc_sample_rate').value || null,
+    mc_qty_rate: row.querySelector('.mc_qty_rate').value || null,
+    remark: row.querySelector('.remark').value || null,
+    status: row.querySelector('.status-select')?.value || 'PENDING'
+  };
+}
+
 function saveAll() {
-  const rows = [];
   const tbody = document.querySelector('#diePatternTable tbody');
   const tableRows = tbody.querySelectorAll('tr');
   
@@ -70,28 +90,12 @@ function saveAll() {
     return;
   }
   
-  // Collect all row data
-  tableRows.forEach(row => {
-    const rowData = {
-      part_id: parseInt(row.querySelector('.part-select').value),
-      pattern_cavity: row.querySelector('.pattern_cavity').value || null,
-      item_weight: row.querySelector('.item_weight').value || null,
-      making_pattern_date: row.querySelector('.making_pattern_date').value || null,
-      complete_pattern_date: row.querySelector('.complete_pattern_date').value || null,
-      send_foundry_pattern_date: row.querySelector('.send_foundry_pattern_date').value || null,
-      casting_date: row.querySelector('.casting_date').value || null,
-      drawing_date: row.querySelector('.drawing_date').value || null,
-      casting_mc_date: row.querySelector('.casting_mc_date').value || null,
-      mc_received_date: row.querySelector('.mc_received_date').value || null,
-      mc_sample_rate: row.querySelector('.mc_sample_rate').value || null,
-      mc_qty_rate: row.querySelector('.mc_qty_rate').value || null,
-      remark: row.querySelector('.remark').value || null,
-      status: row.querySelector('.status-select')?.value || 'PENDING'
-
-    };
-    
-    rows.push(rowData);
-  });
+  // Only rows that were added, changed or removed since the page loaded
+  const changes = GridDelta.changes(tbody, collectRow);
+  if (GridDelta.isEmpty(changes)) {
+    showAlert('No changes to save', 'info');
+    return;
+  }
   
   // Get pump_id from URL
   const pumpId = window.location.pathname.split('/')[2];
@@ -102,11 +106,17 @@ function saveAll() {
     headers: {
       'Content-Type': 'application/json'
     },
-    body: JSON.stringify({ rows: rows })
+    body: JSON.stringify({ changes: changes })
   })
   .then(response => response.json())
   .then(data => {
     if (data.success) {
+      GridDelta.apply(tbody, collectRow, data);
+      if (data.conflicts.length) {
+        // Keep the page so the highlighted rows can be reviewed
+        showAlert(data.message, 'warning');
+        return;
+      }
       showAlert(data.message, 'success');
       // Reload page after 1 second to show updated status
       setTimeout(() => {
@@ -146,3 +156,56 @@ document.addEventListener('change', function (e) {
     }
   }
 });
+
+document.addEventListener('DOMContentLoaded', function () {
+  GridDelta.init(document.querySelector('#diePatternTable tbody'), collectRow);
+});
+
+// ==================== LIVE UPDATES ====================
+
+const GRID_FIELDS = [
+  'pattern_cavity',
+  'item_weight',
+  'making_pattern_date',
+  'complete_pattern_date',
+  'send_foundry_pattern_date',
+  'casting_date',
+  'drawing_date',
+  'casting_mc_date',
+  'mc_received_date',
+  'mc_sample_rate',
+  'mc_qty_rate',
+  'remark'
+];
+
+function fillRow(tr, row) {
+  tr.querySelector('.part-select').value = row.part_id;
+  GRID_FIELDS.forEach(field => {
+    tr.querySelector(`.${field}`).value = row[field] ?? '';
+  });
+  const status = tr.querySelector('.status-select');
+  status.value = row.status || 'PENDING';
+  status.classList.toggle('bg-success', status.value === 'COMPLETED');
+  status.classList.toggle('bg-warning', status.value !== 'COMPLETED');
+}
+
+async function refreshFromServer(pumpId) {
+  const response = await fetch(`/api/v1/pumps/${pumpId}/die-items`);
+  if (!response.ok) return;
+  const data = await response.json();
+  GridDelta.merge(document.querySelector('#diePatternTable tbody'), data.die_items, { collectRow, fillRow, addRow });
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+  const pumpId = window.location.pathname.split('/')[2];
+  Live.on('grid.saved', event => {
+    if (event.grid === 'die') refreshFromServer(pumpId);
+  });
+  Live.on('pump.status', event => {
+    Live.notice(`${event.by} changed this pump to ${event.status}. Reload the page before editing further.`, 'warning');
+  });
+  Live.on('pump.deleted', event => {
+    Live.notice(`${event.by} deleted this pump.`, 'danger');
+  });
+  Live.start({ pump_id: pumpId });
+});
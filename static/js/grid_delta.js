@@ -0,0 +1,125 @@
+// Delta saves for the die & pattern and other items grids.
+//
+// Rows rendered by the server carry data-id and data-version. The values
+// each row had when the page loaded are remembered, so a save only sends
+// rows that were added, changed or removed. Changed and removed rows carry
+// the version they were read at; the server refuses them if someone else
+// saved the row in the meantime and reports them back as conflicts.
+const GridDelta = {
+  removed: [],
+  nextKey: 1,
+
+  // Remember the loaded values of every existing row
+  init(tbody, collectRow) {
+    tbody.querySelectorAll('tr[data-id]').forEach(tr => {
+      tr.dataset.original = JSON.stringify(collectRow(tr));
+    });
+  },
+
+  // Call before a row is taken out of the table
+  remove(tr) {
+    if (tr.dataset.id) {
+      this.removed.push({ id: tr.dataset.id, version: tr.dataset.version });
+    }
+  },
+
+  changes(tbody, collectRow) {
+    const changes = { added: [], changed: [], removed: this.removed.slice() };
+    tbody.querySelectorAll('tr').forEach(tr => {
+      const row = collectRow(tr);
+      if (!row.part_id) return;
+      if (!tr.dataset.id) {
+        tr.dataset.key = tr.dataset.key || `new-${this.nextKey++}`;
+        changes.added.push({ key: tr.dataset.key, ...row });
+      } else if (this.isEdited(tr, collectRow)) {
+        changes.changed.push({ key: tr.dataset.id, id: tr.dataset.id, version: tr.dataset.version, ...row });
+      }
+    });
+    return changes;
+  },
+
+  isEmpty(changes) {
+    return !changes.added.length && !changes.changed.length && !changes.removed.length;
+  },
+
+  // Record the ids/versions the server returned and mark conflicted rows
+  apply(tbody, collectRow, result) {
+    this.removed = [];
+    const byKey = {};
+    tbody.querySelectorAll('tr').forEach(tr => {
+      tr.classList.remove('table-danger');
+      tr.removeAttribute('title');
+      const key = tr.dataset.key || tr.dataset.id;
+      if (key) byKey[key] = tr;
+    });
+
+    (result.rows || []).forEach(saved => {
+      const tr = byKey[String(saved.key)];
+      if (!tr) return;
+      tr.dataset.id = saved.id;
+      tr.dataset.version = saved.version;
+      delete tr.dataset.key;
+      tr.dataset.original = JSON.stringify(collectRow(tr));
+    });
+
+    (result.conflicts || []).forEach(conflict => {
+      const tr = byKey[String(conflict.key)];
+      if (!tr) return;
+      this.markConflict(tr, `Not saved: ${conflict.reason}`);
+    });
+  },
+
+  markConflict(tr, reason) {
+    tr.classList.add('table-danger');
+    tr.title = `${reason}. Reload the page to see the latest values.`;
+  },
+
+  isEdited(tr, collectRow) {
+    return JSON.stringify(collectRow(tr)) !== tr.dataset.original;
+  },
+
+  // Bring in rows someone else saved (serverRows as returned by the read
+  // API). Rows edited here since they were loaded are left as they are and
+  // marked, because saving them would conflict.
+  merge(tbody, serverRows, { collectRow, fillRow, addRow }) {
+    const readOnly = tbody.closest('table').dataset.readonly === 'true';
+    const local = {};
+    tbody.querySelectorAll('tr[data-id]').forEach(tr => { local[tr.dataset.id] = tr; });
+    const removedHere = new Set(this.removed.map(row => String(row.id)));
+
+    serverRows.forEach(row => {
+      const id = String(row.id);
+      let tr = local[id];
+      delete local[id];
+      if (removedHere.has(id)) return;
+      if (tr && Number(tr.dataset.version) >= row.version) return;
+      if (tr && this.isEdited(tr, collectRow)) {
+        this.markConflict(tr, 'Changed by someone else');
+        return;
+      }
+      if (!tr) {
+        tr = addRow();
+        if (readOnly) {
+          tr.querySelectorAll('input').forEach(input => { input.readOnly = true; });
+          tr.querySelectorAll('select').forEach(select => { select.disabled = true; });
+          tr.lastElementChild.remove();  // no remove button
+        }
+      }
+      fillRow(tr, row);
+      tr.dataset.id = row.id;
+      tr.dataset.version = row.version;
+      tr.classList.remove('table-danger');
+      tr.removeAttribute('title');
+      tr.dataset.original = JSON.stringify(collectRow(tr));
+    });
+
+    // Whatever is left was deleted by someone else
+    Object.values(local).forEach(tr => {
+      if (this.isEdited(tr, collectRow)) {
+        this.markConflict(tr, 'Deleted by someone else');
+      } else {
+        tr.remove();
+      }
+    });
+  }
+};
@@ -0,0 +1,23 @@
+// Background jobs (see /api/jobs/<id>): poll until the job is DONE or
+// FAILED and resolve with its status. Polling slows down the longer the
+// job runs.
+async function waitForJob(statusUrl, onUpdate) {
+  let delay = 500;
+  while (true) {
+    const response = await fetch(statusUrl, { cache: 'no-store' });
+    if (!response.ok) throw new Error(`Job status HTTP ${response.status}`);
+    const job = await response.json();
+    if (onUpdate) onUpdate(job);
+    if (job.status === 'DONE' || job.status === 'FAILED') return job;
+    await new Promise(resolve => setTimeout(resolve, delay));
+    delay = Math.min(delay * 2, 5000);
+  }
+}
+
+// POST to a route that queues a job, then wait for the job
+async function runJob(url, body, onUpdate) {
+  const response = await fetch(url, { method: 'POST', body });
+  const data = await response.json();
+  if (!data.success) throw new Error(data.error || 'Could not start the job');
+  return waitForJob(data.status_url, onUpdate);
+}
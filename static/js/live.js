@@ -0,0 +1,51 @@
+// Live updates pushed by the server over /events (see utils/events.py).
+//
+//   Live.on('pump.status', event => { ... });
+//   Live.start({ pump_id: 5 });
+//
+// Every event has id, kind, pump_id and 'by' (the user who made the
+// change). The browser reconnects by itself and the server replays what
+// was missed in between, starting a little before the last event seen so
+// late commits aren't lost; events already handled are skipped by id.
+const Live = {
+  KINDS: ['pump.status', 'pump.deleted', 'workflow.saved', 'grid.saved'],
+  SEEN_LIMIT: 500,
+  handlers: {},
+  seen: new Set(),
+  source: null,
+
+  on(kind, handler) {
+    (this.handlers[kind] = this.handlers[kind] || []).push(handler);
+    return this;
+  },
+
+  start(params = {}) {
+    if (!window.EventSource || this.source) return;
+    const query = new URLSearchParams(params).toString();
+    this.source = new EventSource('/events' + (query ? `?${query}` : ''));
+    this.KINDS.forEach(kind => {
+      this.source.addEventListener(kind, message => {
+        const event = JSON.parse(message.data);
+        if (this.seen.has(event.id)) return;
+        this.seen.add(event.id);
+        // Sets iterate in insertion order, so this forgets the oldest id
+        if (this.seen.size > this.SEEN_LIMIT) this.seen.delete(this.seen.values().next().value);
+        (this.handlers[kind] || []).forEach(handler => handler(event));
+      });
+    });
+  },
+
+  // Dismissible notice at the top of the page
+  notice(message, type = 'info') {
+    const box = document.createElement('div');
+    box.className = `alert alert-${type} alert-dismissible fade show`;
+    box.setAttribute('role', 'alert');
+    box.textContent = message;
+    const close = document.createElement('button');
+    close.type = 'button';
+    close.className = 'btn-close';
+    close.setAttribute('data-bs-dismiss', 'alert');
+    box.appendChild(close);
+    document.querySelector('.container-fluid').prepend(box);
+  }
+};
@@ -40,6 +40,7 @@ function addRow() {
   `;
   
   tbody.appendChild(newRow);
+  return newRow;
 }
 
 function removeRow(button) {
@@ -48,6 +49,7 @@ function removeRow(button) {
   
   // Don't remove if it's the last row
   if (tbody.querySelectorAll('tr').length > 1) {
+    GridDelta.remove(row);
     row.remove();
   } else {
     showAlert('Cannot remove the last row. Add a new row first.', 'warning');
@@ -56,30 +58,36 @@ function removeRow(button) {
 
 
 
+function collectRow(tr) {
+  return {
+    part_id: tr.querySelector(".part-select")?.value,
+    material_specification: tr.querySelector(".material_specification")?.value,
+    item_weight: tr.querySelector(".item_weight")?.value,
+    drawing_date: tr.querySelector(".drawing_date")?.value,
+    send_party_drawing_date: tr.querySelector(".send_party_drawing_date")?.value,
+    party_name: tr.querySelector(".party_name")?.value,
+    party_received_date: tr.querySelector(".party_received_date")?.value,
+    inward_date: tr.querySelector(".inward_date")?.value,
+    sample_price: tr.querySelector(".sample_price")?.value,
+    qty_price: tr.querySelector(".qty_price")?.value,
+    qc_date: tr.querySelector(".qc_date")?.value,
+    qc_status: tr.querySelector(".qc_status")?.value,
+    remark: tr.querySelector(".remark")?.value,
+    status: tr.querySelector(".status-select")?.value
+  };
+}
+
 function saveAll() {
-  const rows = [];
-
-  document.querySelectorAll("#otherItemTable tbody tr").forEach(tr => {
-    const partId = tr.querySelector(".part-select")?.value;
-    if (!partId) return;
-
-    rows.push({
-      part_id: partId,
-      material_specification: tr.querySelector(".material_specification")?.value,
-      item_weight: tr.querySelector(".item_weight")?.value,
-      drawing_date: tr.querySelector(".drawing_date")?.value,
-      send_party_drawing_date: tr.querySelector(".send_party_drawing_date")?.value,
-      party_name: tr.querySelector(".party_name")?.value,
-      party_received_date: tr.querySelector(".party_received_date")?.value,
-      inward_date: tr.querySelector(".inward_date")?.value,
-      sample_price: tr.querySelector(".sample_price")?.value,
-      qty_price: tr.querySelector(".qty_price")?.value,
-      qc_date: tr.querySelector(".qc_date")?.value,
-      qc_status: tr.querySelector(".qc_status")?.value,
-      remark: tr.querySelector(".remark")?.value,
-      status: tr.querySelector(".status-select")?.value
-    });
-  });
+  const tbody = document.querySelector("#otherItemTable tbody");
+
+  // Only rows that were added, changed or removed since the page loaded
+  const changes = GridDelta.changes(tbody, collectRow);
+  if (GridDelta.isEmpty(changes)) {
+    const alertBox = document.getElementById("alertBox");
+    alertBox.className = 'alert alert-info';
+    alertBox.textContent = "No changes to save";
+    return;
+  }
 
   fetch(window.location.pathname, {
     method: "POST",
@@ -87,15 +95,22 @@ function saveAll() {
       "Content-Type": "application/json",
       "X-Requested-With": "XMLHttpRequest"
     },
-    body: JSON.stringify({ rows })
+    body: JSON.stringify({ changes })
   })
   .then(res => res.json())
   .then(data => {
     const alertBox = document.getElementById("alertBox");
+    if (data.success) {
+      GridDelta.apply(tbody, collectRow, data);
+    }
 
     // Reset classes and add the base 'alert' class
     alertBox.className = 'alert'; // Clear all classes and add base 'alert'
-    alertBox.classList.add(data.success ? "alert-success" : "alert-danger");
+    if (!data.success) {
+      alertBox.classList.add("alert-danger");
+    } else {
+      alertBox.classList.add(data.conflicts.length ? "alert-warning" : "alert-success");
+    }
     alertBox.textContent = data.message;
 
     // auto-hide after 3 seconds
@@ -109,4 +124,57 @@ function saveAll() {
     alertBox.textContent = "Something went wrong while saving.";
     console.error(err);
   });
-}
\ No newline at end of file
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  GridDelta.init(document.querySelector("#otherItemTable tbody"), collectRow);
+});
+
+// ==================== LIVE UPDATES ====================
+
+const GRID_FIELDS = [
+  'material_specification',
+  'item_weight',
+  'drawing_date',
+  'send_party_drawing_date',
+  'party_name',
+  'party_received_date',
+  'inward_date',
+  'sample_price',
+  'qty_price',
+  'qc_date',
+  'qc_status',
+  'remark'
+];
+
+function fillRow(tr, row) {
+  tr.querySelector('.part-select').value = row.part_id;
+  GRID_FIELDS.forEach(field => {
+    tr.querySelector(`.${field}`).value = row[field] ?? '';
+  });
+  const status = tr.querySelector('.status-select');
+  status.value = row.status || 'PENDING';
+  status.classList.toggle('bg-success', status.value === 'COMPLETED');
+  status.classList.toggle('bg-warning', status.value !== 'COMPLETED');
+}
+
+async function refreshFromServer(pumpId) {
+  const response = await fetch(`/api/v1/pumps/${pumpId}/other-items`);
+  if (!response.ok) return;
+  const data = await response.json();
+  GridDelta.merge(document.querySelector('#otherItemTable tbody'), data.other_items, { collectRow, fillRow, addRow });
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+  const pumpId = window.location.pathname.split('/')[2];
+  Live.on('grid.saved', event => {
+    if (event.grid === 'other') refreshFromServer(pumpId);
+  });
+  Live.on('pump.status', event => {
+    Live.notice(`${event.by} changed this pump to ${event.status}. Reload the page before editing further.`, 'warning');
+  });
+  Live.on('pump.deleted', event => {
+    Live.notice(`${event.by} deleted this pump.`, 'danger');
+  });
+  Live.start({ pump_id: pumpId });
+});
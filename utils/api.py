@@ -0,0 +1,143 @@
+"""
+Read API for pumps and their rows (/api/v1/...).
+
+Each resource lists the fields it can return; ?fields=a,b selects a subset
+(id is always included) and only those columns are queried. A pump can
+embed its rows with ?include=parts,die_items,... in the same response.
+
+ETags for a single pump come from pumps.version (utils/versioning.py), so
+a conditional GET costs one single-row lookup and answers 304 when nothing
+changed. Pump list pages hash their body instead.
+"""
+import hashlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import select
+
+from extensions import db
+from models import DiePatternItem, OtherItem, Part, Pump, TestingWorkflow, User
+from utils.validators import format_ddmmyyyy
+
+
+class ApiError(ValueError):
+    """Bad query parameters; reported to the client as a 400"""
+
+
+def _columns(model, names):
+    return {name: getattr(model, name) for name in names}
+
+
+RESOURCES = {
+    'pump': {
+        'columns': _columns(Pump, [
+            'id', 'name', 'pump_type', 'status', 'hp', 'phase', 'pipe_size',
+            'stamping', 'stamping_grade', 'capacitor', 'r_gauge', 'r_gauge_weight',
+            's_gauge', 's_gauge_weight', 'gauge', 'weight', 'deadline_date',
+            'drawing_path', 'drawing_name', 'version', 'created_at',
+        ]),
+        'default': ['id', 'name', 'pump_type', 'status', 'deadline_date', 'version'],
+    },
+    'parts': {
+        'model': Part,
+        'columns': _columns(Part, [
+            'id', 'source', 'part_name', 'weight', 'quantity', 'brand', 'material',
+        ]),
+    },
+    'die_items': {
+        'model': DiePatternItem,
+        'columns': _columns(DiePatternItem, [
+            'id', 'part_id', 'pattern_cavity', 'item_weight', 'making_pattern_date',
+            'complete_pattern_date', 'send_foundry_pattern_date', 'casting_date',
+            'drawing_date', 'casting_mc_date', 'mc_received_date', 'mc_sample_rate',
+            'mc_qty_rate', 'status', 'status_override', 'remark', 'updated_at', 'version',
+        ]),
+    },
+    'other_items': {
+        'model': OtherItem,
+        'columns': _columns(OtherItem, [
+            'id', 'part_id', 'material_specification', 'item_weight', 'drawing_date',
+            'send_party_drawing_date', 'party_name', 'party_received_date',
+            'inward_date', 'sample_price', 'qty_price', 'qc_date', 'qc_status',
+            'status', 'status_override', 'remark', 'updated_at', 'version',
+        ]),
+    },
+    'workflow': {
+        'model': TestingWorkflow,
+        'columns': {
+            **_columns(TestingWorkflow, ['id', 'date', 'action', 'remark', 'user_id', 'created_at']),
+            'user': User.username,
+        },
+        'joins': [(User, User.id == TestingWorkflow.user_id)],
+    },
+}
+
+CHILD_RESOURCES = ('parts', 'die_items', 'other_items', 'workflow')
+
+
+def parse_fields(resource, value):
+    """Field names selected by ?fields= (the default set when empty); id first"""
+    spec = RESOURCES[resource]
+    if not value:
+        return list(spec.get('default') or spec['columns'])
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in spec['columns']]
+    if unknown:
+        raise ApiError(f'Unknown field(s) for {resource}: {", ".join(unknown)}')
+    return ['id'] + [name for name in dict.fromkeys(names) if name != 'id']
+
+
+def parse_include(value):
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in CHILD_RESOURCES]
+    if unknown:
+        raise ApiError(f'Unknown include(s): {", ".join(unknown)}')
+    return list(dict.fromkeys(names))
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return format_ddmmyyyy(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _rows(stmt, fields):
+    return [
+        {name: _json_value(value) for name, value in zip(fields, row)}
+        for row in db.session.execute(stmt)
+    ]
+
+
+def fetch_children(resource, pump_id, fields):
+    """Rows of one child resource of a pump, ordered by id"""
+    spec = RESOURCES[resource]
+    model = spec['model']
+    stmt = select(*[spec['columns'][name] for name in fields]).select_from(model)
+    for target, onclause in spec.get('joins', []):
+        stmt = stmt.outerjoin(target, onclause)
+    stmt = stmt.where(model.pump_id == pump_id).order_by(model.id)
+    return _rows(stmt, fields)
+
+
+def fetch_pumps(where, fields, limit):
+    """Pumps matching where, ordered by id"""
+    columns = RESOURCES['pump']['columns']
+    stmt = select(*[columns[name] for name in fields]).where(*where).order_by(Pump.id).limit(limit)
+    return _rows(stmt, fields)
+
+
+def pump_version(pump_id):
+    """pumps.version for one pump, None if it does not exist"""
+    return db.session.execute(
+        select(Pump.version).where(Pump.id == pump_id)
+    ).scalar_one_or_none()
+
+
+def make_etag(*parts):
+    """Strong ETag over the data version and everything that shapes the body"""
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:32]
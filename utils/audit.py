@@ -0,0 +1,238 @@
+"""
+Field-level change history for pumps, parts and grid rows.
+
+Every insert, delete and changed field of a Pump, Part, DiePatternItem or
+OtherItem becomes one append-only field_changes row: who, when, which field,
+the old and the new value. ORM writes are picked up by a flush hook; the
+grid saves in utils/grid.py write with Core statements and call
+record_update()/record_insert()/record_delete() themselves.
+
+Records wait in session.info until the transaction commits (a rollback
+drops them), then go to a per-process buffer. A background thread writes
+the buffer in batches of AUDIT_BATCH_SIZE rows, or every
+AUDIT_FLUSH_SECONDS, with one multi-row INSERT. A save therefore never
+waits for its audit rows. The price is that records still in the buffer
+are lost if the process is killed. history() flushes this process's buffer
+before it reads.
+"""
+import atexit
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import has_request_context
+from flask_login import current_user
+from sqlalchemy import event, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import DiePatternItem, FieldChange, OtherItem, Part, Pump, User
+
+ENTITIES = {
+    Pump: 'pump',
+    Part: 'part',
+    DiePatternItem: 'die_item',
+    OtherItem: 'other_item',
+}
+# Bookkeeping columns that change on every save
+SKIPPED = {'id', 'pump_id', 'version', 'created_at', 'updated_at', 'created_by'}
+MAX_BUFFERED = 50000
+
+_table = FieldChange.__table__
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return format(value.normalize(), 'f')
+    return str(value)
+
+
+def _user_id():
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+def _stage(session, records):
+    if records:
+        session.info.setdefault('audit_records', []).extend(records)
+
+
+def _record(entity, pump_id, row_id, action, field=None, old=None, new=None):
+    return {
+        'pump_id': pump_id, 'entity': entity, 'row_id': row_id, 'action': action,
+        'field': field, 'old_value': _text(old), 'new_value': _text(new),
+        'changed_by': _user_id(), 'changed_at': datetime.now(),
+    }
+
+
+def record_update(session, model, pump_id, row_id, old, new):
+    """Stage one record per column whose value differs between old and new"""
+    entity = ENTITIES[model]
+    _stage(session, [
+        _record(entity, pump_id, row_id, 'UPDATE', field, old.get(field), value)
+        for field, value in new.items()
+        if field not in SKIPPED and field in old and old[field] != value
+    ])
+
+
+def record_insert(session, model, pump_id, row_id, label=None):
+    _stage(session, [_record(ENTITIES[model], pump_id, row_id, 'INSERT', new=label)])
+
+
+def record_delete(session, model, pump_id, row_id, label=None):
+    _stage(session, [_record(ENTITIES[model], pump_id, row_id, 'DELETE', old=label)])
+
+
+def _label(obj):
+    if isinstance(obj, Pump):
+        return obj.name
+    if isinstance(obj, Part):
+        return obj.part_name
+    return f'part {obj.part_id}'
+
+
+def _audited_columns(model):
+    return [attr.key for attr in inspect(model).column_attrs if attr.key not in SKIPPED]
+
+
+def _noop(target, value, oldvalue, initiator):
+    pass
+
+
+# Load the old value when an audited column is assigned, so the flush hook
+# can record it even if the row had been expired by an earlier commit
+for _model in ENTITIES:
+    for _key in _audited_columns(_model):
+        event.listen(getattr(_model, _key), 'set', _noop, active_history=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _capture(session, flush_context):
+    records = []
+    for obj in session.new:
+        if type(obj) in ENTITIES:
+            pump_id = obj.id if isinstance(obj, Pump) else obj.pump_id
+            records.append(_record(ENTITIES[type(obj)], pump_id, obj.id, 'INSERT', new=_label(obj)))
+    for obj in session.deleted:
+        if type(obj) in ENTITIES:
+            pump_id = obj.id if isinstance(obj, Pump) else obj.pump_id
+            records.append(_record(ENTITIES[type(obj)], pump_id, obj.id, 'DELETE', old=_label(obj)))
+    for obj in session.dirty:
+        if type(obj) not in ENTITIES or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        pump_id = obj.id if isinstance(obj, Pump) else obj.pump_id
+        for key in _audited_columns(type(obj)):
+            history = state.attrs[key].history
+            if not history.has_changes():
+                continue
+            old = history.deleted[0] if history.deleted else None
+            new = history.added[0] if history.added else None
+            if old != new:
+                records.append(_record(ENTITIES[type(obj)], pump_id, obj.id, 'UPDATE', key, old, new))
+    _stage(session, records)
+
+
+@event.listens_for(Session, 'after_commit')
+def _buffer_committed(session):
+    records = session.info.pop('audit_records', None)
+    if records:
+        audit_buffer.add(records)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back(session, previous_transaction):
+    # A failed savepoint keeps what the outer transaction staged before it
+    if not previous_transaction.nested:
+        session.info.pop('audit_records', None)
+
+
+class AuditBuffer:
+    """Committed audit records waiting to be written in batches"""
+
+    def __init__(self, batch_size=200, flush_seconds=2.0):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.engine = None
+        self.logger = None
+        self._records = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, records):
+        with self._lock:
+            self._records.extend(records)
+            full = len(self._records) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        if self.engine is None:
+            return 0
+        with self._write_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            if not records:
+                return 0
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(insert(_table), records)
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception('Writing %d audit records failed', len(records))
+                with self._lock:
+                    # Keep them for the next try, up to a limit
+                    self._records[:0] = records[-MAX_BUFFERED:]
+                return 0
+            return len(records)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+
+audit_buffer = AuditBuffer()
+atexit.register(audit_buffer.flush)
+
+
+def init_audit(app):
+    """Point the buffer at the app's database and read its batch settings"""
+    audit_buffer.batch_size = app.config.setdefault('AUDIT_BATCH_SIZE', 200)
+    audit_buffer.flush_seconds = app.config.setdefault('AUDIT_FLUSH_SECONDS', 2.0)
+    audit_buffer.logger = app.logger
+    with app.app_context():
+        audit_buffer.engine = db.engine
+
+
+def history(session, pump_id, entities, field=None, before=None, limit=50):
+    """
+    Change records of one pump, newest first, with the user's name.
+    before pages on: pass the smallest id of the previous page.
+    Returns (records, next_before).
+    """
+    audit_buffer.flush()
+    stmt = (
+        select(_table, User.username)
+        .outerjoin(User.__table__, User.__table__.c.id == _table.c.changed_by)
+        .where(_table.c.pump_id == pump_id, _table.c.entity.in_(entities))
+    )
+    if field:
+        stmt = stmt.where(_table.c.field == field)
+    if before:
+        stmt = stmt.where(_table.c.id < before)
+    rows = session.execute(stmt.order_by(_table.c.id.desc()).limit(limit + 1)).mappings().all()
+    next_before = rows[limit - 1]['id'] if len(rows) > limit else None
+    return [dict(row) for row in rows[:limit]], next_before
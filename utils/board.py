@@ -0,0 +1,107 @@
+"""
+Plant-wide manufacturing board.
+
+One row per PENDING pump: how far its die & pattern items have got and in
+which stages the rest are waiting, its other items and QC results, and its
+testing workflow stage. All of it comes from one SELECT: the pump, its
+pump_progress row (utils/progress.py) and its die_stage_open rows
+(utils/stages.py) grouped into one column per stage. The board never
+queries per pump, however many are active.
+
+board_page() returns one keyset page in deadline order, like the pump list;
+board_rows() returns given pumps, for the page to refresh rows that changed
+(see templates/manufacturing/index.html).
+"""
+from datetime import date
+
+from sqlalchemy import case, func, select
+
+from models import DieStageOpen, Pump, PumpProgress
+from utils.pagination import keyset_page
+from utils.stages import STAGES
+
+WORKFLOW_LABELS = {
+    'NEW': 'Not started',
+    'ASSEMBLED': 'Assembled',
+    'IN_TESTING': 'In testing',
+    'APPROVED': 'Approved',
+}
+
+_open = DieStageOpen.__table__
+
+
+def _waiting():
+    """Die & pattern items waiting per pump, one column per stage"""
+    return (
+        select(
+            _open.c.pump_id,
+            *[
+                func.sum(case((_open.c.stage == key, _open.c.open_count), else_=0)).label(key)
+                for key, _, _, _ in STAGES
+            ],
+            func.min(_open.c.oldest_since).label('oldest_since'),
+        )
+        .group_by(_open.c.pump_id)
+        .subquery()
+    )
+
+
+def _progress(column):
+    return func.coalesce(column, 0).label(column.key)
+
+
+def _board_query(session):
+    waiting = _waiting()
+    return (
+        session.query(
+            Pump.id, Pump.name, Pump.pump_type, Pump.deadline_date, Pump.workflow_stage,
+            _progress(PumpProgress.die_total),
+            _progress(PumpProgress.die_completed),
+            _progress(PumpProgress.other_total),
+            _progress(PumpProgress.other_completed),
+            _progress(PumpProgress.other_qc_ok),
+            _progress(PumpProgress.other_qc_rejected),
+            _progress(PumpProgress.percent_done),
+            PumpProgress.last_action,
+            PumpProgress.last_action_date,
+            *[func.coalesce(waiting.c[key], 0).label(f'waiting_{key}') for key, _, _, _ in STAGES],
+            waiting.c.oldest_since.label('die_waiting_since'),
+        )
+        .select_from(Pump)
+        .outerjoin(PumpProgress, PumpProgress.pump_id == Pump.id)
+        .outerjoin(waiting, waiting.c.pump_id == Pump.id)
+        .filter(Pump.status == 'PENDING')
+    )
+
+
+def _sort_keys():
+    # Deadline first; pumps without one after every date
+    return [func.coalesce(Pump.deadline_date, date.max), Pump.id]
+
+
+def _as_dicts(query, rows):
+    names = [column['name'] for column in query.column_descriptions]
+    board = []
+    for row in rows:
+        item = dict(zip(names, row))
+        item['die_waiting'] = [
+            (label, item[f'waiting_{key}']) for key, label, _, _ in STAGES if item[f'waiting_{key}']
+        ]
+        item['workflow_label'] = WORKFLOW_LABELS.get(item['workflow_stage'], item['workflow_stage'])
+        board.append(item)
+    return board
+
+
+def board_page(session, after=None, per_page=50):
+    """One page of the board: (rows, next_cursor)"""
+    query = _board_query(session)
+    rows, next_cursor = keyset_page(query, _sort_keys(), after, per_page)
+    return _as_dicts(query, rows), next_cursor
+
+
+def board_rows(session, pump_ids):
+    """Board rows of these pumps; pumps no longer PENDING are left out"""
+    if not pump_ids:
+        return []
+    query = _board_query(session).filter(Pump.id.in_(pump_ids))
+    return _as_dicts(query, query.order_by(*_sort_keys()).all())
@@ -0,0 +1,26 @@
+from sqlalchemy import update
+from sqlalchemy.dialects import mysql, sqlite
+
+
+def increment(connection, table, keys, column, delta):
+    """
+    Atomically add delta to table.column for the row identified by keys,
+    creating the row (with delta as its value) when it does not exist yet.
+    """
+    values = {**keys, column: delta}
+    new_value = table.c[column] + delta
+    dialect = connection.dialect.name
+
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(values).on_duplicate_key_update({column: new_value})
+        connection.execute(stmt)
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(table).values(values).on_conflict_do_update(
+            index_elements=list(keys), set_={column: new_value}
+        )
+        connection.execute(stmt)
+    else:
+        where = [table.c[name] == value for name, value in keys.items()]
+        result = connection.execute(update(table).where(*where).values({column: new_value}))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(values))
@@ -0,0 +1,206 @@
+"""
+Live change notifications for open pages, sent as server-sent events.
+
+Routes that change a pump call publish() once their change has committed;
+it writes one row to pump_events. Each process that serves /events runs
+one broker thread that reads new rows every EVENT_POLL_SECONDS and hands
+them to the streams open in that process. Every process therefore sees
+every event, whichever process handled the write, and the database answers
+one small query per interval instead of one per open page.
+
+Ids are handed out when a row is inserted, not when it commits, so a row
+can become visible after one with a higher id. The broker reads the last
+WINDOW ids again on every poll and only passes on the ids it has not seen.
+A browser that reconnects sends Last-Event-ID and is replayed from WINDOW
+ids before it, as long as the events are younger than
+EVENT_RETENTION_HOURS; static/js/live.js drops the ones it already had.
+
+A stream stays open as long as its page, so in production /events is
+served by a separate gevent process (gunicorn_events.conf.py) and never
+holds one of the gthread workers that serve everything else.
+"""
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import PumpEvent
+
+REPLAY_LIMIT = 500
+QUEUE_SIZE = 100
+WINDOW = 100  # ids read again behind the newest one seen
+PRUNE_EVERY = 600  # seconds
+
+_table = PumpEvent.__table__
+
+
+def publish(session, kind, pump_id, logger=None, **data):
+    """
+    Record one event. Call it after the change it describes has committed;
+    a failure is logged and never fails the request that made the change.
+    """
+    try:
+        session.execute(insert(_table).values(
+            pump_id=pump_id, kind=kind, data=json.dumps(data, default=str)
+        ))
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        if logger is not None:
+            logger.exception('Could not publish %s event for pump %s', kind, pump_id)
+
+
+def _event(row):
+    return {'id': row.id, 'kind': row.kind, 'pump_id': row.pump_id, **json.loads(row.data)}
+
+
+def events_after(connection, last_id, limit=REPLAY_LIMIT):
+    rows = connection.execute(
+        select(_table.c.id, _table.c.kind, _table.c.pump_id, _table.c.data)
+        .where(_table.c.id > last_id)
+        .order_by(_table.c.id)
+        .limit(limit)
+    )
+    return [_event(row) for row in rows]
+
+
+def latest_event_id(connection):
+    return connection.execute(select(func.max(_table.c.id))).scalar() or 0
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {json.dumps(event)}\n\n"
+
+
+class Subscription:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        # Set when the client fell too far behind; its stream then ends and
+        # the browser reconnects, catching up through Last-Event-ID
+        self.dropped = False
+
+
+class EventBroker:
+    """Fans new pump_events rows out to the streams open in this process"""
+
+    def __init__(self, poll_seconds=1.0, retention_hours=24, logger=None):
+        self.poll_seconds = poll_seconds
+        self.retention = timedelta(hours=retention_hours)
+        self.logger = logger
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_id = 0
+        self._seen = set()
+
+    def subscribe(self, engine):
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                # Start from the newest event; older ones are only replayed
+                # to streams that ask for them
+                with engine.connect() as connection:
+                    self._last_id = latest_event_id(connection)
+                    self._seen = {
+                        event['id'] for event in events_after(connection, self._last_id - WINDOW)
+                    }
+                self._thread = threading.Thread(
+                    target=self._run, args=(engine,), name='pump-events', daemon=True
+                )
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _run(self, engine):
+        last_prune = 0.0
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # Nobody is listening; the next subscribe() starts a new thread
+                    self._thread = None
+                    return
+            try:
+                with engine.connect() as connection:
+                    events = events_after(connection, self._last_id - WINDOW)
+                    if time.monotonic() - last_prune > PRUNE_EVERY:
+                        connection.execute(delete(_table).where(
+                            _table.c.created_at < datetime.now() - self.retention
+                        ))
+                        connection.commit()
+                        last_prune = time.monotonic()
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception('Reading pump events failed')
+                events = []
+
+            for event in events:
+                if event['id'] not in self._seen:
+                    self._seen.add(event['id'])
+                    self._fan_out(event)
+            if events:
+                self._last_id = max(self._last_id, events[-1]['id'])
+                self._seen = {event_id for event_id in self._seen if event_id > self._last_id - WINDOW}
+            if len(events) < REPLAY_LIMIT:
+                time.sleep(self.poll_seconds)
+
+    def _fan_out(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+    def stream(self, engine, last_id=None, allowed=None, keepalive=15):
+        """
+        SSE body for one client: events it missed since last_id, then new
+        ones as they arrive, with a comment line every keepalive seconds so
+        proxies keep the connection open and disconnects are noticed.
+        allowed(event) filters what this client may see.
+        """
+        subscription = self.subscribe(engine)
+        try:
+            yield 'retry: 3000\n\n'
+            sent = set()
+            if last_id is not None:
+                after = last_id - WINDOW
+                while True:
+                    with engine.connect() as connection:
+                        missed = events_after(connection, after)
+                    for event in missed:
+                        sent.add(event['id'])
+                        if allowed is None or allowed(event):
+                            yield format_sse(event)
+                    if len(missed) < REPLAY_LIMIT:
+                        break
+                    after = missed[-1]['id']
+
+            while True:
+                try:
+                    event = subscription.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    if subscription.dropped:
+                        return
+                    yield ': keepalive\n\n'
+                    continue
+                # Already sent while replaying
+                if event['id'] in sent:
+                    continue
+                sent.add(event['id'])
+                if len(sent) > 2 * WINDOW:
+                    newest = max(sent)
+                    sent = {event_id for event_id in sent if event_id > newest - WINDOW}
+                if allowed is None or allowed(event):
+                    yield format_sse(event)
+        finally:
+            self.unsubscribe(subscription)
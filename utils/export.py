@@ -0,0 +1,208 @@
+"""
+Streaming export of the R&D pipeline as CSV or XLSX.
+
+One row per part (pumps without parts get a single row), joined with its
+die & pattern row, its other-items row and the pump's latest workflow
+action. The query runs with yield_per so rows are fetched from a
+server-side cursor in batches and written out as they arrive; memory stays
+flat no matter how many pumps are exported.
+
+XLSX needs openpyxl. Its write-only workbook spools rows to a temporary
+file, which is then streamed back in chunks.
+"""
+import csv
+import tempfile
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, func, select
+
+from extensions import db
+from models import DiePatternItem, OtherItem, Part, Pump, TestingWorkflow
+from utils.validators import format_ddmmyyyy
+
+YIELD_PER = 1000
+CHUNK_SIZE = 64 * 1024
+CSV_ROWS_PER_CHUNK = 200
+
+# (header, column) in output order
+COLUMNS = [
+    ('Pump ID', Pump.id),
+    ('Pump Name', Pump.name),
+    ('Pump Type', Pump.pump_type),
+    ('Pump Status', Pump.status),
+    ('HP', Pump.hp),
+    ('Phase', Pump.phase),
+    ('Pipe Size', Pump.pipe_size),
+    ('Stamping', Pump.stamping),
+    ('Stamping Grade', Pump.stamping_grade),
+    ('Capacitor', Pump.capacitor),
+    ('Deadline', Pump.deadline_date),
+    ('Created', Pump.created_at),
+    ('Part ID', Part.id),
+    ('Part Source', Part.source),
+    ('Part Name', Part.part_name),
+    ('Part Weight', Part.weight),
+    ('Quantity', Part.quantity),
+    ('Brand', Part.brand),
+    ('Material', Part.material),
+    ('Pattern Cavity', DiePatternItem.pattern_cavity),
+    ('Die Item Weight', DiePatternItem.item_weight),
+    ('Making Pattern', DiePatternItem.making_pattern_date),
+    ('Complete Pattern', DiePatternItem.complete_pattern_date),
+    ('Send Foundry Pattern', DiePatternItem.send_foundry_pattern_date),
+    ('Casting', DiePatternItem.casting_date),
+    ('Die Drawing', DiePatternItem.drawing_date),
+    ('Casting M/C', DiePatternItem.casting_mc_date),
+    ('M/C Received', DiePatternItem.mc_received_date),
+    ('M/C Sample Rate', DiePatternItem.mc_sample_rate),
+    ('M/C Qty Rate', DiePatternItem.mc_qty_rate),
+    ('Die Status', DiePatternItem.status),
+    ('Die Remark', DiePatternItem.remark),
+    ('Material Specification', OtherItem.material_specification),
+    ('Other Item Weight', OtherItem.item_weight),
+    ('Other Drawing', OtherItem.drawing_date),
+    ('Send Party Drawing', OtherItem.send_party_drawing_date),
+    ('Party Name', OtherItem.party_name),
+    ('Party Received', OtherItem.party_received_date),
+    ('Inward', OtherItem.inward_date),
+    ('Sample Price', OtherItem.sample_price),
+    ('Qty Price', OtherItem.qty_price),
+    ('QC Date', OtherItem.qc_date),
+    ('QC Status', OtherItem.qc_status),
+    ('Other Status', OtherItem.status),
+    ('Other Remark', OtherItem.remark),
+    ('Latest Action', TestingWorkflow.action),
+    ('Latest Action Date', TestingWorkflow.date),
+    ('Latest Action Remark', TestingWorkflow.remark),
+]
+
+HEADERS = [header for header, _ in COLUMNS]
+
+
+def build_export_query(filters):
+    """
+    SELECT for the export. filters may hold 'status', 'type', 'q' and a
+    'from'/'to' date range applied to 'date_field' ('created' or 'deadline').
+    """
+    latest = (
+        select(TestingWorkflow.pump_id, func.max(TestingWorkflow.id).label('id'))
+        .group_by(TestingWorkflow.pump_id)
+        .subquery()
+    )
+
+    stmt = (
+        select(*[column for _, column in COLUMNS])
+        .select_from(Pump)
+        .outerjoin(Part, Part.pump_id == Pump.id)
+        .outerjoin(DiePatternItem, and_(
+            DiePatternItem.pump_id == Pump.id, DiePatternItem.part_id == Part.id
+        ))
+        .outerjoin(OtherItem, and_(
+            OtherItem.pump_id == Pump.id, OtherItem.part_id == Part.id
+        ))
+        .outerjoin(latest, latest.c.pump_id == Pump.id)
+        .outerjoin(TestingWorkflow, TestingWorkflow.id == latest.c.id)
+    )
+
+    if filters.get('status'):
+        stmt = stmt.where(Pump.status == filters['status'])
+    if filters.get('type'):
+        stmt = stmt.where(Pump.pump_type == filters['type'])
+    if filters.get('q'):
+        stmt = stmt.where(Pump.name.icontains(filters['q'], autoescape=True))
+
+    # Bounds are inclusive dates; created_at is a datetime, so it is
+    # compared against [from 00:00, day after to 00:00)
+    if filters.get('date_field') == 'deadline':
+        if filters.get('from'):
+            stmt = stmt.where(Pump.deadline_date >= filters['from'])
+        if filters.get('to'):
+            stmt = stmt.where(Pump.deadline_date <= filters['to'])
+    else:
+        if filters.get('from'):
+            stmt = stmt.where(Pump.created_at >= datetime.combine(filters['from'], time.min))
+        if filters.get('to'):
+            stmt = stmt.where(Pump.created_at < datetime.combine(filters['to'] + timedelta(days=1), time.min))
+
+    return stmt.order_by(Pump.id, Part.id)
+
+
+def iter_export_rows(filters):
+    """Result rows fetched YIELD_PER at a time from a server-side cursor"""
+    stmt = build_export_query(filters).execution_options(yield_per=YIELD_PER)
+    for partition in db.session.execute(stmt).partitions():
+        yield from partition
+
+
+class _LineBuffer:
+    """File-like target for csv.writer that hands back what was written"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def drain(self):
+        data = ''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _csv_value(value):
+    if isinstance(value, date):
+        return format_ddmmyyyy(value)
+    return value
+
+
+def stream_csv(rows):
+    """Yield the CSV export CSV_ROWS_PER_CHUNK rows at a time"""
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the UTF-8 file with the right encoding
+    yield '\ufeff'
+    writer.writerow(HEADERS)
+    size = 0
+    for row in rows:
+        writer.writerow([_csv_value(v) for v in row])
+        size += 1
+        if size >= CSV_ROWS_PER_CHUNK:
+            yield buffer.drain()
+            size = 0
+    yield buffer.drain()
+
+
+def xlsx_available():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def stream_xlsx(rows):
+    """Write the XLSX export to a temporary file, then yield it in chunks"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Pumps')
+    sheet.append(HEADERS)
+
+    def cell(value):
+        if isinstance(value, date):
+            value = WriteOnlyCell(sheet, value=value)
+            value.number_format = 'DD/MM/YYYY'
+        return value
+
+    for row in rows:
+        sheet.append([cell(v) for v in row])
+
+    with tempfile.TemporaryFile() as fh:
+        workbook.save(fh)
+        fh.seek(0)
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
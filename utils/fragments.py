@@ -0,0 +1,73 @@
+"""
+Cached per-pump fragments: pump list rows and dashboard cards.
+
+Most pumps don't change for weeks, so each worker process keeps their
+rendered markup in a bounded LRU instead of running Jinja over every pump
+on every hit. A fragment is keyed by its template, the pump id and
+pumps.version, which utils/versioning.py bumps on any change to the pump
+or its rows. An edited pump therefore gets a new key and its old entry
+ages out. created_at is part of the key as well, so a new pump that reuses
+a deleted pump's id (SQLite can) never gets its predecessor's markup.
+
+Fragment templates are rendered with nothing but the pump: no current_user,
+request or flashed messages, which would differ between hits.
+"""
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered markup, capped at maxsize entries"""
+
+    def __init__(self, maxsize=5000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+fragment_cache = FragmentCache()
+
+
+def pump_fragment(template_name, pump):
+    """Rendered template_name for pump, from the cache when pump is unchanged"""
+    key = (template_name, pump.id, pump.version, pump.created_at)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(current_app.jinja_env.get_template(template_name).render(pump=pump))
+        fragment_cache.put(key, html)
+    return html
+
+
+def init_fragment_cache(app):
+    """Size the cache from FRAGMENT_CACHE_SIZE and expose pump_fragment() to templates"""
+    fragment_cache.maxsize = app.config.setdefault('FRAGMENT_CACHE_SIZE', 5000)
+    app.add_template_global(pump_fragment)
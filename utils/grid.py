@@ -0,0 +1,217 @@
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from utils.audit import record_delete, record_insert, record_update
+from utils.progress import changes_counts
+from utils.versioning import bump_pump_versions
+
+
+def _changed(pump_id, counts_changed):
+    """Bookkeeping for a pump whose grid rows changed, in the same transaction"""
+    bump_pump_versions(db.session.connection(), [pump_id], progress=counts_changed)
+
+
+def _rows_by_part(rows):
+    """Key submitted rows by part_id; the last row for a part wins"""
+    by_part = {}
+    for row in rows:
+        try:
+            part_id = int(row.get('part_id'))
+        except (TypeError, ValueError):
+            continue
+        by_part[part_id] = row
+    return by_part
+
+
+def _apply(model, pump_id, by_part, build_values):
+    table = model.__table__
+    # Whole rows, so the audit log gets the old value of every changed field
+    existing = {
+        row['part_id']: row
+        for row in db.session.execute(select(table).where(table.c.pump_id == pump_id)).mappings()
+    }
+
+    inserts = []
+    updates = []
+    counts_changed = False
+    for part_id, row in by_part.items():
+        values = build_values(row)
+        if part_id in existing:
+            old = existing[part_id]
+            updates.append({'id': old['id'], 'version': (old['version'] or 0) + 1, **values})
+            record_update(db.session, model, pump_id, old['id'], old, values)
+            counts_changed = counts_changed or changes_counts(old, values)
+        else:
+            inserts.append({'pump_id': pump_id, 'part_id': part_id, 'version': 1, **values})
+
+    removed = {row['id']: part_id for part_id, row in existing.items() if part_id not in by_part}
+
+    if inserts:
+        db.session.execute(insert(model), inserts)
+        inserted = [v['part_id'] for v in inserts]
+        for item_id, part_id in db.session.execute(
+            select(table.c.id, table.c.part_id).where(table.c.pump_id == pump_id, table.c.part_id.in_(inserted))
+        ):
+            record_insert(db.session, model, pump_id, item_id, f'part {part_id}')
+    if updates:
+        db.session.execute(update(model), updates)
+    if removed:
+        db.session.execute(delete(model).where(model.id.in_(removed)))
+        for item_id, part_id in removed.items():
+            record_delete(db.session, model, pump_id, item_id, f'part {part_id}')
+    if inserts or updates or removed:
+        _changed(pump_id, counts_changed or bool(inserts or removed))
+
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(removed)}
+
+
+def save_grid_rows(model, pump_id, rows, build_values):
+    """
+    Replace the grid rows (DiePatternItem / OtherItem) of one pump.
+
+    Existing rows are loaded once keyed by part_id, then inserts, updates and
+    deletes run as three batched statements in one transaction. Rows missing
+    from the submission are deleted. build_values(row) maps a submitted row
+    to column values.
+
+    The (pump_id, part_id) unique constraint rejects a concurrent save that
+    inserted the same part first; in that case the save is retried once so
+    it updates that row instead.
+    """
+    by_part = _rows_by_part(rows)
+
+    for attempt in range(2):
+        try:
+            counts = _apply(model, pump_id, by_part, build_values)
+            db.session.commit()
+            return counts
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                raise
+
+
+# ==================== DELTA SAVES ====================
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _current(model, pump_id, item_id):
+    row = (
+        db.session.query(model.id, model.part_id, model.version)
+        .filter(model.id == item_id, model.pump_id == pump_id)
+        .first()
+    )
+    return {'id': row.id, 'part_id': row.part_id, 'version': row.version} if row else None
+
+
+def save_grid_changes(model, pump_id, changes, build_values):
+    """
+    Apply only the rows a client added, changed or removed.
+
+    changes = {'added': [row, ...], 'changed': [row, ...], 'removed': [row, ...]}
+    Added rows carry part_id and an optional client 'key' echoed back.
+    Changed and removed rows carry the 'id' and 'version' the client read;
+    they only apply while the stored row still has that version, so a save
+    never overwrites an edit it has not seen. Inserts and updates run in
+    their own savepoint; rows that fail come back in 'conflicts' with the
+    reason and the stored id/version, and the rest are committed.
+    """
+    result = {'added': 0, 'changed': 0, 'removed': 0, 'rows': [], 'conflicts': []}
+    table = model.__table__
+    counts_changed = False
+
+    def conflict(row, reason, current=None):
+        result['conflicts'].append({
+            'key': row.get('key'), 'id': _as_int(row.get('id')),
+            'part_id': _as_int(row.get('part_id')), 'reason': reason, 'current': current,
+        })
+
+    # Rows about to change or go, for the audit log's old values
+    ids = [_as_int(row.get('id')) for row in (changes.get('changed') or []) + (changes.get('removed') or [])]
+    ids = [item_id for item_id in ids if item_id is not None]
+    before = {
+        row['id']: row
+        for row in db.session.execute(
+            select(table).where(table.c.id.in_(ids), table.c.pump_id == pump_id)
+        ).mappings()
+    } if ids else {}
+
+    # Removals first, so a part freed by a removed row can be reused
+    for row in changes.get('removed') or []:
+        item_id, version = _as_int(row.get('id')), _as_int(row.get('version'))
+        if item_id is None or version is None:
+            conflict(row, 'id and version are required')
+            continue
+        deleted = db.session.execute(
+            delete(table).where(table.c.id == item_id, table.c.pump_id == pump_id, table.c.version == version)
+        ).rowcount
+        if not deleted:
+            current = _current(model, pump_id, item_id)
+            if current:
+                conflict(row, 'changed by someone else', current)
+            continue
+        result['removed'] += 1
+        old = before.get(item_id)
+        record_delete(db.session, model, pump_id, item_id, old and f"part {old['part_id']}")
+
+    for row in changes.get('changed') or []:
+        item_id, version = _as_int(row.get('id')), _as_int(row.get('version'))
+        part_id = _as_int(row.get('part_id'))
+        if item_id is None or version is None or part_id is None:
+            conflict(row, 'id, version and part_id are required')
+            continue
+        values = {'part_id': part_id, **build_values(row)}
+        old = before.get(item_id)
+        if old is not None and old['version'] != version:
+            # Someone saved the row after it was read above; compare with what is there now
+            old = db.session.execute(
+                select(table).where(table.c.id == item_id, table.c.pump_id == pump_id)
+            ).mappings().first()
+        try:
+            with db.session.begin_nested():
+                updated = db.session.execute(
+                    update(table)
+                    .where(table.c.id == item_id, table.c.pump_id == pump_id, table.c.version == version)
+                    .values(version=table.c.version + 1, **values)
+                ).rowcount
+        except IntegrityError:
+            conflict(row, 'another row already uses this part', _current(model, pump_id, item_id))
+            continue
+        if not updated:
+            current = _current(model, pump_id, item_id)
+            conflict(row, 'changed by someone else' if current else 'deleted by someone else', current)
+            continue
+        result['changed'] += 1
+        counts_changed = counts_changed or changes_counts(old, values)
+        if old is not None:
+            record_update(db.session, model, pump_id, item_id, old, values)
+        result['rows'].append({'key': row.get('key'), 'id': item_id, 'part_id': part_id, 'version': version + 1})
+
+    for row in changes.get('added') or []:
+        part_id = _as_int(row.get('part_id'))
+        if part_id is None:
+            conflict(row, 'part_id is required')
+            continue
+        try:
+            with db.session.begin_nested():
+                item_id = db.session.execute(
+                    insert(table).values(pump_id=pump_id, part_id=part_id, version=1, **build_values(row))
+                ).inserted_primary_key[0]
+        except IntegrityError:
+            existing = db.session.query(model.id).filter_by(pump_id=pump_id, part_id=part_id).scalar()
+            conflict(row, 'this part already has a row', existing and _current(model, pump_id, existing))
+            continue
+        result['added'] += 1
+        record_insert(db.session, model, pump_id, item_id, f'part {part_id}')
+        result['rows'].append({'key': row.get('key'), 'id': item_id, 'part_id': part_id, 'version': 1})
+
+    if result['added'] or result['changed'] or result['removed']:
+        _changed(pump_id, counts_changed or bool(result['added'] or result['removed']))
+    db.session.commit()
+    return result
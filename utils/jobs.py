@@ -0,0 +1,269 @@
+"""
+Durable background jobs.
+
+enqueue() adds a row to the jobs table inside the caller's transaction, so
+a job exists exactly when the change that asked for it commits. The worker
+(`flask run-worker`) claims queued jobs and runs them on a thread pool.
+
+- A job that raises is retried with exponential backoff until it reaches
+  max_attempts. After that it is marked FAILED.
+- Jobs left RUNNING by a worker that died are requeued once their lease
+  (JOB_LEASE_SECONDS) runs out. A live worker renews the lease of the jobs
+  it is running every third of that, so a long export or import is never
+  picked up a second time while it still runs.
+- DONE jobs are deleted JOB_RETENTION_HOURS after they finished; FAILED
+  ones stay for inspection.
+
+Handlers are plain functions registered with @handler('kind'). They get
+the decoded payload and return a JSON-serialisable result, which
+/api/jobs/<id> reports back to the page that queued the job. current_job()
+is the row of the job being run, for handlers that need its attempts.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, or_, select, update
+
+from models import Job
+
+HANDLERS = {}
+CLAIM_BATCH = 10
+BACKOFF_SECONDS = 30  # first retry; doubles on every further attempt
+PRUNE_EVERY = 3600  # seconds
+
+_table = Job.__table__
+_current = threading.local()
+
+
+def handler(kind):
+    """Register the function that runs jobs of this kind"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(session, kind, payload=None, created_by=None, max_attempts=3, delay_seconds=0):
+    """Queue a job in the current transaction; returns its id"""
+    result = session.execute(insert(_table).values(
+        kind=kind,
+        payload=json.dumps(payload or {}, default=str),
+        status='QUEUED',
+        attempts=0,
+        max_attempts=max_attempts,
+        run_after=datetime.now() + timedelta(seconds=delay_seconds),
+        created_by=created_by,
+    ))
+    return result.inserted_primary_key[0]
+
+
+def current_job():
+    """The job the calling worker thread is running, or None"""
+    return getattr(_current, 'job', None)
+
+
+def job_status(job):
+    """Public view of a Job row for the status API"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'result': json.loads(job.result) if job.result else None,
+        # Last line of the traceback; the full one stays in the table
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def claim(connection, worker_id, lease_seconds):
+    """
+    Take the oldest runnable job, or None. The conditional UPDATE makes the
+    claim safe between workers without row locks: whoever changes the row
+    first owns it, everyone else sees rowcount 0 and tries the next one.
+    """
+    now = datetime.now()
+    stale = (_table.c.status == 'RUNNING') & (_table.c.locked_at < now - timedelta(seconds=lease_seconds))
+
+    # A job whose worker died on its last attempt is not run again
+    abandoned = connection.execute(
+        update(_table)
+        .where(stale, _table.c.attempts >= _table.c.max_attempts)
+        .values(status='FAILED', error='Worker stopped while running the job',
+                locked_by=None, locked_at=None, finished_at=now)
+    ).rowcount
+    if abandoned:
+        connection.commit()
+
+    runnable = or_((_table.c.status == 'QUEUED') & (_table.c.run_after <= now), stale)
+    candidates = connection.execute(
+        select(_table.c.id, _table.c.status, _table.c.locked_at)
+        .where(runnable)
+        .order_by(_table.c.run_after, _table.c.id)
+        .limit(CLAIM_BATCH)
+    ).all()
+
+    for job_id, status, locked_at in candidates:
+        claimed = connection.execute(
+            update(_table)
+            .where(_table.c.id == job_id, _table.c.status == status,
+                   _table.c.locked_at.is_(None) if locked_at is None else _table.c.locked_at == locked_at)
+            .values(status='RUNNING', locked_by=worker_id, locked_at=now,
+                    attempts=_table.c.attempts + 1)
+        ).rowcount
+        connection.commit()
+        if claimed:
+            return connection.execute(select(_table).where(_table.c.id == job_id)).one()
+    return None
+
+
+def renew(connection, job_ids, worker_id):
+    """Push the lease of jobs this worker is still running forward"""
+    connection.execute(
+        update(_table)
+        .where(_table.c.id.in_(job_ids), _table.c.status == 'RUNNING', _table.c.locked_by == worker_id)
+        .values(locked_at=datetime.now())
+    )
+    connection.commit()
+
+
+def finish(connection, job_id, result):
+    connection.execute(
+        update(_table).where(_table.c.id == job_id).values(
+            status='DONE', result=json.dumps(result, default=str), error=None,
+            locked_by=None, locked_at=None, finished_at=datetime.now(),
+        )
+    )
+    connection.commit()
+
+
+def fail(connection, job, error):
+    """Schedule a retry, or mark the job FAILED after its last attempt"""
+    if job.attempts < job.max_attempts:
+        delay = BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+        values = {'status': 'QUEUED', 'run_after': datetime.now() + timedelta(seconds=delay)}
+    else:
+        values = {'status': 'FAILED', 'finished_at': datetime.now()}
+    connection.execute(
+        update(_table).where(_table.c.id == job.id).values(
+            error=error, locked_by=None, locked_at=None, **values
+        )
+    )
+    connection.commit()
+
+
+def prune(connection, retention_hours):
+    """Delete DONE jobs that finished more than retention_hours ago"""
+    deleted = connection.execute(
+        delete(_table).where(
+            _table.c.status == 'DONE',
+            _table.c.finished_at < datetime.now() - timedelta(hours=retention_hours),
+        )
+    ).rowcount
+    connection.commit()
+    return deleted
+
+
+class Worker:
+    """Claims jobs and runs them on a thread pool until stopped"""
+
+    def __init__(self, app, engine, threads=4, poll_seconds=1.0, lease_seconds=600, retention_hours=168):
+        self.app = app
+        self.engine = engine
+        self.threads = threads
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.retention_hours = retention_hours
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._busy = threading.Semaphore(threads)
+        self._stop = threading.Event()
+        self._running = set()  # ids of the jobs on the pool
+        self._running_lock = threading.Lock()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        self.app.logger.info('Worker %s started with %d thread(s)', self.worker_id, self.threads)
+        self._next_renewal = time.monotonic() + self.lease_seconds / 3
+        next_prune = 0.0
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='job') as pool:
+            while not self._stop.is_set():
+                self._renew_if_due()
+                if time.monotonic() >= next_prune:
+                    next_prune = time.monotonic() + PRUNE_EVERY
+                    self._prune()
+                # Only claim a job when a thread is free to run it
+                if not self._busy.acquire(timeout=self.poll_seconds):
+                    continue
+                try:
+                    with self.engine.connect() as connection:
+                        job = claim(connection, self.worker_id, self.lease_seconds)
+                except Exception:
+                    self.app.logger.exception('Claiming a job failed')
+                    job = None
+                if job is None:
+                    self._busy.release()
+                    self._stop.wait(self.poll_seconds)
+                    continue
+                with self._running_lock:
+                    self._running.add(job.id)
+                pool.submit(self._run, job)
+
+            # Jobs still running after stop() keep their lease until they end
+            while self._running:
+                self._renew_if_due()
+                time.sleep(self.poll_seconds)
+
+    def _renew_if_due(self):
+        if time.monotonic() < self._next_renewal:
+            return
+        self._next_renewal = time.monotonic() + self.lease_seconds / 3
+        with self._running_lock:
+            job_ids = sorted(self._running)
+        if not job_ids:
+            return
+        try:
+            with self.engine.connect() as connection:
+                renew(connection, job_ids, self.worker_id)
+        except Exception:
+            self.app.logger.exception('Renewing the lease of jobs %s failed', job_ids)
+
+    def _prune(self):
+        try:
+            with self.engine.connect() as connection:
+                prune(connection, self.retention_hours)
+        except Exception:
+            self.app.logger.exception('Pruning finished jobs failed')
+
+    def _run(self, job):
+        try:
+            func = HANDLERS.get(job.kind)
+            started = time.perf_counter()
+            _current.job = job
+            try:
+                if func is None:
+                    raise LookupError(f'No handler for job kind {job.kind!r}')
+                with self.app.app_context():
+                    result = func(json.loads(job.payload))
+            except Exception:
+                self.app.logger.exception('Job %s (%s) failed on attempt %d', job.id, job.kind, job.attempts)
+                with self.engine.connect() as connection:
+                    fail(connection, job, traceback.format_exc(limit=5))
+                return
+            with self.engine.connect() as connection:
+                finish(connection, job.id, result)
+            self.app.logger.info('Job %s (%s) done in %.1fs', job.id, job.kind, time.perf_counter() - started)
+        finally:
+            _current.job = None
+            with self._running_lock:
+                self._running.discard(job.id)
+            self._busy.release()
@@ -0,0 +1,232 @@
+"""
+Per-request SQL and latency instrumentation.
+
+init_metrics(app) hooks the SQLAlchemy engine and the Flask request
+lifecycle. For every request it counts statements and DB time, records
+latency and query-count histograms per endpoint, keeps samples of slow
+statements, and logs an N+1 warning when one statement shape runs many
+times in a single request. render_metrics() formats everything in the
+Prometheus text exposition format for /admin/metrics.
+
+Metrics are kept in memory per worker process.
+"""
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from extensions import db
+from utils.fragments import fragment_cache
+from utils.passwords import password_hasher
+from utils.throttle import login_throttle
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    def __init__(self, slow_sample_size=50):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.db_seconds = Counter()
+        self.n_plus_one = Counter()
+        self.slow_queries = deque(maxlen=slow_sample_size)
+        self.started = time.time()
+
+    def record_request(self, endpoint, duration, query_count, db_time):
+        with self.lock:
+            self.latency[endpoint].observe(duration)
+            self.queries[endpoint].observe(query_count)
+            self.db_seconds[endpoint] += db_time
+
+    def record_slow_query(self, endpoint, duration, statement):
+        with self.lock:
+            self.slow_queries.append((time.time(), endpoint, duration, statement))
+
+    def record_n_plus_one(self, endpoint):
+        with self.lock:
+            self.n_plus_one[endpoint] += 1
+
+
+registry = MetricsRegistry()
+
+
+def _shape(statement):
+    """Statements already use bound placeholders, so whitespace is all that varies"""
+    return ' '.join(statement.split())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    stats = g.get('_metrics')
+    if stats is None:
+        return
+
+    elapsed = time.perf_counter() - context._metrics_start
+    stats['queries'] += 1
+    stats['db_time'] += elapsed
+    stats['shapes'][_shape(statement)] += 1
+
+    if elapsed * 1000 >= stats['slow_ms']:
+        registry.record_slow_query(request.endpoint or 'unmatched', elapsed, _shape(statement))
+
+
+def init_metrics(app):
+    """Attach the SQL and request hooks to app and its engine"""
+    app.config.setdefault('SLOW_QUERY_MS', 200)
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def _start_request_metrics():
+        g._metrics = {
+            'start': time.perf_counter(),
+            'queries': 0,
+            'db_time': 0.0,
+            'shapes': Counter(),
+            'slow_ms': app.config['SLOW_QUERY_MS'],
+        }
+
+    @app.teardown_request
+    def _finish_request_metrics(exc):
+        stats = g.pop('_metrics', None)
+        if stats is None:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        duration = time.perf_counter() - stats['start']
+        registry.record_request(endpoint, duration, stats['queries'], stats['db_time'])
+
+        if stats['shapes']:
+            shape, repeats = stats['shapes'].most_common(1)[0]
+            if repeats >= app.config['N_PLUS_ONE_THRESHOLD']:
+                registry.record_n_plus_one(endpoint)
+                app.logger.warning(
+                    'Possible N+1 in %s: statement ran %d times: %s',
+                    endpoint, repeats, shape[:200]
+                )
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _histogram_lines(name, help_text, histograms):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for endpoint, hist in sorted(histograms.items()):
+        label = f'endpoint="{_label(endpoint)}"'
+        for bound, count in zip(hist.buckets, hist.counts):
+            lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{label},le="+Inf"}} {hist.total}')
+        lines.append(f'{name}_sum{{{label}}} {hist.sum:.6f}')
+        lines.append(f'{name}_count{{{label}}} {hist.total}')
+    return lines
+
+
+def render_metrics():
+    """All metrics in the Prometheus text format; slow queries as comments"""
+    with registry.lock:
+        lines = _histogram_lines(
+            'versil_request_duration_seconds',
+            'Request latency by endpoint.',
+            registry.latency
+        )
+        lines += _histogram_lines(
+            'versil_request_queries',
+            'SQL statements per request by endpoint.',
+            registry.queries
+        )
+
+        lines += [
+            '# HELP versil_request_db_seconds_total Time spent in SQL by endpoint.',
+            '# TYPE versil_request_db_seconds_total counter',
+        ]
+        for endpoint, seconds in sorted(registry.db_seconds.items()):
+            lines.append(f'versil_request_db_seconds_total{{endpoint="{_label(endpoint)}"}} {seconds:.6f}')
+
+        lines += [
+            '# HELP versil_n_plus_one_total Requests where one statement shape repeated past the threshold.',
+            '# TYPE versil_n_plus_one_total counter',
+        ]
+        for endpoint, count in sorted(registry.n_plus_one.items()):
+            lines.append(f'versil_n_plus_one_total{{endpoint="{_label(endpoint)}"}} {count}')
+
+        lines += [
+            '# HELP versil_process_start_time_seconds Start time of this worker process.',
+            '# TYPE versil_process_start_time_seconds gauge',
+            f'versil_process_start_time_seconds {registry.started:.0f}',
+        ]
+
+        lines += [
+            '# HELP versil_fragment_cache_hits_total Pump fragments served from the cache.',
+            '# TYPE versil_fragment_cache_hits_total counter',
+            f'versil_fragment_cache_hits_total {fragment_cache.hits}',
+            '# HELP versil_fragment_cache_misses_total Pump fragments rendered because they were not cached.',
+            '# TYPE versil_fragment_cache_misses_total counter',
+            f'versil_fragment_cache_misses_total {fragment_cache.misses}',
+            '# HELP versil_fragment_cache_entries Pump fragments currently cached.',
+            '# TYPE versil_fragment_cache_entries gauge',
+            f'versil_fragment_cache_entries {len(fragment_cache)}',
+        ]
+
+        hasher = password_hasher
+        lines += [
+            '# HELP versil_password_hash_waiting Password checks queued for a hashing thread.',
+            '# TYPE versil_password_hash_waiting gauge',
+            f'versil_password_hash_waiting {hasher.waiting}',
+            '# HELP versil_password_hash_running Password checks being hashed now.',
+            '# TYPE versil_password_hash_running gauge',
+            f'versil_password_hash_running {hasher.running}',
+            '# HELP versil_password_hash_completed_total Password checks and hashes finished.',
+            '# TYPE versil_password_hash_completed_total counter',
+            f'versil_password_hash_completed_total {hasher.completed}',
+            '# HELP versil_password_hash_rejected_total Password checks refused because the queue was full.',
+            '# TYPE versil_password_hash_rejected_total counter',
+            f'versil_password_hash_rejected_total {hasher.rejected}',
+            '# HELP versil_password_hash_timeouts_total Password checks that waited past PASSWORD_HASH_TIMEOUT.',
+            '# TYPE versil_password_hash_timeouts_total counter',
+            f'versil_password_hash_timeouts_total {hasher.timeouts}',
+            '# HELP versil_password_hash_wait_seconds_total Time password checks spent queued.',
+            '# TYPE versil_password_hash_wait_seconds_total counter',
+            f'versil_password_hash_wait_seconds_total {hasher.wait_seconds:.6f}',
+            '# HELP versil_password_hash_seconds_total Time spent hashing.',
+            '# TYPE versil_password_hash_seconds_total counter',
+            f'versil_password_hash_seconds_total {hasher.hash_seconds:.6f}',
+            '# HELP versil_login_throttled_total Login attempts refused by the rate limiter.',
+            '# TYPE versil_login_throttled_total counter',
+            f'versil_login_throttled_total{{scope="user"}} {login_throttle.users.rejected}',
+            f'versil_login_throttled_total{{scope="ip"}} {login_throttle.ips.rejected}',
+        ]
+
+        if registry.slow_queries:
+            lines.append('# Slow query samples (newest last): time endpoint seconds sql')
+            for at, endpoint, duration, statement in registry.slow_queries:
+                stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(at))
+                lines.append(f'# {stamp} {endpoint} {duration:.3f} {statement[:500]}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import and_, or_
+
+
+def get_page_size(value, allowed, default):
+    """Return the requested page size if it is one of the allowed sizes"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return value if value in allowed else default
+
+
+def _dump_value(value):
+    # Dates are tagged so decode_cursor() can hand back real date objects
+    if isinstance(value, date):
+        return {'date': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict) and 'date' in value:
+        return date.fromisoformat(value['date'])
+    return value
+
+
+def encode_cursor(values):
+    """Encode the sort key values of the last row on a page"""
+    values = [_dump_value(v) for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor(), None if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list):
+            return None
+        return [_load_value(v) for v in values]
+    except (ValueError, TypeError):
+        return None
+
+
+def _after(sort_keys, values):
+    """Build (k1, k2, ...) > (v1, v2, ...) as portable AND/OR clauses"""
+    clauses = []
+    for i, key in enumerate(sort_keys):
+        equal_prefix = [sort_keys[j] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, key > values[i]))
+    return or_(*clauses)
+
+
+def keyset_page(query, sort_keys, cursor=None, per_page=50):
+    """
+    Fetch one page of query ordered by sort_keys (all ascending, last one unique).
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    Items are the query's entities, or its rows if it selects several columns.
+    """
+    width = len(query.column_descriptions)
+    values = decode_cursor(cursor)
+    if values is not None and len(values) == len(sort_keys):
+        query = query.filter(_after(sort_keys, values))
+
+    rows = (
+        query.add_columns(*sort_keys)
+        .order_by(*sort_keys)
+        .limit(per_page + 1)
+        .all()
+    )
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    items = [row[0] if width == 1 else row[:width] for row in rows]
+    next_cursor = encode_cursor(rows[-1][width:]) if has_more and rows else None
+    return items, next_cursor
@@ -0,0 +1,278 @@
+"""
+Bulk parts import from CSV or XLSX.
+
+The whole file is parsed first, every row is validated in one pass
+(pumps referenced by the file are loaded with a single query), and the
+valid rows are inserted with executemany in batches of BATCH_SIZE, all in
+one transaction: an import that fails part way inserts nothing, so it can
+simply be run again. Rejected rows come back with their reasons and are
+written to a CSV report that can be downloaded afterwards.
+
+Columns (header names are case-insensitive):
+    pump_id or pump_name   only when importing for several pumps; when
+                           importing for one pump they may be left out,
+                           and rows naming another pump are rejected
+    source                 VERSIL or OTHER (default OTHER)
+    part_name              required
+    weight, quantity, brand, material
+"""
+import csv
+import io
+import os
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import func, insert, or_, select
+
+from extensions import db
+from models import Part, Pump
+from utils.audit import record_insert
+from utils.versioning import bump_pump_versions
+
+BATCH_SIZE = 500
+SOURCES = ('VERSIL', 'OTHER')
+MAX_WEIGHT = 10 ** 6  # Part.weight is Numeric(10, 4)
+FIELDS = ('pump_id', 'pump_name', 'source', 'part_name', 'weight', 'quantity', 'brand', 'material')
+REPORT_HEADERS = ['row'] + list(FIELDS) + ['errors']
+
+
+class ImportFileError(ValueError):
+    """The file as a whole cannot be imported (bad format, no header...)"""
+
+
+def _normalize_header(name):
+    return str(name or '').strip().lower().replace(' ', '_')
+
+
+def _rows_from_table(table):
+    """Turn a list of row tuples (header first) into dicts of known fields"""
+    if not table:
+        raise ImportFileError('The file is empty')
+    headers = [_normalize_header(h) for h in table[0]]
+    if 'part_name' not in headers:
+        raise ImportFileError('The file needs a part_name column')
+
+    rows = []
+    for line, values in enumerate(table[1:], start=2):
+        row = {}
+        for header, value in zip(headers, values):
+            if header in FIELDS:
+                row[header] = '' if value is None else str(value).strip()
+        # Blank lines are skipped; 'row' keeps the file line for the report
+        if any(row.values()):
+            row['row'] = line
+            rows.append(row)
+    return rows
+
+
+def read_rows(stream, filename):
+    """Parse an uploaded CSV or XLSX file into a list of dicts"""
+    extension = os.path.splitext(filename or '')[1].lower()
+
+    if extension == '.csv':
+        try:
+            text = stream.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ImportFileError('CSV files must be UTF-8 encoded')
+        return _rows_from_table(list(csv.reader(io.StringIO(text))))
+
+    if extension == '.xlsx':
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFileError('XLSX import needs openpyxl installed')
+        try:
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+        except Exception:
+            raise ImportFileError('Could not read the XLSX file')
+        try:
+            return _rows_from_table(list(workbook.active.iter_rows(values_only=True)))
+        finally:
+            workbook.close()
+
+    raise ImportFileError('Upload a .csv or .xlsx file')
+
+
+def _load_pumps(rows, default_pump_id):
+    """Pumps referenced by the rows, keyed by id and by lower-cased name"""
+    if default_pump_id is not None:
+        # Every row goes to this pump; the others are only named to be refused
+        ids, names = {default_pump_id}, set()
+    else:
+        ids = {int(r['pump_id']) for r in rows if r.get('pump_id', '').isdigit()}
+        names = {r['pump_name'] for r in rows if r.get('pump_name') and not r.get('pump_id')}
+
+    conditions = []
+    if ids:
+        conditions.append(Pump.id.in_(ids))
+    if names:
+        conditions.append(Pump.name.in_(names))
+    if not conditions:
+        return {}, {}
+
+    pumps = (
+        db.session.query(Pump.id, Pump.name, Pump.pump_type, Pump.status)
+        .filter(or_(*conditions))
+        .all()
+    )
+    by_id = {p.id: p for p in pumps}
+    by_name = {}
+    for p in pumps:
+        by_name.setdefault((p.name or '').lower(), []).append(p)
+    return by_id, by_name
+
+
+def _resolve_pump(row, default_pump_id, by_id, by_name):
+    """(pump, error) for one row"""
+    if default_pump_id is not None:
+        pump = by_id.get(default_pump_id)
+        if pump is None:
+            return None, 'pump not found'
+        if row.get('pump_id') and row['pump_id'] != str(pump.id):
+            return None, f'pump_id must be {pump.id} or left empty when importing for one pump'
+        if row.get('pump_name') and row['pump_name'].lower() != (pump.name or '').lower():
+            return None, f'pump_name must be {pump.name} or left empty when importing for one pump'
+        return pump, None
+
+    if row.get('pump_id'):
+        if not row['pump_id'].isdigit():
+            return None, 'pump_id must be a number'
+        pump = by_id.get(int(row['pump_id']))
+        return (pump, None) if pump else (None, 'pump not found')
+
+    if row.get('pump_name'):
+        matches = by_name.get(row['pump_name'].lower(), [])
+        if len(matches) > 1:
+            return None, 'pump_name matches more than one pump; use pump_id'
+        return (matches[0], None) if matches else (None, 'pump not found')
+
+    return None, 'pump_id or pump_name is required'
+
+
+def _decimal(value):
+    if not value:
+        return None
+    return Decimal(value)
+
+
+def validate_rows(rows, default_pump_id=None):
+    """
+    Split rows from read_rows() into (valid, rejected). valid holds Part
+    column values; rejected holds the original row plus its 'errors'.
+    """
+    by_id, by_name = _load_pumps(rows, default_pump_id)
+    valid = []
+    rejected = []
+
+    for row in rows:
+        errors = []
+
+        pump, error = _resolve_pump(row, default_pump_id, by_id, by_name)
+        if error:
+            errors.append(error)
+        elif pump is None:
+            errors.append('pump not found')
+        elif pump.status != 'PENDING':
+            errors.append(f'pump is {pump.status}; parts cannot be added')
+
+        source = (row.get('source') or 'OTHER').upper()
+        if source not in SOURCES:
+            errors.append('source must be VERSIL or OTHER')
+        elif pump is not None and pump.pump_type == 'VERSIL' and source != 'VERSIL':
+            errors.append('VERSIL pumps only take VERSIL parts')
+
+        part_name = row.get('part_name', '')
+        if not part_name:
+            errors.append('part_name is required')
+        elif len(part_name) > 200:
+            errors.append('part_name is longer than 200 characters')
+
+        try:
+            weight = _decimal(row.get('weight'))
+            if weight is not None and not (0 <= weight < MAX_WEIGHT):
+                errors.append(f'weight must be between 0 and {MAX_WEIGHT}')
+        except InvalidOperation:
+            weight = None
+            errors.append('weight must be a number')
+
+        quantity = None
+        if row.get('quantity'):
+            try:
+                quantity = int(Decimal(row['quantity']))
+                if quantity < 1 or quantity != Decimal(row['quantity']):
+                    errors.append('quantity must be a whole number of at least 1')
+            except (InvalidOperation, ValueError, OverflowError):
+                errors.append('quantity must be a whole number of at least 1')
+
+        for field in ('brand', 'material'):
+            if len(row.get(field, '')) > 100:
+                errors.append(f'{field} is longer than 100 characters')
+
+        if errors:
+            rejected.append({**row, 'errors': '; '.join(errors)})
+            continue
+
+        valid.append({
+            'pump_id': pump.id,
+            'source': source,
+            'part_name': part_name,
+            'weight': weight,
+            'quantity': quantity,
+            'brand': row.get('brand', ''),
+            'material': row.get('material', ''),
+        })
+
+    return valid, rejected
+
+
+def _insert_batch(batch):
+    """
+    Insert one batch and stage its change-history records. Core inserts
+    skip the audit flush hook, so the new ids are read back: in this
+    transaction the only parts of these pumps above their highest id are
+    the ones just inserted.
+    """
+    pump_ids = {v['pump_id'] for v in batch}
+    last_id = db.session.query(func.max(Part.id)).filter(Part.pump_id.in_(pump_ids)).scalar() or 0
+    db.session.execute(insert(Part), batch)
+    for part_id, pump_id, part_name in db.session.execute(
+        select(Part.id, Part.pump_id, Part.part_name).where(Part.pump_id.in_(pump_ids), Part.id > last_id)
+    ):
+        record_insert(db.session, Part, pump_id, part_id, part_name)
+
+
+def insert_parts(values):
+    """Insert Part rows BATCH_SIZE at a time and commit them together"""
+    try:
+        for start in range(0, len(values), BATCH_SIZE):
+            _insert_batch(values[start:start + BATCH_SIZE])
+        bump_pump_versions(db.session.connection(), [v['pump_id'] for v in values])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(values)
+
+
+def write_report(folder, rejected):
+    """Save the rejected rows as CSV in folder; returns the report token"""
+    os.makedirs(folder, exist_ok=True)
+    token = uuid.uuid4().hex
+    with open(os.path.join(folder, f'{token}.csv'), 'w', newline='', encoding='utf-8-sig') as fh:
+        writer = csv.DictWriter(fh, fieldnames=REPORT_HEADERS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rejected)
+    return token
+
+
+def import_parts(stream, filename, report_folder, default_pump_id=None):
+    """
+    Parse, validate and insert one uploaded file. Returns a dict with the
+    number of rows read and inserted, the rejected rows and the report token
+    (None when nothing was rejected). Raises ImportFileError for bad files.
+    """
+    rows = read_rows(stream, filename)
+    valid, rejected = validate_rows(rows, default_pump_id)
+    inserted = insert_parts(valid)
+    report = write_report(report_folder, rejected) if rejected else None
+    return {'rows': len(rows), 'inserted': inserted, 'rejected': rejected, 'report': report}
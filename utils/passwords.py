@@ -0,0 +1,111 @@
+"""
+Password hashing off the request threads.
+
+bcrypt is slow on purpose: one check at the default work factor costs a
+few hundred milliseconds of CPU. At shift start dozens of people log in at
+once, and every check used to hold a request thread for that long.
+
+Checks and new hashes now run on a pool of PASSWORD_HASH_WORKERS threads
+(bcrypt releases the GIL, so they run alongside the rest of the worker)
+with at most PASSWORD_HASH_QUEUE calls waiting. When the queue is full a
+login is refused at once with HasherBusy instead of piling up behind the
+others, and one that waits longer than PASSWORD_HASH_TIMEOUT gives up the
+same way. The pool threads start on first use, so a preloading gunicorn
+master never forks them.
+
+The work factor is BCRYPT_LOG_ROUNDS. Hashes made with another factor
+still verify; login() replaces them after the next successful login
+(needs_rehash()).
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from extensions import bcrypt
+
+
+class HasherBusy(Exception):
+    """Too many password checks are waiting, or this one waited too long"""
+
+
+class PasswordHasher:
+    """bcrypt on a bounded thread pool, with queueing counters for /admin/metrics"""
+
+    def __init__(self, workers=4, queue_size=64, timeout=10.0, rounds=12):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.rounds = rounds
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def check(self, password_hash, password):
+        """True if password matches; a malformed stored hash never matches"""
+        if not password_hash:
+            return False
+        try:
+            return self._submit(bcrypt.check_password_hash, password_hash, password)
+        except ValueError:
+            return False
+
+    def hash(self, password):
+        return self._submit(bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with another work factor than BCRYPT_LOG_ROUNDS"""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise HasherBusy()
+            self.waiting += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+
+        future = self._executor.submit(self._run, time.monotonic(), fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+                # Still queued: take it out so it doesn't run for nobody
+                if future.cancel():
+                    self.waiting -= 1
+            raise HasherBusy()
+
+    def _run(self, queued_at, fn, *args):
+        started = time.monotonic()
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+            self.wait_seconds += started - queued_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.hash_seconds += time.monotonic() - started
+
+
+password_hasher = PasswordHasher()
+
+
+def init_password_hasher(app):
+    """Read the pool size, queue limit, timeout and work factor from the config"""
+    password_hasher.workers = app.config.setdefault('PASSWORD_HASH_WORKERS', 4)
+    password_hasher.queue_size = app.config.setdefault('PASSWORD_HASH_QUEUE', 64)
+    password_hasher.timeout = app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10.0)
+    password_hasher.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
@@ -0,0 +1,209 @@
+"""
+Cached principal for current_user.
+
+load_user() runs on every request. Instead of loading the User row and
+walking its lazy roles relationship for every permission check, the
+principal (id, username, role bitmask) is built with one query the first
+time a user is seen and kept in a per-process cache. Role checks are then
+a single AND against the bitmask.
+
+A commit that changes a user's roles, username or active flag, or deletes
+the user, drops the entry in its own process and adds a
+principal_invalidations row in the same transaction. Every process reads
+the rows added since its last look at most every PRINCIPAL_CHECK_SECONDS
+and drops those users too, so a demoted or deleted user loses access in
+every worker within seconds without a query per request. The last
+LOOKBACK ids are read again each time, since ids can commit out of order.
+Entries also expire after PRINCIPAL_CACHE_TTL seconds.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from flask_login import UserMixin
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session, object_session
+
+from extensions import db
+from models import PrincipalInvalidation, Role, User
+
+ROLE_BITS = {
+    'BOSS': 1 << 0,
+    'ADMIN': 1 << 1,
+    'DIE_INCHARGE': 1 << 2,
+    'OTHER_INCHARGE': 1 << 3,
+}
+
+LOOKBACK = 100  # invalidation ids read again on every check
+KEEP_INVALIDATIONS = timedelta(days=1)  # well past PRINCIPAL_CACHE_TTL
+
+_cache = {}
+_lock = threading.Lock()
+_invalidations = PrincipalInvalidation.__table__
+_check_lock = threading.Lock()
+_next_check = 0.0
+_last_id = None
+_seen = set()
+
+
+@lru_cache(maxsize=64)
+def role_mask(role_names):
+    """Bitmask for a tuple of role names"""
+    mask = 0
+    for name in role_names:
+        mask |= ROLE_BITS.get(name, 0)
+    return mask
+
+
+class Principal(UserMixin):
+    """Read-only stand-in for User as current_user"""
+
+    def __init__(self, id, username, role_names, active=True):
+        self.id = id
+        self.username = username
+        self.role_names = tuple(role_names)
+        self.role_mask = role_mask(self.role_names)
+        self.active = active
+
+    @property
+    def is_active(self):
+        return self.active
+
+    @property
+    def role_name(self):
+        return self.role_names[0] if self.role_names else 'N/A'
+
+    def has_role(self, role_name):
+        bit = ROLE_BITS.get(role_name)
+        if bit is None:
+            return role_name in self.role_names
+        return bool(self.role_mask & bit)
+
+    def has_any_role(self, *roles):
+        if self.role_mask & role_mask(roles):
+            return True
+        # Roles without a bit assigned fall back to a name lookup
+        return any(r not in ROLE_BITS and r in self.role_names for r in roles)
+
+
+def _build_principal(user_id):
+    rows = (
+        db.session.query(User.id, User.username, User.is_active, Role.name)
+        .outerjoin(User.roles)
+        .filter(User.id == user_id)
+        .order_by(Role.id)
+        .all()
+    )
+    if not rows:
+        return None
+    _, username, is_active, _ = rows[0]
+    role_names = [row[3] for row in rows if row[3]]
+    return Principal(user_id, username, role_names, active=is_active is not False)
+
+
+def _drop_invalidated(check_seconds):
+    """Drop the principals other processes invalidated since the last check"""
+    global _next_check, _last_id
+    if time.monotonic() < _next_check or not _check_lock.acquire(blocking=False):
+        return
+    try:
+        _next_check = time.monotonic() + check_seconds
+        if _last_id is None:
+            # Nothing is cached yet, so earlier rows don't matter
+            _last_id = db.session.execute(select(func.max(_invalidations.c.id))).scalar() or 0
+            return
+        rows = db.session.execute(
+            select(_invalidations.c.id, _invalidations.c.user_id)
+            .where(_invalidations.c.id > _last_id - LOOKBACK)
+        ).all()
+        for row_id, user_id in rows:
+            if row_id not in _seen:
+                _seen.add(row_id)
+                invalidate_principal(user_id)
+            _last_id = max(_last_id, row_id)
+        _seen.difference_update([row_id for row_id in _seen if row_id <= _last_id - LOOKBACK])
+    finally:
+        _check_lock.release()
+
+
+def get_principal(user_id, ttl=300, check_seconds=2):
+    """Cached principal for user_id, None if the user does not exist"""
+    _drop_invalidated(check_seconds)
+    now = time.monotonic()
+    entry = _cache.get(user_id)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    principal = _build_principal(user_id)
+    with _lock:
+        if principal is None:
+            _cache.pop(user_id, None)
+        else:
+            _cache[user_id] = (now + ttl, principal)
+    return principal
+
+
+def invalidate_principal(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+# ==================== INVALIDATION HOOKS ====================
+# Changes are collected while the transaction is open, recorded for other
+# processes in it and applied locally after commit, so a concurrent request
+# cannot re-cache the old roles in between.
+
+def _mark_stale(session, user_id):
+    if user_id is not None:
+        session.info.setdefault('stale_principals', set()).add(user_id)
+
+
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _roles_changed(user, role, initiator):
+    session = object_session(user)
+    if session is not None:
+        _mark_stale(session, user.id)
+
+
+@event.listens_for(User.username, 'set')
+@event.listens_for(User.is_active, 'set')
+def _user_changed(user, value, oldvalue, initiator):
+    session = object_session(user)
+    if session is not None and value != oldvalue:
+        _mark_stale(session, user.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, user):
+    session = object_session(user)
+    if session is not None:
+        _mark_stale(session, user.id)
+
+
+@event.listens_for(Session, 'before_commit')
+def _record_invalidations(session):
+    if session.in_nested_transaction():
+        return
+    # Deletes are only seen once they are flushed
+    session.flush()
+    user_ids = session.info.get('stale_principals')
+    if user_ids:
+        session.execute(delete(_invalidations).where(
+            _invalidations.c.created_at < datetime.now() - KEEP_INVALIDATIONS
+        ))
+        session.execute(insert(_invalidations), [{'user_id': user_id} for user_id in sorted(user_ids)])
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.in_nested_transaction():
+        return
+    for user_id in session.info.pop('stale_principals', ()):
+        invalidate_principal(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('stale_principals', None)
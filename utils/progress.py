@@ -0,0 +1,108 @@
+"""
+Per-pump progress summary for list pages.
+
+pump_progress holds one row per pump: parts count, die & pattern items
+completed of total, other items completed and QC OK/rejected, the latest
+workflow action and a percent done. List views read it with one join
+instead of loading every pump's rows.
+
+refresh_pump_progress() recounts the given pumps with one aggregate query.
+bump_pump_versions() (utils/versioning.py) calls it for every pump whose
+data changed, in the same transaction, so every write path keeps it
+current: part saves and deletes, the grids, workflow saves, approve and
+reject.
+"""
+from sqlalchemy import delete, func, insert, select
+
+from models import DiePatternItem, OtherItem, Part, Pump, PumpProgress, TestingWorkflow
+
+_table = PumpProgress.__table__
+# Grid row columns the counts depend on; edits to other columns leave them as they are
+COUNTED_COLUMNS = ('status', 'qc_status')
+
+
+def _count(model, *where):
+    return (
+        select(func.count())
+        .where(model.pump_id == Pump.id, *where)
+        .correlate(Pump)
+        .scalar_subquery()
+    )
+
+
+def _last_workflow(column):
+    return (
+        select(column)
+        .where(TestingWorkflow.pump_id == Pump.id)
+        .order_by(TestingWorkflow.date.desc(), TestingWorkflow.id.desc())
+        .limit(1)
+        .correlate(Pump)
+        .scalar_subquery()
+    )
+
+
+def changes_counts(old, new):
+    """True if a grid row going from old to new (column dicts) changes its pump's counts"""
+    return old is None or any(
+        column in new and old.get(column) != new[column] for column in COUNTED_COLUMNS
+    )
+
+
+def percent_done(status, done, total):
+    """Share of die & pattern and other items completed; 100 once the pump is approved"""
+    if status == 'COMPLETED':
+        return 100
+    if not total:
+        return 0
+    return done * 100 // total
+
+
+def refresh_pump_progress(connection, pump_ids):
+    """Recount the progress rows of these pumps; deleted pumps lose theirs"""
+    pump_ids = sorted({pid for pid in pump_ids if pid is not None})
+    if not pump_ids:
+        return
+
+    rows = connection.execute(
+        select(
+            Pump.id.label('pump_id'),
+            Pump.status,
+            _count(Part).label('parts_count'),
+            _count(DiePatternItem).label('die_total'),
+            _count(DiePatternItem, DiePatternItem.status == 'COMPLETED').label('die_completed'),
+            _count(OtherItem).label('other_total'),
+            _count(OtherItem, OtherItem.status == 'COMPLETED').label('other_completed'),
+            _count(OtherItem, OtherItem.qc_status == 'OK').label('other_qc_ok'),
+            _count(OtherItem, OtherItem.qc_status == 'REJECTED').label('other_qc_rejected'),
+            _last_workflow(TestingWorkflow.action).label('last_action'),
+            _last_workflow(TestingWorkflow.date).label('last_action_date'),
+        ).where(Pump.id.in_(pump_ids))
+    ).mappings().all()
+
+    connection.execute(delete(_table).where(_table.c.pump_id.in_(pump_ids)))
+    if rows:
+        values = []
+        for row in rows:
+            row = dict(row)
+            status = row.pop('status')
+            row['percent_done'] = percent_done(
+                status,
+                row['die_completed'] + row['other_completed'],
+                row['die_total'] + row['other_total'],
+            )
+            values.append(row)
+        connection.execute(insert(_table), values)
+
+
+def rebuild_pump_progress(connection, batch_size=500):
+    """Recount every pump's progress row"""
+    connection.execute(delete(_table))
+    last_id = 0
+    while True:
+        pump_ids = connection.execute(
+            select(Pump.id).where(Pump.id > last_id).order_by(Pump.id).limit(batch_size)
+        ).scalars().all()
+        if not pump_ids:
+            return
+        refresh_pump_progress(connection, pump_ids)
+        last_id = pump_ids[-1]
@@ -0,0 +1,196 @@
+"""
+Pump search over an inverted index.
+
+search_terms holds one row per (term, pump, field): the folded words of
+pump names, part names, brands and materials, suppliers, specifications
+and the remarks on die items, other items and workflow rows. weight is the
+field's weight times how often the word occurs there. Words are
+casefolded and stripped of accents, so "Café" and "cafe" are one term and
+either spelling finds both.
+
+reindex_pumps() rebuilds the rows of the given pumps. Every change to a
+pump's data queues a refresh_derived job that calls it (see
+utils/versioning.py), so the index trails a save by a few seconds.
+
+search_pumps() matches every query word as a prefix of an indexed term.
+It ranks pumps by the summed weight of their matches, with exact word
+matches counting double, and pages through them with a keyset cursor.
+"""
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from sqlalchemy import and_, case, delete, desc, distinct, func, insert, literal, or_, select, union_all
+
+from models import DiePatternItem, OtherItem, Part, Pump, SearchTerm, TestingWorkflow
+from utils.pagination import decode_cursor, encode_cursor
+
+FIELD_WEIGHTS = {
+    'name': 10,
+    'part': 5,
+    'brand': 3,
+    'supplier': 3,
+    'material': 2,
+    'spec': 2,
+    'die_remark': 1,
+    'other_remark': 1,
+    'workflow_remark': 1,
+}
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+_TOKEN = re.compile(r'[^\W_]+')
+_table = SearchTerm.__table__
+
+
+def fold(text):
+    """Casefolded text with compatibility forms expanded and accents removed"""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    """Folded words of text; single letters are dropped, digits kept"""
+    if not text:
+        return []
+    return [
+        word[:MAX_TERM_LENGTH]
+        for word in _TOKEN.findall(fold(text))
+        if len(word) > 1 or word.isdigit()
+    ]
+
+
+def _sources(pump_ids):
+    """(pump_id, field, text) for everything indexed about these pumps"""
+    def source(column, field, pump_id):
+        return select(pump_id.label('pump_id'), literal(field).label('field'), column.label('text')).where(
+            pump_id.in_(pump_ids), column.isnot(None)
+        )
+
+    return union_all(
+        # Every existing pump yields its name row, even an empty one
+        select(Pump.id, literal('name'), Pump.name).where(Pump.id.in_(pump_ids)),
+        source(Part.part_name, 'part', Part.pump_id),
+        source(Part.brand, 'brand', Part.pump_id),
+        source(Part.material, 'material', Part.pump_id),
+        source(OtherItem.party_name, 'supplier', OtherItem.pump_id),
+        source(OtherItem.material_specification, 'spec', OtherItem.pump_id),
+        source(DiePatternItem.remark, 'die_remark', DiePatternItem.pump_id),
+        source(OtherItem.remark, 'other_remark', OtherItem.pump_id),
+        source(TestingWorkflow.remark, 'workflow_remark', TestingWorkflow.pump_id),
+    )
+
+
+def reindex_pumps(connection, pump_ids):
+    """Replace the index rows of these pumps; deleted pumps just lose theirs"""
+    pump_ids = sorted({pid for pid in pump_ids if pid is not None})
+    if not pump_ids:
+        return
+
+    weights = Counter()
+    existing = set()
+    for pump_id, field, text in connection.execute(_sources(pump_ids)):
+        if field == 'name':
+            existing.add(pump_id)
+        for term in tokenize(text):
+            weights[(term, pump_id, field)] += FIELD_WEIGHTS[field]
+    # Rows a deleted pump left behind (no cascade on SQLite) aren't indexed
+    weights = {key: weight for key, weight in weights.items() if key[1] in existing}
+
+    connection.execute(delete(_table).where(_table.c.pump_id.in_(pump_ids)))
+    if weights:
+        connection.execute(insert(_table), [
+            {'term': term, 'pump_id': pump_id, 'field': field, 'weight': weight}
+            for (term, pump_id, field), weight in weights.items()
+        ])
+
+
+def rebuild_search_index(connection, batch_size=500):
+    """Index every pump from scratch"""
+    connection.execute(delete(_table))
+    last_id = 0
+    while True:
+        pump_ids = connection.execute(
+            select(Pump.id).where(Pump.id > last_id).order_by(Pump.id).limit(batch_size)
+        ).scalars().all()
+        if not pump_ids:
+            return
+        reindex_pumps(connection, pump_ids)
+        last_id = pump_ids[-1]
+
+
+def _query_terms(q):
+    terms = list(dict.fromkeys(tokenize(q)))[:MAX_QUERY_TERMS]
+    # 'bol bolt' is the same search as 'bolt'; a word that only prefixes
+    # another would otherwise need its own match
+    return [t for t in terms if not any(o != t and o.startswith(t) for o in terms)]
+
+
+def search_pumps(session, q, fields, after=None, limit=25):
+    """
+    Pumps matching every word of q in the given fields, best first.
+    Returns (results, next_cursor); each result has the pump's id, name,
+    pump_type, status, deadline_date, score and matches ({field: [terms]}).
+    """
+    terms = _query_terms(q)
+    fields = [f for f in FIELD_WEIGHTS if f in fields]
+    if not terms or not fields:
+        return [], None
+
+    prefix_match = or_(*[_table.c.term.startswith(t, autoescape=True) for t in terms])
+    # Which query word each posting answers, to require all of them
+    word = case(*[(_table.c.term.startswith(t, autoescape=True), i) for i, t in enumerate(terms)])
+    exact = case((_table.c.term.in_(terms), 2), else_=1)
+    score = func.sum(_table.c.weight * exact)
+
+    stmt = (
+        select(_table.c.pump_id, score.label('score'))
+        .where(prefix_match, _table.c.field.in_(fields))
+        .group_by(_table.c.pump_id)
+        .having(func.count(distinct(word)) == len(terms))
+    )
+    cursor = decode_cursor(after)
+    if cursor and len(cursor) == 2:
+        last_score, last_id = cursor
+        stmt = stmt.having(or_(score < last_score, and_(score == last_score, _table.c.pump_id > last_id)))
+    ranked = session.execute(
+        stmt.order_by(desc('score'), _table.c.pump_id).limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(ranked) > limit:
+        ranked = ranked[:limit]
+        next_cursor = encode_cursor([ranked[-1].score, ranked[-1].pump_id])
+    if not ranked:
+        return [], None
+
+    pump_ids = [row.pump_id for row in ranked]
+    pumps = {
+        row.id: row for row in session.execute(
+            select(Pump.id, Pump.name, Pump.pump_type, Pump.status, Pump.deadline_date)
+            .where(Pump.id.in_(pump_ids))
+        )
+    }
+    matches = defaultdict(lambda: defaultdict(list))
+    for pump_id, field, term in session.execute(
+        select(_table.c.pump_id, _table.c.field, _table.c.term)
+        .where(_table.c.pump_id.in_(pump_ids), _table.c.field.in_(fields), prefix_match)
+        .order_by(_table.c.pump_id, _table.c.field, desc(_table.c.weight))
+    ):
+        matches[pump_id][field].append(term)
+
+    results = []
+    for row in ranked:
+        pump = pumps.get(row.pump_id)
+        if pump is None:
+            continue
+        results.append({
+            'id': pump.id,
+            'name': pump.name,
+            'pump_type': pump.pump_type,
+            'status': pump.status,
+            'deadline_date': pump.deadline_date,
+            'score': int(row.score),
+            'matches': {field: found for field, found in matches[row.pump_id].items()},
+        })
+    return results, next_cursor
@@ -0,0 +1,95 @@
+"""
+Frozen read-only pages of COMPLETED pumps.
+
+An approved pump can't be edited, yet every visit to its info, parts, die
+& pattern, other items or workflow page used to rerun their queries and
+render every input again. When a pump is approved, app.freeze_pump()
+renders those pages once, read-only, and store_snapshot() keeps them in
+pump_snapshots, zlib-compressed, one row per page. The read routes serve a
+page with one lookup; the navigation bar around it is still rendered per
+user. Rejecting the pump discards its snapshot.
+
+Only the content block of a page is frozen, rendered without flashed
+messages or anything about the current user. A page that differs per role
+is frozen once per variant (workflow and workflow_boss).
+
+Each row records pumps.version at freeze time, and load_snapshot() only
+returns rows whose version still matches a COMPLETED pump. If the pump's
+data is changed after all, its pages are rendered live again.
+"""
+import zlib
+from datetime import datetime
+
+from flask import current_app
+from markupsafe import Markup
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+
+from models import Pump, PumpSnapshot
+
+_table = PumpSnapshot.__table__
+_pumps = Pump.__table__
+
+
+def _no_flashes(with_categories=False, category_filter=()):
+    return []
+
+
+def render_content(template_name, **context):
+    """The content block of a page template, rendered on its own"""
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    context['get_flashed_messages'] = _no_flashes
+    return ''.join(template.blocks['content'](template.new_context(context)))
+
+
+def store_snapshot(session, pump_id, pages):
+    """Replace the pump's snapshot with pages ({page name: text})"""
+    session.flush()  # so pumps.version includes this transaction's changes
+    version = select(_pumps.c.version).where(_pumps.c.id == pump_id).scalar_subquery()
+    now = datetime.utcnow()
+    session.execute(delete(_table).where(_table.c.pump_id == pump_id))
+    session.execute(insert(_table).values(version=version), [
+        {'pump_id': pump_id, 'page': page, 'created_at': now,
+         'body': zlib.compress(text.encode('utf-8'), 6)}
+        for page, text in pages.items()
+    ])
+
+
+def discard_snapshot(session, pump_id):
+    session.execute(delete(_table).where(_table.c.pump_id == pump_id))
+
+
+def load_snapshot(session, pump_id, page):
+    """(text, pumps.version) of the frozen page, or None if there is no current one"""
+    row = session.execute(
+        select(_table.c.body, _table.c.version)
+        .join(_pumps, _pumps.c.id == _table.c.pump_id)
+        .where(
+            _table.c.pump_id == pump_id,
+            _table.c.page == page,
+            _table.c.version == _pumps.c.version,
+            _pumps.c.status == 'COMPLETED',
+        )
+    ).first()
+    if row is None:
+        return None
+    return zlib.decompress(row.body).decode('utf-8'), row.version
+
+
+def load_page(session, pump_id, page):
+    """The frozen page as markup for templates/snapshots/page.html, or None"""
+    snapshot = load_snapshot(session, pump_id, page)
+    return None if snapshot is None else Markup(snapshot[0])
+
+
+@event.listens_for(Session, 'after_flush')
+def _discard_for_new_and_deleted(session, flush_context):
+    # A deleted pump's id can come back on SQLite; its snapshot must not
+    pump_ids = {
+        obj.id for obj in list(session.new) + list(session.deleted)
+        if isinstance(obj, Pump)
+    }
+    if pump_ids:
+        session.connection().execute(delete(_table).where(_table.c.pump_id.in_(pump_ids)))
@@ -0,0 +1,223 @@
+"""
+Cycle times of the die & pattern stages.
+
+A die & pattern item moves through making pattern -> complete -> sent to
+foundry -> casting -> casting M/C -> M/C received; each stage runs from one
+date column to the next. Two small tables hold the materialized figures:
+
+- die_stage_durations: per pump and stage, how many items took N days.
+  Medians and p90s come from window functions over this histogram, for one
+  pump or summed across all pumps.
+- die_stage_open: per pump and stage, how many items entered the stage and
+  have not left it, and since when the oldest has been waiting.
+
+refresh_die_stages() recomputes the rows of the given pumps with two
+INSERT ... SELECT statements over die_pattern_items. It runs in the
+refresh_derived job that every change to a pump's rows queues (see
+utils/versioning.py), so the figures trail a save by a few seconds.
+"""
+from datetime import date
+
+from sqlalchemy import Integer, case, delete, func, insert, literal, select, union_all
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from models import DiePatternItem, DieStageDuration, DieStageOpen, Pump
+
+# (key, label, column the stage starts at, column it ends at)
+STAGES = (
+    ('pattern', 'Making pattern', 'making_pattern_date', 'complete_pattern_date'),
+    ('to_foundry', 'Pattern to foundry', 'complete_pattern_date', 'send_foundry_pattern_date'),
+    ('casting', 'Casting', 'send_foundry_pattern_date', 'casting_date'),
+    ('to_mc', 'Casting to M/C', 'casting_date', 'casting_mc_date'),
+    ('mc', 'M/C', 'casting_mc_date', 'mc_received_date'),
+)
+STAGE_LABELS = {key: label for key, label, _, _ in STAGES}
+
+_durations = DieStageDuration.__table__
+_open = DieStageOpen.__table__
+_items = DiePatternItem.__table__
+
+
+class days_between(FunctionElement):
+    """Whole days from start to end"""
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(days_between)
+def _days_between(element, compiler, **kw):
+    end, start = list(element.clauses)
+    return 'CAST(julianday(%s) - julianday(%s) AS INTEGER)' % (compiler.process(end, **kw),
+                                                               compiler.process(start, **kw))
+
+
+@compiles(days_between, 'mysql')
+def _days_between_mysql(element, compiler, **kw):
+    end, start = list(element.clauses)
+    return 'DATEDIFF(%s, %s)' % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+def _finished(pump_ids):
+    """(pump_id, stage, days) for every item that has left a stage"""
+    return union_all(*[
+        select(_items.c.pump_id, literal(key).label('stage'),
+               days_between(_items.c[end], _items.c[start]).label('days'))
+        .where(_items.c.pump_id.in_(pump_ids), _items.c[start].isnot(None),
+               _items.c[end].isnot(None), _items.c[end] >= _items.c[start])
+        for key, _, start, end in STAGES
+    ]).subquery()
+
+
+def _waiting(pump_ids):
+    """(pump_id, stage, since) for every item still in a stage"""
+    return union_all(*[
+        select(_items.c.pump_id, literal(key).label('stage'), _items.c[start].label('since'))
+        .where(_items.c.pump_id.in_(pump_ids), _items.c[start].isnot(None), _items.c[end].is_(None))
+        for key, _, start, end in STAGES
+    ]).subquery()
+
+
+def refresh_die_stages(connection, pump_ids):
+    """Recompute the stage rows of these pumps from their die & pattern items"""
+    pump_ids = sorted({pid for pid in pump_ids if pid is not None})
+    if not pump_ids:
+        return
+
+    finished = _finished(pump_ids)
+    connection.execute(delete(_durations).where(_durations.c.pump_id.in_(pump_ids)))
+    connection.execute(insert(_durations).from_select(
+        ['pump_id', 'stage', 'days', 'item_count'],
+        select(finished.c.pump_id, finished.c.stage, finished.c.days, func.count())
+        .group_by(finished.c.pump_id, finished.c.stage, finished.c.days)
+    ))
+
+    waiting = _waiting(pump_ids)
+    connection.execute(delete(_open).where(_open.c.pump_id.in_(pump_ids)))
+    connection.execute(insert(_open).from_select(
+        ['pump_id', 'stage', 'open_count', 'oldest_since'],
+        select(waiting.c.pump_id, waiting.c.stage, func.count(), func.min(waiting.c.since))
+        .group_by(waiting.c.pump_id, waiting.c.stage)
+    ))
+
+
+def rebuild_die_stages(connection, batch_size=500):
+    """Recompute the stage tables for every pump"""
+    connection.execute(delete(_durations))
+    connection.execute(delete(_open))
+    last_id = 0
+    while True:
+        pump_ids = connection.execute(
+            select(Pump.id).where(Pump.id > last_id).order_by(Pump.id).limit(batch_size)
+        ).scalars().all()
+        if not pump_ids:
+            return
+        refresh_die_stages(connection, pump_ids)
+        last_id = pump_ids[-1]
+
+
+def _percentiles(histogram, keys):
+    """
+    Item count, mean, median, p90 and max days per keys over a histogram
+    subquery with keys, days and n columns. Percentiles are nearest-rank:
+    the first days value whose running count reaches p% of the total.
+    """
+    partition = [histogram.c[k] for k in keys]
+    ranked = select(
+        *partition, histogram.c.days, histogram.c.n,
+        func.sum(histogram.c.n).over(partition_by=partition, order_by=histogram.c.days).label('running'),
+        func.sum(histogram.c.n).over(partition_by=partition).label('total'),
+    ).subquery()
+
+    def percentile(p):
+        return func.min(case((ranked.c.running * 100 >= ranked.c.total * p, ranked.c.days)))
+
+    by = [ranked.c[k] for k in keys]
+    return select(
+        *by,
+        func.sum(ranked.c.n).label('items'),
+        (func.sum(ranked.c.n * ranked.c.days) * 1.0 / func.sum(ranked.c.n)).label('mean'),
+        percentile(50).label('median'),
+        percentile(90).label('p90'),
+        func.max(ranked.c.days).label('max'),
+    ).group_by(*by)
+
+
+def _stage_row(key, stats, waiting, today):
+    row = {
+        'stage': key,
+        'label': STAGE_LABELS[key],
+        'items': 0, 'mean': None, 'median': None, 'p90': None, 'max': None,
+        'open': 0, 'oldest_open_days': None,
+    }
+    if stats is not None:
+        row.update(items=int(stats.items), mean=round(float(stats.mean), 1),
+                   median=stats.median, p90=stats.p90, max=stats.max)
+    if waiting is not None:
+        row.update(open=int(waiting.open_count), oldest_open_days=(today - waiting.oldest_since).days)
+    return row
+
+
+def _bottleneck(rows):
+    """The stage where most items wait, then the one with the slowest p90"""
+    candidates = [r for r in rows if r['open'] or r['items']]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda r: (r['open'], r['oldest_open_days'] or 0, r['p90'] or 0))['stage']
+
+
+def plant_stage_report(session):
+    """Stage figures across all pumps"""
+    histogram = (
+        select(_durations.c.stage, _durations.c.days, func.sum(_durations.c.item_count).label('n'))
+        .group_by(_durations.c.stage, _durations.c.days)
+        .subquery()
+    )
+    stats = {row.stage: row for row in session.execute(_percentiles(histogram, ['stage']))}
+    waiting = {
+        row.stage: row for row in session.execute(
+            select(_open.c.stage, func.sum(_open.c.open_count).label('open_count'),
+                   func.min(_open.c.oldest_since).label('oldest_since'))
+            .group_by(_open.c.stage)
+        )
+    }
+    today = date.today()
+    rows = [_stage_row(key, stats.get(key), waiting.get(key), today) for key, _, _, _ in STAGES]
+    return {'stages': rows, 'bottleneck': _bottleneck(rows)}
+
+
+def pump_stage_report(session, pump_ids):
+    """Stage figures per pump: {pump_id: {'stages': [...], 'bottleneck': key}}"""
+    pump_ids = list(pump_ids)
+    if not pump_ids:
+        return {}
+    histogram = (
+        select(_durations.c.pump_id, _durations.c.stage, _durations.c.days,
+               _durations.c.item_count.label('n'))
+        .where(_durations.c.pump_id.in_(pump_ids))
+        .subquery()
+    )
+    stats = {(row.pump_id, row.stage): row
+             for row in session.execute(_percentiles(histogram, ['pump_id', 'stage']))}
+    waiting = {(row.pump_id, row.stage): row
+               for row in session.execute(select(_open).where(_open.c.pump_id.in_(pump_ids)))}
+    today = date.today()
+    report = {}
+    for pump_id in pump_ids:
+        rows = [_stage_row(key, stats.get((pump_id, key)), waiting.get((pump_id, key)), today)
+                for key, _, _, _ in STAGES]
+        report[pump_id] = {'stages': rows, 'bottleneck': _bottleneck(rows)}
+    return report
+
+
+def stalled_pumps(session, limit=50):
+    """Ids of PENDING pumps with items waiting in a stage, longest wait first"""
+    oldest = func.min(_open.c.oldest_since)
+    return session.execute(
+        select(_open.c.pump_id)
+        .join(Pump.__table__, Pump.__table__.c.id == _open.c.pump_id)
+        .where(Pump.__table__.c.status == 'PENDING')
+        .group_by(_open.c.pump_id)
+        .order_by(oldest, _open.c.pump_id)
+        .limit(limit)
+    ).scalars().all()
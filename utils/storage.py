@@ -0,0 +1,271 @@
+"""
+Content-addressed storage for uploaded drawings.
+
+store_upload() streams an upload to a temporary file while hashing it and
+then moves it to <UPLOAD_FOLDER>/<aa>/<sha256><ext>. Identical files share
+one copy, and two different files with the same name no longer overwrite
+each other. Pump.drawing_path holds that storage key; Pump.drawing_name
+keeps the original file name for display.
+
+stored_files keeps a reference count per key. A flush hook turns every
+change of Pump.drawing_path (new pump, replaced drawing, deleted pump) into
++1/-1 deltas in the same transaction. After commit, a release_files job is
+queued for keys that lost a reference; the worker removes those that
+dropped to zero from the table and from disk, together with any files
+derived from them (utils/tasks.py).
+
+An upload can reuse a file that such a job is about to remove. So
+store_upload() takes a reference in the caller's transaction before it
+looks at the disk: the stored_files row stays locked until that
+transaction ends, and remove_unreferenced() reads the row FOR UPDATE. The
+flush hook counts the pump that takes the file against that reference; one
+that no pump took is given back at commit. Files stored by a transaction
+that rolls back are queued for removal too.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+from collections import Counter
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+from werkzeug.utils import secure_filename
+
+from models import Pump, StoredFile
+from utils.counters import increment
+from utils.jobs import enqueue
+
+CHUNK_SIZE = 64 * 1024
+DERIVED_FOLDER = 'derived'  # thumbnails and previews, see utils/thumbnails.py
+
+
+def _hashed_copy(stream, folder):
+    """Copy stream to a temp file in folder; returns (temp path, sha256 hex)"""
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                fh.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+
+def storage_key(sha256, filename):
+    """Key (path relative to UPLOAD_FOLDER) for content with this hash"""
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{sha256[:2]}/{sha256}{extension}'
+
+
+def _take_reference(session, key):
+    """+1 on key in session's transaction, held for the pump about to use it"""
+    increment(session.connection(), StoredFile.__table__, {'path': key}, 'ref_count', 1)
+    session.info.setdefault('pinned_files', Counter())[key] += 1
+    session.info.setdefault('stored_files', set()).add(key)
+
+
+def store_stream(stream, name, folder, session=None):
+    """
+    Save a binary stream by content hash; returns its storage key. With a
+    session, a reference to the key is taken in its transaction first.
+    """
+    os.makedirs(folder, exist_ok=True)
+    temp_path, sha256 = _hashed_copy(stream, folder)
+
+    key = storage_key(sha256, name)
+    final_path = os.path.join(folder, key)
+    try:
+        if session is not None:
+            _take_reference(session, key)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    if os.path.exists(final_path):
+        # Same content is already stored
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path)
+    return key
+
+
+def store_upload(file, folder, session):
+    """
+    Save a werkzeug FileStorage by content hash, referenced in session's
+    transaction. Returns (storage key, original file name).
+    """
+    name = secure_filename(file.filename) or 'drawing'
+    return store_stream(file.stream, name, folder, session), name
+
+
+def is_content_addressed(key):
+    """True for keys made by storage_key(); legacy uploads are plain names"""
+    folder, _, name = (key or '').partition('/')
+    stem = os.path.splitext(name)[0]
+    return len(folder) == 2 and len(stem) == 64 and stem.startswith(folder)
+
+
+def derived_path(folder, key, variant, extension='.jpg'):
+    """Where a file derived from stored content (e.g. a thumbnail) is cached"""
+    sha256 = etag_for(key)
+    return os.path.join(folder, DERIVED_FOLDER, sha256[:2], f'{sha256}-{variant}{extension}')
+
+
+def _remove_stored(folder, key):
+    paths = [os.path.join(folder, key)]
+    sha256 = etag_for(key)
+    paths += glob.glob(os.path.join(folder, DERIVED_FOLDER, sha256[:2], f'{sha256}-*'))
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def etag_for(key):
+    """The content hash doubles as a strong ETag"""
+    return os.path.splitext(key.rpartition('/')[2])[0] if is_content_addressed(key) else None
+
+
+# ==================== REFERENCE COUNTING ====================
+
+def _noop(target, value, oldvalue, initiator):
+    pass
+
+
+# Load the previous drawing when a new one is assigned, so the flush hook
+# knows which file lost a reference
+event.listen(Pump.drawing_path, 'set', _noop, active_history=True)
+
+
+def _path(pump, old):
+    history = inspect(pump).attrs.drawing_path.history
+    if old:
+        current = history.deleted or history.unchanged or (None,)
+    else:
+        current = history.added or history.unchanged or (None,)
+    return current[0] if is_content_addressed(current[0]) else None
+
+
+@event.listens_for(Session, 'before_flush')
+def _load_drawing_path(session, flush_context, instances):
+    # Expired attributes would have no history in after_flush
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Pump):
+            obj.drawing_path
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_file_refs(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Pump):
+            deltas[_path(obj, old=False)] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Pump) and session.is_modified(obj):
+            deltas[_path(obj, old=True)] -= 1
+            deltas[_path(obj, old=False)] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Pump):
+            deltas[_path(obj, old=True)] -= 1
+    deltas.pop(None, None)
+
+    # References taken by store_upload() already count for the pumps using them
+    pinned = session.info.get('pinned_files')
+    for key in list(pinned or ()):
+        used = min(pinned[key], max(deltas[key], 0))
+        deltas[key] -= used
+        pinned[key] -= used
+        if not pinned[key]:
+            del pinned[key]
+
+    if not any(deltas.values()):
+        return
+
+    connection = session.connection()
+    for key, delta in sorted(deltas.items()):
+        if delta:
+            increment(connection, StoredFile.__table__, {'path': key}, 'ref_count', delta)
+        if delta < 0:
+            session.info.setdefault('released_files', set()).add(key)
+
+
+def remove_unreferenced(connection, folder, keys):
+    """Delete the rows and files of keys that no pump references any more"""
+    table = StoredFile.__table__
+    removed = []
+    for key in sorted(keys):
+        # Locked until the caller commits, so an upload reusing the file waits
+        ref_count = connection.execute(
+            select(table.c.ref_count).where(table.c.path == key).with_for_update()
+        ).scalar()
+        if ref_count is not None and ref_count > 0:
+            continue
+        if ref_count is not None:
+            connection.execute(delete(table).where(table.c.path == key))
+        _remove_stored(folder, key)
+        removed.append(key)
+    return removed
+
+
+def _queue_release(session, keys):
+    # Removing files (and their thumbnails) is left to the job worker
+    with session.get_bind().begin() as connection:
+        enqueue(connection, 'release_files', {'keys': sorted(keys)})
+
+
+@event.listens_for(Session, 'before_commit')
+def _return_unused_references(session):
+    if session.in_nested_transaction() or not session.info.get('pinned_files'):
+        return
+    session.flush()
+    pinned = session.info.pop('pinned_files', None) or {}
+    connection = session.connection()
+    for key, count in sorted(pinned.items()):
+        increment(connection, StoredFile.__table__, {'path': key}, 'ref_count', -count)
+        session.info.setdefault('released_files', set()).add(key)
+
+
+@event.listens_for(Session, 'after_commit')
+def _queue_file_removal(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('stored_files', None)
+    released = session.info.pop('released_files', None)
+    if released:
+        _queue_release(session, released)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('released_files', None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _release_rolled_back_files(session, transaction):
+    # Also runs when the session is closed without a commit or rollback
+    if transaction.parent is not None or transaction.nested:
+        return
+    session.info.pop('pinned_files', None)
+    stored = session.info.pop('stored_files', None)
+    if stored:
+        _queue_release(session, stored)
+
+
+def rebuild_file_refs(connection):
+    """Recount stored_files from pumps.drawing_path"""
+    table = StoredFile.__table__
+    connection.execute(delete(table))
+    connection.execute(insert(table).from_select(
+        ['path', 'ref_count'],
+        select(Pump.drawing_path, func.count())
+        .where(Pump.drawing_path.like('__/%'))
+        .group_by(Pump.drawing_path)
+    ))
@@ -0,0 +1,155 @@
+"""
+Dashboard counters maintained alongside Pump writes.
+
+pump_status_counts holds the number of pumps per (status, pump_type) and
+pump_deadline_counts the number of PENDING pumps per deadline date. A flush
+hook turns every insert, delete or status/type/deadline change of a Pump
+into +1/-1 deltas applied in the same transaction, so the counters commit
+(or roll back) together with the change itself.
+
+get_dashboard_summary() reads only these small tables. Bulk loads that
+bypass the ORM should call rebuild_pump_summary() afterwards.
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import case, delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Pump, PumpDeadlineCount, PumpStatusCount
+from utils.counters import increment
+
+TRACKED = ('status', 'pump_type', 'deadline_date')
+
+
+def _noop(target, value, oldvalue, initiator):
+    pass
+
+
+# Load the previous value when one of these is assigned, so the flush hook
+# can always tell which counters the pump is leaving
+for _attr in TRACKED:
+    event.listen(getattr(Pump, _attr), 'set', _noop, active_history=True)
+
+
+def _values(pump, old):
+    state = inspect(pump)
+    values = []
+    for attr in TRACKED:
+        history = state.attrs[attr].history
+        if old:
+            current = history.deleted or history.unchanged or (None,)
+        else:
+            current = history.added or history.unchanged or (None,)
+        values.append(current[0])
+    return tuple(values)
+
+
+def _contributions(values):
+    """Counter keys a pump with (status, pump_type, deadline) counts towards"""
+    status, pump_type, deadline = values
+    keys = [('status', status or '', pump_type or '')]
+    if status == 'PENDING' and deadline is not None:
+        keys.append(('deadline', deadline))
+    return keys
+
+
+@event.listens_for(Session, 'before_flush')
+def _load_tracked(session, flush_context, instances):
+    # Expired attributes would have no history in after_flush
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Pump):
+            for attr in TRACKED:
+                getattr(obj, attr)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_pump_deltas(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Pump):
+            for key in _contributions(_values(obj, old=False)):
+                deltas[key] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Pump) and session.is_modified(obj):
+            old, new = _values(obj, old=True), _values(obj, old=False)
+            if old != new:
+                for key in _contributions(old):
+                    deltas[key] -= 1
+                for key in _contributions(new):
+                    deltas[key] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Pump):
+            for key in _contributions(_values(obj, old=True)):
+                deltas[key] -= 1
+
+    if not any(deltas.values()):
+        return
+
+    connection = session.connection()
+    for key, delta in sorted(deltas.items(), key=str):
+        if not delta:
+            continue
+        if key[0] == 'status':
+            increment(connection, PumpStatusCount.__table__,
+                      {'status': key[1], 'pump_type': key[2]}, 'pump_count', delta)
+        else:
+            increment(connection, PumpDeadlineCount.__table__,
+                      {'deadline_date': key[1]}, 'pending_count', delta)
+
+
+def rebuild_pump_summary(connection):
+    """Recount both summary tables from the pumps table"""
+    status = func.coalesce(Pump.status, '')
+    pump_type = func.coalesce(Pump.pump_type, '')
+    connection.execute(delete(PumpStatusCount.__table__))
+    connection.execute(insert(PumpStatusCount.__table__).from_select(
+        ['status', 'pump_type', 'pump_count'],
+        select(status, pump_type, func.count()).group_by(status, pump_type)
+    ))
+
+    connection.execute(delete(PumpDeadlineCount.__table__))
+    connection.execute(insert(PumpDeadlineCount.__table__).from_select(
+        ['deadline_date', 'pending_count'],
+        select(Pump.deadline_date, func.count())
+        .where(Pump.status == 'PENDING', Pump.deadline_date.isnot(None))
+        .group_by(Pump.deadline_date)
+    ))
+
+
+def get_dashboard_summary(today=None, pump_type=None):
+    """
+    Counts by status and by pump type, plus PENDING pumps that are overdue
+    or due by the end of this week / month. Status counts are limited to
+    pump_type when given.
+    """
+    today = today or date.today()
+    week_end = today + timedelta(days=6 - today.weekday())
+    month_end = (today.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+    by_status = Counter()
+    by_type = Counter()
+    for status, type_, count in db.session.query(
+        PumpStatusCount.status, PumpStatusCount.pump_type, PumpStatusCount.pump_count
+    ).filter(PumpStatusCount.pump_count != 0):
+        by_type[type_ or 'UNSET'] += count
+        if not pump_type or type_ == pump_type:
+            by_status[status or 'UNSET'] += count
+
+    c = PumpDeadlineCount
+    overdue, due_week, due_month = db.session.query(
+        func.sum(case((c.deadline_date < today, c.pending_count), else_=0)),
+        func.sum(case((c.deadline_date.between(today, week_end), c.pending_count), else_=0)),
+        func.sum(case((c.deadline_date.between(today, month_end), c.pending_count), else_=0)),
+    ).filter(c.deadline_date <= max(week_end, month_end)).one()
+
+    return {
+        'total': sum(by_type.values()),
+        'by_status': dict(by_status),
+        'by_type': dict(by_type),
+        'overdue': int(overdue or 0),
+        'due_this_week': int(due_week or 0),
+        'due_this_month': int(due_month or 0),
+        'as_of': today,
+    }
@@ -0,0 +1,121 @@
+"""
+Job handlers run by the worker (`flask run-worker`, see utils/jobs.py).
+
+Each runs inside an app context with its own DB session. Handlers that can
+be retried are written so that running them twice does no harm.
+"""
+import glob
+import os
+import time
+import uuid
+
+from flask import current_app
+
+from extensions import db
+from models import Pump
+from utils.events import publish
+from utils.export import iter_export_rows, stream_csv, stream_xlsx
+from utils.jobs import current_job, handler
+from utils.parts_import import ImportFileError, import_parts
+from utils.storage import remove_unreferenced
+from utils.validators import parse_ddmmyyyy
+from utils.versioning import refresh_pending
+
+
+@handler('delete_pump')
+def delete_pump(payload):
+    """Delete a pump with all its rows (the database cascades)"""
+    pump = db.session.get(Pump, payload['pump_id'])
+    if pump is None:
+        return {'deleted': False}
+    deleted = {'name': pump.name, 'pump_type': pump.pump_type, 'status': pump.status}
+    db.session.delete(pump)
+    db.session.commit()
+    publish(db.session, 'pump.deleted', payload['pump_id'], logger=current_app.logger,
+            by=payload.get('by'), **deleted)
+    return {'deleted': True, **deleted}
+
+
+@handler('refresh_derived')
+def refresh_derived(payload):
+    """Rebuild a pump's search terms and die stage rows after its data changed"""
+    with db.engine.begin() as connection:
+        refresh_pending(connection, payload['pump_id'])
+    return {'pump_id': payload['pump_id']}
+
+
+@handler('release_files')
+def release_files(payload):
+    """Remove stored drawings (and their thumbnails) no pump references"""
+    with db.engine.begin() as connection:
+        removed = remove_unreferenced(connection, current_app.config['UPLOAD_FOLDER'], payload['keys'])
+    return {'removed': removed}
+
+
+def _prune(folder, hours):
+    cutoff = time.time() - hours * 3600
+    for path in glob.glob(os.path.join(folder, '*')):
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+
+@handler('export_pumps')
+def export_pumps(payload):
+    """Write the pump export to EXPORT_FOLDER; the page downloads it when done"""
+    folder = current_app.config['EXPORT_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    _prune(folder, current_app.config['EXPORT_RETENTION_HOURS'])
+
+    filters = dict(payload['filters'])
+    for key in ('from', 'to'):
+        filters[key] = parse_ddmmyyyy(filters.get(key))
+
+    export_format = payload['format']
+    name = f'{uuid.uuid4().hex}.{export_format}'
+    path = os.path.join(folder, name)
+    rows = iter_export_rows(filters)
+    try:
+        if export_format == 'xlsx':
+            with open(path, 'wb') as fh:
+                for chunk in stream_xlsx(rows):
+                    fh.write(chunk)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as fh:
+                for chunk in stream_csv(rows):
+                    fh.write(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return {'file': name, 'filename': payload['filename']}
+
+
+@handler('import_parts')
+def import_parts_file(payload):
+    """
+    Import an uploaded parts file saved by /api/parts/import. The rows go
+    in with one transaction, so a failed attempt inserts nothing and the
+    next one starts over; the file is kept until then.
+    """
+    path = payload['path']
+    job = current_job()
+    try:
+        with open(path, 'rb') as fh:
+            result = import_parts(fh, payload['filename'], current_app.config['IMPORT_REPORT_FOLDER'],
+                                  default_pump_id=payload.get('pump_id'))
+    except ImportFileError as e:
+        # A bad file fails the same way every time; report it instead of retrying
+        os.remove(path)
+        return {'error': str(e)}
+    except Exception:
+        if job is None or job.attempts >= job.max_attempts:
+            os.remove(path)
+        raise
+    os.remove(path)
+    return {
+        'rows': result['rows'],
+        'inserted': result['inserted'],
+        'rejected': len(result['rejected']),
+        'errors': [{'row': r['row'], 'errors': r['errors']} for r in result['rejected'][:100]],
+        'report': result['report'],
+    }
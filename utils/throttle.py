@@ -0,0 +1,83 @@
+"""
+Login throttling with in-memory token buckets.
+
+Every login attempt takes one token from the bucket of the username and
+one from the bucket of the client IP; buckets refill at a steady rate up
+to their burst size. An attempt that finds either bucket empty is refused
+before the user is loaded or any password is hashed, so a script
+hammering /login costs a dictionary lookup per request. A successful login
+refills the user's bucket.
+
+The IP limit is the looser one: a whole shift may log in from behind the
+same plant router. Buckets live in each worker process, so with N workers
+a client gets up to N times the configured rate. Behind a reverse proxy,
+set PROXY_COUNT so request.remote_addr is the client, not the proxy.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """burst tokens per key, refilled at per_minute tokens a minute"""
+
+    def __init__(self, burst, per_minute, max_keys=10000):
+        self.burst = burst
+        self.per_minute = per_minute
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Take a token; returns 0 if there was one, else seconds until there is"""
+        now = time.monotonic()
+        rate = self.per_minute / 60.0
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                self.rejected += 1
+                wait = math.ceil((1 - tokens) / rate) if rate else 60
+            self._buckets[key] = (tokens, now)
+            # Least recently seen keys go first; they come back with a full bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginThrottle:
+    """Per-username and per-IP buckets for /login"""
+
+    def __init__(self):
+        self.users = TokenBucketLimiter(burst=5, per_minute=5)
+        self.ips = TokenBucketLimiter(burst=60, per_minute=120)
+
+    def check(self, username, ip):
+        """Seconds the caller must wait before trying again; 0 lets the attempt through"""
+        return max(self.ips.take(ip or '-'), self.users.take((username or '').strip().lower()))
+
+    def succeeded(self, username):
+        self.users.reset((username or '').strip().lower())
+
+
+login_throttle = LoginThrottle()
+
+
+def init_login_throttle(app):
+    """Read the bucket sizes and refill rates from the config"""
+    login_throttle.users.burst = app.config.setdefault('LOGIN_USER_BURST', 5)
+    login_throttle.users.per_minute = app.config.setdefault('LOGIN_USER_PER_MINUTE', 5)
+    login_throttle.ips.burst = app.config.setdefault('LOGIN_IP_BURST', 60)
+    login_throttle.ips.per_minute = app.config.setdefault('LOGIN_IP_PER_MINUTE', 120)
@@ -0,0 +1,144 @@
+"""
+Thumbnails and low-resolution previews of uploaded drawings.
+
+schedule_thumbnails() hands the work to a small per-process thread pool,
+so the upload request returns without waiting for image work. Output is
+cached next to the stored file under a name derived from its content hash
+(see storage.derived_path), which makes generation idempotent: a file that
+already has its variants is skipped, the same content is never rendered
+twice, and nothing needs invalidating when a pump switches drawings.
+
+Images need Pillow. PDFs are rendered from their first page with
+pypdfium2, which ships PDFium in its wheel, so no system package is
+needed. PDFium is not thread-safe; _pdf_lock keeps one PDF render at a
+time per process. When a library is missing, drawings simply have no
+thumbnail.
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.storage import derived_path, is_content_addressed
+
+VARIANTS = {
+    'thumb': (160, 160),
+    'preview': (1024, 1024),
+}
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+PDF_EXTENSIONS = {'.pdf'}
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+_pdf_lock = threading.Lock()
+PDF_DPI = 100  # first page resolution, enough for the preview
+
+
+def _pool(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        return _executor
+
+
+def can_render(key):
+    """True if a thumbnail can be made for this stored file"""
+    if not is_content_addressed(key):
+        return False
+    extension = os.path.splitext(key)[1].lower()
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    if extension in PDF_EXTENSIONS:
+        try:
+            import pypdfium2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+    return extension in IMAGE_EXTENSIONS
+
+
+def thumbnail_path(folder, key, variant):
+    return derived_path(folder, key, variant)
+
+
+def is_ready(folder, key):
+    return all(os.path.exists(thumbnail_path(folder, key, v)) for v in VARIANTS)
+
+
+def _open_image(source):
+    from PIL import Image
+
+    if os.path.splitext(source)[1].lower() in PDF_EXTENSIONS:
+        import pypdfium2
+
+        with _pdf_lock:
+            pdf = pypdfium2.PdfDocument(source)
+            try:
+                # PDF user space is 72 units per inch
+                return pdf[0].render(scale=PDF_DPI / 72).to_pil()
+            finally:
+                pdf.close()
+    image = Image.open(source)
+    image.seek(0)
+    return image
+
+
+def _save(image, path):
+    """Write atomically so readers never see a half-written file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.thumb-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            image.save(fh, 'JPEG', quality=80, optimize=True)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def render(folder, key):
+    """Build every missing variant of one stored file"""
+    from PIL import Image
+
+    missing = {v: size for v, size in VARIANTS.items()
+               if not os.path.exists(thumbnail_path(folder, key, v))}
+    if not missing:
+        return
+
+    with _open_image(os.path.join(folder, key)) as image:
+        image = image.convert('RGB')
+        # Largest first, so each smaller variant is scaled from a smaller image
+        for variant, size in sorted(missing.items(), key=lambda item: -item[1][0]):
+            image.thumbnail(size, Image.Resampling.LANCZOS)
+            _save(image, thumbnail_path(folder, key, variant))
+
+
+def _run(folder, key, logger):
+    try:
+        render(folder, key)
+    except Exception:
+        if logger is not None:
+            logger.exception('Thumbnail generation failed for %s', key)
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(key)
+
+
+def schedule_thumbnails(folder, key, workers=2, logger=None):
+    """
+    Queue thumbnail/preview generation for a stored file. Returns False when
+    nothing was queued (not renderable, already cached or already queued).
+    """
+    if not key or not can_render(key) or is_ready(folder, key):
+        return False
+    with _in_flight_lock:
+        if key in _in_flight:
+            return False
+        _in_flight.add(key)
+    _pool(workers).submit(_run, folder, key, logger)
+    return True
@@ -1,8 +1,42 @@
 import re
+from datetime import date, datetime
 
 DATE_REGEX = re.compile(r'^(0[1-9]|[12][0-9]|3[01])/(0[1-9]|1[0-2])/\d{4}$')
+DATE_FORMAT = '%d/%m/%Y'
 
 def is_valid_ddmmyyyy(date_str):
     if not date_str:
         return True  # allow empty
-    return bool(DATE_REGEX.match(date_str))
+    if not DATE_REGEX.match(date_str):
+        return False
+    try:
+        datetime.strptime(date_str, DATE_FORMAT)  # rejects 31/02/2024 etc.
+    except ValueError:
+        return False
+    return True
+
+
+def parse_ddmmyyyy(date_str):
+    """
+    Convert a DD/MM/YYYY string from a form or JSON body to a date.
+    Empty values become None; invalid ones raise ValueError.
+    """
+    if isinstance(date_str, datetime):
+        return date_str.date()
+    if isinstance(date_str, date):
+        return date_str
+    date_str = (date_str or '').strip()
+    if not date_str:
+        return None
+    if not is_valid_ddmmyyyy(date_str):
+        raise ValueError(f'Invalid date: {date_str}. Use DD/MM/YYYY')
+    return datetime.strptime(date_str, DATE_FORMAT).date()
+
+
+def format_ddmmyyyy(value):
+    """Convert a date column value to DD/MM/YYYY for templates and JSON"""
+    if not value:
+        return ''
+    if isinstance(value, str):
+        return value
+    return value.strftime(DATE_FORMAT)
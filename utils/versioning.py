@@ -0,0 +1,121 @@
+"""
+Per-pump data version for the read API's ETags.
+
+pumps.version goes up by one whenever the pump or any of its parts, die &
+pattern items, other items or workflow rows change. ORM changes are picked
+up by a flush hook; code that writes these tables with Core statements
+(utils/grid.py, utils/parts_import.py) calls bump_pump_versions() itself.
+
+The same calls keep what is derived from a pump's rows current. The
+progress summary (utils/progress.py) is recounted in the same transaction,
+since list pages and the manufacturing board show it right after a save.
+The search index (utils/search.py) and the die & pattern stage tables
+(utils/stages.py) are rebuilt per pump, which costs far more than a
+one-cell edit; queue_refresh() leaves them to a refresh_derived job
+instead. The pump gets a pending_refreshes row and one job, run
+REFRESH_DELAY_SECONDS later; saves made in between find the row and queue
+nothing, so a burst of edits to one pump is refreshed once.
+"""
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+from models import DiePatternItem, OtherItem, Part, PendingRefresh, Pump, TestingWorkflow
+from utils.jobs import enqueue
+from utils.progress import refresh_pump_progress
+from utils.search import reindex_pumps
+from utils.stages import refresh_die_stages
+
+CHILDREN = (Part, DiePatternItem, OtherItem, TestingWorkflow)
+REFRESH_DELAY_SECONDS = 2
+
+_pending = PendingRefresh.__table__
+
+
+def bump_pump_versions(connection, pump_ids, progress=True):
+    """
+    Increment pumps.version for every id in pump_ids and refresh what is
+    derived from them. progress=False skips the progress recount, for
+    writes that changed none of the columns it counts.
+    """
+    pump_ids = sorted({pid for pid in pump_ids if pid is not None})
+    if pump_ids:
+        connection.execute(
+            update(Pump.__table__)
+            .where(Pump.__table__.c.id.in_(pump_ids))
+            .values(version=Pump.__table__.c.version + 1)
+        )
+        _refresh_derived(connection, pump_ids, progress)
+
+
+def _refresh_derived(connection, pump_ids, progress=True):
+    if progress:
+        refresh_pump_progress(connection, pump_ids)
+    queue_refresh(connection, pump_ids)
+
+
+def _mark_pending(connection, pump_id):
+    """Add the pump's pending_refreshes row; False if it was already there"""
+    values = {'pump_id': pump_id}
+    dialect = connection.dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(_pending).values(values).prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(_pending).values(values).on_conflict_do_nothing()
+    else:
+        if connection.execute(select(_pending.c.pump_id).where(_pending.c.pump_id == pump_id)).first():
+            return False
+        stmt = insert(_pending).values(values)
+    return connection.execute(stmt).rowcount > 0
+
+
+def queue_refresh(connection, pump_ids):
+    """Have the job worker rebuild these pumps' search terms and die stage rows"""
+    for pump_id in sorted({pid for pid in pump_ids if pid is not None}):
+        if _mark_pending(connection, pump_id):
+            enqueue(connection, 'refresh_derived', {'pump_id': pump_id},
+                    delay_seconds=REFRESH_DELAY_SECONDS)
+
+
+def refresh_pending(connection, pump_id):
+    """
+    Rebuild what queue_refresh() left for the job. The pending row goes
+    first, in the same transaction: a save that commits after this read
+    its rows finds no row and queues the pump again.
+    """
+    connection.execute(delete(_pending).where(_pending.c.pump_id == pump_id))
+    reindex_pumps(connection, [pump_id])
+    refresh_die_stages(connection, [pump_id])
+
+
+@event.listens_for(Session, 'before_flush')
+def _load_pump_ids(session, flush_context, instances):
+    # Deleted rows can no longer be refreshed once the flush has run
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, CHILDREN):
+            obj.pump_id
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_pumps(session, flush_context):
+    pump_ids = set()
+    # New pumps start at version 1 and deleted ones need no version, but
+    # both still change the search index and progress rows
+    refresh_only = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, CHILDREN):
+            if obj in session.dirty and not session.is_modified(obj):
+                continue
+            pump_ids.add(obj.pump_id)
+        elif isinstance(obj, Pump):
+            if obj in session.dirty:
+                if session.is_modified(obj):
+                    pump_ids.add(obj.id)
+            else:
+                refresh_only.add(obj.id)
+
+    if pump_ids:
+        bump_pump_versions(session.connection(), pump_ids)
+    refresh_only -= pump_ids
+    if refresh_only:
+        _refresh_derived(session.connection(), refresh_only)
@@ -0,0 +1,140 @@
+"""
+The testing workflow as a state machine.
+
+pumps.workflow_stage says where a pump is in its workflow:
+
+    NEW --Assembly--> ASSEMBLED --Testing--> IN_TESTING --Final Approved--> APPROVED
+                                              |      ^                          |
+                                              +------+                          |
+                          Assembly, Testing, Testing Report Date                |
+                                              ^                                 |
+                                              +--------Rejected by Boss---------+
+
+A pending pump can be approved from any stage. The pump's status follows
+its stage: APPROVED is COMPLETED, every other stage is PENDING.
+
+Every action is one testing_workflow row. append_actions() checks the new
+rows against TRANSITIONS using the stored stage alone, instead of counting
+the pump's rows, then adds them and moves the stage in the same
+transaction. The pump row is read FOR UPDATE, so on MySQL a concurrent
+save waits for this one and then sees its stage. SQLite has no row locks;
+there the stage is only moved if it still is the stage that was read, and
+the save that loses the race gets a WorkflowError with status 409.
+"""
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import Pump, TestingWorkflow
+from utils.audit import record_update
+
+# stage -> {action: next stage}
+TRANSITIONS = {
+    'NEW': {'Assembly': 'ASSEMBLED', 'Final Approved': 'APPROVED'},
+    'ASSEMBLED': {'Testing': 'IN_TESTING', 'Final Approved': 'APPROVED'},
+    'IN_TESTING': {
+        'Assembly': 'IN_TESTING',
+        'Testing': 'IN_TESTING',
+        'Testing Report Date': 'IN_TESTING',
+        'Final Approved': 'APPROVED',
+    },
+    'APPROVED': {'Rejected by Boss': 'IN_TESTING'},
+}
+# Why an action is refused: approve and reject by action, the rest by stage
+ACTION_REFUSALS = {
+    'Final Approved': ('Pump is not in pending state.', 400),
+    'Rejected by Boss': ('Can only reject approved pumps', 400),
+}
+STAGE_REFUSALS = {
+    'NEW': ('First action must be Assembly', 400),
+    'ASSEMBLED': ('Second action must be Testing', 400),
+    'APPROVED': ('Invalid pump status', 403),
+}
+# Actions entered on the workflow form; approve and reject have their own routes
+FORM_ACTIONS = ('Assembly', 'Testing', 'Testing Report Date')
+
+
+class WorkflowError(Exception):
+    """An action the pump's stage does not allow; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def status_for(stage):
+    return 'COMPLETED' if stage == 'APPROVED' else 'PENDING'
+
+
+def next_stage(stage, action):
+    """The stage after action, or WorkflowError if stage doesn't allow it"""
+    if action in TRANSITIONS.get(stage, {}):
+        return TRANSITIONS[stage][action]
+    message, status = ACTION_REFUSALS.get(action) or STAGE_REFUSALS.get(stage) or (f'Invalid action: {action}', 400)
+    raise WorkflowError(message, status)
+
+
+def append_actions(session, pump, rows, user_id):
+    """
+    Add workflow rows ({'action', 'date', 'remark'}) to pump and move its
+    stage and status. Raises WorkflowError, leaving the session untouched,
+    if an action isn't allowed or another save moved the stage first.
+    The caller commits.
+    """
+    # Lock the row and refresh pump with what is stored now
+    pump = session.get(Pump, pump.id, with_for_update=True, populate_existing=True)
+    if pump is None:
+        raise WorkflowError('Pump not found', 404)
+
+    stage = pump.workflow_stage
+    new_stage = stage
+    for row in rows:
+        new_stage = next_stage(new_stage, row['action'])
+
+    # Also when the stage stays the same: the rows must not land after a
+    # concurrent approve
+    moved = session.execute(
+        update(Pump.__table__)
+        .where(Pump.__table__.c.id == pump.id, Pump.__table__.c.workflow_stage == stage)
+        .values(workflow_stage=new_stage)
+    ).rowcount
+    if not moved:
+        raise WorkflowError('The workflow was changed by someone else. Reload and try again', 409)
+    set_committed_value(pump, 'workflow_stage', new_stage)
+    record_update(session, Pump, pump.id, pump.id, {'workflow_stage': stage}, {'workflow_stage': new_stage})
+
+    # Through the ORM, so the dashboard counters and the change history see it
+    if pump.status != status_for(new_stage):
+        pump.status = status_for(new_stage)
+    session.add_all([
+        TestingWorkflow(
+            pump_id=pump.id,
+            date=row['date'],
+            user_id=user_id,
+            action=row['action'],
+            remark=row.get('remark'),
+        )
+        for row in rows
+    ])
+    return pump
+
+
+def _stage_from_rows():
+    """workflow_stage as the old row-count rules would have it"""
+    rows = (
+        select(func.count())
+        .where(TestingWorkflow.pump_id == Pump.id)
+        .correlate(Pump)
+        .scalar_subquery()
+    )
+    return case(
+        (Pump.status == 'COMPLETED', 'APPROVED'),
+        (rows == 0, 'NEW'),
+        (rows == 1, 'ASSEMBLED'),
+        else_='IN_TESTING',
+    )
+
+
+def rebuild_workflow_stages(connection):
+    """Set every pump's workflow_stage from its status and workflow rows"""
+    connection.execute(update(Pump.__table__).values(workflow_stage=_stage_from_rows()))